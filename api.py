@@ -0,0 +1,325 @@
+"""
+HTTP API serving the RAG pipeline to the Streamlit UI and other tools.
+
+Usage:
+    python api.py                # serves on API_HOST:API_PORT
+    uvicorn api:app --workers 1  # the index is loaded once per worker process
+
+Endpoints:
+    POST /chat                 stream an answer as server-sent events
+    POST /retrieve             retrieved chunks only, no LLM call
+    POST /ingest?file_name=..  queue a document (raw request body) for indexing;
+                               optional session_id and profile=1 query parameters
+    GET  /ingest/{job_id}      progress of an ingestion job
+    GET  /filters/{field}      indexed values of a metadata filter field
+    GET  /index                live index version and rebuild status
+    POST /index/rebuild        build a new index version in the background, optional
+                               reason and profile=1 query parameters
+    POST /index/rollback       switch back to the previous index version
+    GET  /health               liveness and readiness
+    GET  /metrics              request metrics in the Prometheus text format
+"""
+import json
+import asyncio
+import contextlib
+from starlette.applications import Starlette
+from starlette.concurrency import iterate_in_threadpool, run_in_threadpool
+from starlette.responses import JSONResponse, StreamingResponse, PlainTextResponse
+from starlette.routing import Route
+from config import API_HOST, API_PORT, SUPPORTED_FILE_TYPES, INDEX_AUTO_REBUILD
+from ingestion import IngestionQueue, UploadedBytes
+from index_manager import IndexManager
+from metrics import RequestMetrics, registry
+from bm25_index import FILTER_FIELDS
+from tracing import remote_parent, start_span, trace, use_span
+
+
+def sse_event(event, data):
+    """Format one server-sent event with a JSON payload."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def document_to_dict(doc):
+    """Retrieved chunk as JSON-serializable values."""
+    return {"id": getattr(doc, "id", None), "page_content": doc.page_content, "metadata": doc.metadata}
+
+
+async def read_json(request):
+    """Parse a JSON request body, raising ValueError on anything else."""
+    try:
+        body = await request.json()
+    except Exception:
+        raise ValueError("request body must be JSON")
+    if not isinstance(body, dict) or not str(body.get("query", "")).strip():
+        raise ValueError("'query' is required")
+    return body
+
+
+def read_filters(body):
+    """
+    Validate the metadata filters of a request body.
+
+    Returns:
+        dict: Field name to a value or a list of accepted values, or None
+
+    Raises:
+        ValueError: If the filters are not such a mapping over FILTER_FIELDS
+    """
+    filters = body.get("filters")
+    if not filters:
+        return None
+    if not isinstance(filters, dict):
+        raise ValueError("'filters' must be an object mapping fields to values")
+    for field, accepted in filters.items():
+        if field not in FILTER_FIELDS:
+            raise ValueError(f"unknown filter field '{field}', expected one of: {', '.join(FILTER_FIELDS)}")
+        values = accepted if isinstance(accepted, list) else [accepted]
+        if not values or not all(isinstance(value, str) for value in values):
+            raise ValueError(f"filter '{field}' must be a string or a non-empty list of strings")
+    return filters
+
+
+def _in_span(span, iterator):
+    """Advance an iterator with a span active, without keeping it active between items."""
+    iterator = iter(iterator)
+    while True:
+        with use_span(span):
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
+
+
+async def chat(request):
+    """
+    Answer a query, streaming the response as server-sent events.
+
+    The JSON body holds query and optionally session_id, report_mode,
+    premium_model, filters and profile. Each piece of the answer is sent as a
+    'chunk' event with {"text": ...}, followed by a 'done' event.
+    """
+    from chatbot import get_bot_response
+
+    try:
+        body = await read_json(request)
+        filters = read_filters(body)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+
+    # The live retriever is taken once, so an index swap mid-answer does not affect it
+    retriever = request.app.state.index_manager.current()
+    session_id = str(body.get("session_id", "default"))
+    # Continues the caller's trace when it sent a traceparent header
+    span = start_span("api.chat", parent=remote_parent(request.headers),
+                      session_id=session_id)
+    response_stream = get_bot_response(
+        body["query"],
+        retriever,
+        bool(body.get("report_mode", False)),
+        bool(body.get("premium_model", True)),
+        session_id,
+        filters=filters,
+        profile=bool(body.get("profile", False))
+    )
+
+    async def events():
+        try:
+            # The LLM client blocks, so the generator is advanced on worker threads;
+            # each step runs with api.chat active so get_bot_response nests under it
+            async for text in iterate_in_threadpool(_in_span(span, response_stream)):
+                yield sse_event("chunk", {"text": text})
+            yield sse_event("done", {})
+        except Exception as e:
+            print(f"Error streaming response: {str(e)}")
+            span.record_exception(e)
+            yield sse_event("error", {"message": str(e)})
+        finally:
+            # Runs on client disconnect too, so the LLM stream and its metrics are closed
+            try:
+                response_stream.close()
+            except ValueError:
+                # Still advancing on a worker thread; it is closed when garbage collected
+                pass
+            span.end()
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+async def retrieve(request):
+    """Return the chunks retrieved for a query, without calling the LLM."""
+    try:
+        body = await read_json(request)
+        filters = read_filters(body)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+
+    k = body.get("k")
+    if k is not None and (isinstance(k, bool) or not str(k).isdigit() or int(k) < 1):
+        return JSONResponse({"error": "'k' must be a positive integer"}, status_code=400)
+    search_kwargs = {"k": int(k)} if k is not None else {}
+    if filters:
+        search_kwargs["filters"] = filters
+
+    retriever = request.app.state.index_manager.current()
+    session_id = str(body.get("session_id", "default"))
+    metrics = RequestMetrics("retrieve", session_id=session_id, filtered=bool(filters))
+    try:
+        with metrics.stage("retrieval"), metrics.activate(), \
+                trace("api.retrieve", parent=remote_parent(request.headers),
+                      session_id=session_id, filtered=bool(filters)) as span:
+            metrics.set(trace_id=span.trace_id)
+            docs = await run_in_threadpool(retriever.invoke, body["query"], **search_kwargs)
+    except Exception as e:
+        print(f"Error retrieving documents: {str(e)}")
+        metrics.finish(error=str(e))
+        return JSONResponse({"error": f"Error retrieving documents: {str(e)}"}, status_code=500)
+    metrics.set(retrieved_chunks=len(docs))
+    metrics.finish()
+
+    return JSONResponse({"documents": [document_to_dict(doc) for doc in docs]})
+
+
+async def ingest(request):
+    """Queue the request body as a document for indexing."""
+    file_name = request.query_params.get("file_name") or request.headers.get("x-file-name")
+    if not file_name:
+        return JSONResponse({"error": "'file_name' is required"}, status_code=400)
+    file_type = file_name.rsplit(".", 1)[-1].lower() if "." in file_name else ""
+    if file_type not in SUPPORTED_FILE_TYPES:
+        return JSONResponse({"error": f"Unsupported file type: {file_type}"}, status_code=400)
+
+    data = await request.body()
+    if not data:
+        return JSONResponse({"error": "the request body is empty"}, status_code=400)
+
+    # The job keeps this span as its parent, so the worker's ingestion spans join the caller's trace
+    with trace("api.ingest", parent=remote_parent(request.headers),
+               session_id=request.query_params.get("session_id"), file_name=file_name, size=len(data)):
+        job_ids = request.app.state.ingestion_queue.submit(
+            [UploadedBytes(file_name, data)],
+            session_id=request.query_params.get("session_id", "default"),
+            profile=request.query_params.get("profile", "").lower() in ("1", "true", "yes")
+        )
+    return JSONResponse({"job_id": job_ids[0]}, status_code=202)
+
+
+async def ingestion_job(request):
+    """Report the progress of an ingestion job."""
+    job = request.app.state.ingestion_queue.get(request.path_params["job_id"])
+    if job is None:
+        return JSONResponse({"error": "unknown job"}, status_code=404)
+    return JSONResponse(job.to_dict())
+
+
+async def filter_values(request):
+    """List the indexed values of a metadata field."""
+    retriever = request.app.state.index_manager.current()
+    if not hasattr(retriever, "metadata_values"):
+        return JSONResponse({"values": []})
+    values = await run_in_threadpool(retriever.metadata_values, request.path_params["field"])
+    return JSONResponse({"values": values})
+
+
+def index_status(index_manager):
+    """State of the live index and of a background rebuild."""
+    return {
+        "index_path": index_manager.index_path,
+        "status": index_manager.status,
+        "message": index_manager.message,
+        "is_building": index_manager.is_building,
+        "can_roll_back": index_manager.can_roll_back
+    }
+
+
+async def get_index(request):
+    return JSONResponse(index_status(request.app.state.index_manager))
+
+
+async def rebuild_index(request):
+    """Start a background rebuild; answers 409 if one is already running."""
+    index_manager = request.app.state.index_manager
+    started = index_manager.start_rebuild(
+        request.query_params.get("reason", "requested over the API"),
+        profile=request.query_params.get("profile", "").lower() in ("1", "true", "yes")
+    )
+    return JSONResponse(index_status(index_manager), status_code=202 if started else 409)
+
+
+async def rollback_index(request):
+    """Switch back to the previous index version; answers 409 if there is none."""
+    index_manager = request.app.state.index_manager
+    rolled_back = await run_in_threadpool(index_manager.rollback)
+    return JSONResponse(index_status(index_manager), status_code=200 if rolled_back else 409)
+
+
+async def health(request):
+    """Report whether a retriever is loaded, with the index and ingestion state."""
+    index_manager = getattr(request.app.state, "index_manager", None)
+    if index_manager is None or index_manager.current() is None:
+        return JSONResponse({"status": "starting"}, status_code=503)
+    return JSONResponse({
+        "status": "ok",
+        "index": index_status(index_manager),
+        "ingestion_pending": request.app.state.ingestion_queue.pending
+    })
+
+
+async def prometheus_metrics(request):
+    """Expose the request metrics of this process to Prometheus."""
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+def create_app(initialize_system_func=None):
+    """
+    Create the ASGI application.
+
+    The index is loaded once at startup and its live retriever, ingestion
+    queue and chat histories are shared by every request. Blocking work
+    (retrieval, embedding, the LLM stream) runs on worker threads so the
+    event loop keeps serving other requests meanwhile.
+
+    Args:
+        initialize_system_func (callable, optional): Returns the retriever of the
+            live index, defaults to main.initialize_system
+
+    Returns:
+        Starlette: The application
+    """
+    @contextlib.asynccontextmanager
+    async def lifespan(app):
+        load_retriever = initialize_system_func
+        if load_retriever is None:
+            from main import initialize_system
+            load_retriever = initialize_system
+
+        index_manager = await asyncio.to_thread(IndexManager, load_retriever)
+        if INDEX_AUTO_REBUILD and index_manager.needs_rebuild():
+            # Keep serving the current index while one matching the settings is built
+            index_manager.start_rebuild("index settings changed")
+        app.state.index_manager = index_manager
+        app.state.ingestion_queue = IngestionQueue(index_manager.current, write_lock=index_manager.write_lock)
+        yield
+
+    routes = [
+        Route("/chat", chat, methods=["POST"]),
+        Route("/retrieve", retrieve, methods=["POST"]),
+        Route("/ingest", ingest, methods=["POST"]),
+        Route("/ingest/{job_id}", ingestion_job, methods=["GET"]),
+        Route("/filters/{field}", filter_values, methods=["GET"]),
+        Route("/index", get_index, methods=["GET"]),
+        Route("/index/rebuild", rebuild_index, methods=["POST"]),
+        Route("/index/rollback", rollback_index, methods=["POST"]),
+        Route("/health", health, methods=["GET"]),
+        Route("/metrics", prometheus_metrics, methods=["GET"]),
+    ]
+    return Starlette(routes=routes, lifespan=lifespan)
+
+
+app = create_app()
+
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(app, host=API_HOST, port=API_PORT)
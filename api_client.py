@@ -0,0 +1,229 @@
+"""
+Client of the HTTP API in api.py.
+
+The classes mirror the parts of IndexManager, IngestionQueue and the
+retriever that the Streamlit UI uses, so the UI runs unchanged against a
+shared API server instead of loading the index in its own process.
+"""
+import json
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from langchain_core.documents import Document
+from config import API_URL, API_TIMEOUT
+from ingestion import FINISHED_STATES
+from tracing import trace_headers
+
+# Seconds the index status is reused before it is fetched again
+STATUS_CACHE_SECONDS = 0.5
+
+
+def _request(path, method="GET", body=None, headers=None, base_url=None, timeout=API_TIMEOUT):
+    """Send a request to the API and return the response object."""
+    url = (base_url or API_URL).rstrip("/") + path
+    # The API continues the trace of the active span, e.g. ui.render or ui.upload
+    headers = {**trace_headers(), **(headers or {})}
+    if isinstance(body, dict):
+        body = json.dumps(body).encode("utf-8")
+        headers = {"Content-Type": "application/json", **headers}
+    request = urllib.request.Request(url, data=body, method=method, headers=headers)
+    return urllib.request.urlopen(request, timeout=timeout)
+
+
+def _request_json(path, method="GET", body=None, headers=None, base_url=None):
+    """
+    Send a request to the API and decode its JSON answer.
+
+    Error statuses that still carry a JSON body (404, 409) are returned
+    like successes, with the status code added under "status_code".
+    """
+    try:
+        with _request(path, method, body, headers, base_url) as response:
+            return json.load(response)
+    except urllib.error.HTTPError as e:
+        try:
+            result = json.load(e)
+        except Exception:
+            raise e
+        result["status_code"] = e.code
+        return result
+
+
+def iter_sse(response):
+    """
+    Parse a server-sent event stream.
+
+    Yields:
+        tuple: (event name, decoded JSON data)
+    """
+    event, data = "message", []
+    for raw_line in response:
+        line = raw_line.decode("utf-8").rstrip("\r\n")
+        if not line:
+            if data:
+                yield event, json.loads("\n".join(data))
+            event, data = "message", []
+        elif line.startswith("event:"):
+            event = line[len("event:"):].strip()
+        elif line.startswith("data:"):
+            data.append(line[len("data:"):].strip())
+
+
+def stream_bot_response(user_query, retriever=None, is_report_mode=False, use_premium_model=True,
+                        session_id="default", filters=None, profile=False):
+    """
+    Stream a response from the API; a drop-in for chatbot.get_bot_response.
+
+    Args:
+        user_query (str): The user's query
+        retriever: Ignored, the server uses its own live retriever
+        is_report_mode (bool): Whether to generate a detailed report
+        use_premium_model (bool): Whether to use the premium LLM model
+        session_id (str): Session identifier for chat history
+        filters (dict, optional): Metadata filters restricting the search
+        profile (bool): Have the server profile this request
+
+    Yields:
+        str: Chunks of the response from the LLM
+    """
+    body = {
+        "query": user_query,
+        "report_mode": is_report_mode,
+        "premium_model": use_premium_model,
+        "session_id": session_id,
+        "filters": filters or None,
+        "profile": profile
+    }
+    try:
+        with _request("/chat", "POST", body, headers={"Accept": "text/event-stream"}) as response:
+            for event, data in iter_sse(response):
+                if event == "chunk":
+                    yield data["text"]
+                elif event == "error":
+                    yield data.get("message", "The server failed to generate a response")
+                    return
+                elif event == "done":
+                    return
+    except Exception as e:
+        yield f"Error contacting the API: {str(e)}"
+
+
+class RemoteRetriever:
+    """Retriever answering from the API's live index."""
+
+    def __init__(self, base_url=None):
+        self.base_url = base_url
+
+    def invoke(self, query, filters=None):
+        result = _request_json("/retrieve", "POST", {"query": query, "filters": filters or None},
+                               base_url=self.base_url)
+        if "error" in result:
+            raise RuntimeError(result["error"])
+        return [Document(page_content=doc["page_content"], metadata=doc["metadata"], id=doc.get("id"))
+                for doc in result["documents"]]
+
+    def metadata_values(self, field):
+        try:
+            return _request_json(f"/filters/{urllib.parse.quote(field)}", base_url=self.base_url).get("values", [])
+        except Exception as e:
+            print(f"Error fetching filter values for {field}: {str(e)}")
+            return []
+
+
+class RemoteIndexManager:
+    """Index status and controls of the API server, with the interface of IndexManager."""
+
+    def __init__(self, base_url=None):
+        self.base_url = base_url
+        self._status = None
+        self._fetched = 0.0
+        # Fail early, like a local IndexManager whose index cannot be loaded
+        self._refresh(force=True)
+
+    def _refresh(self, force=False):
+        if force or self._status is None or time.monotonic() - self._fetched > STATUS_CACHE_SECONDS:
+            self._status = _request_json("/index", base_url=self.base_url)
+            self._fetched = time.monotonic()
+        return self._status
+
+    def current(self):
+        return RemoteRetriever(self.base_url)
+
+    @property
+    def index_path(self):
+        return self._refresh()["index_path"]
+
+    @property
+    def status(self):
+        return self._refresh()["status"]
+
+    @property
+    def message(self):
+        return self._refresh()["message"]
+
+    @property
+    def is_building(self):
+        return self._refresh()["is_building"]
+
+    @property
+    def can_roll_back(self):
+        return self._refresh()["can_roll_back"]
+
+    def needs_rebuild(self):
+        # The server rebuilds a stale index itself at startup
+        return False
+
+    def start_rebuild(self, reason="manual rebuild", load_documents=None, profile=False):
+        query = urllib.parse.urlencode({"reason": reason, "profile": int(bool(profile))})
+        self._status = _request_json(f"/index/rebuild?{query}", "POST", b"", base_url=self.base_url)
+        self._fetched = time.monotonic()
+        return self._status.get("status_code", 202) == 202
+
+    def rollback(self):
+        self._status = _request_json("/index/rollback", "POST", b"", base_url=self.base_url)
+        self._fetched = time.monotonic()
+        return self._status.get("status_code", 200) == 200
+
+
+class RemoteJob:
+    """Progress of an ingestion job on the API server."""
+
+    def __init__(self, values):
+        self.id = values["id"]
+        self.file_name = values["file_name"]
+        self.status = values["status"]
+        self.stage = values["stage"]
+        self.progress = values["progress"]
+        self.message = values["message"]
+
+    @property
+    def is_finished(self):
+        return self.status in FINISHED_STATES
+
+
+class RemoteIngestionQueue:
+    """Ingestion through the API server, with the interface of IngestionQueue."""
+
+    def __init__(self, base_url=None):
+        self.base_url = base_url
+
+    def submit(self, uploaded_files, session_id="default", profile=False):
+        job_ids = []
+        for uploaded_file in uploaded_files:
+            query = urllib.parse.urlencode({"file_name": uploaded_file.name, "session_id": session_id,
+                                            "profile": int(profile)})
+            result = _request_json(f"/ingest?{query}", "POST", bytes(uploaded_file.getbuffer()),
+                                   headers={"Content-Type": "application/octet-stream"},
+                                   base_url=self.base_url)
+            if "job_id" in result:
+                job_ids.append(result["job_id"])
+            else:
+                print(f"Error uploading {uploaded_file.name}: {result.get('error')}")
+        return job_ids
+
+    def get(self, job_id):
+        result = _request_json(f"/ingest/{job_id}", base_url=self.base_url)
+        if result.get("status_code") == 404:
+            return None
+        return RemoteJob(result)
@@ -0,0 +1,994 @@
+"""
+Benchmarks for the retrieval stack.
+
+Usage:
+    python benchmark.py backends [--sizes 1000 5000 20000] [--queries 200]
+    python benchmark.py quantization [--source auto|numpy|chroma|synthetic] [--k 10]
+    python benchmark.py hnsw [--m 8 16 32] [--construction-ef 100 200] [--search-ef 10 50 100]
+    python benchmark.py chunking [--folder "goofiya data"] [--strategies sentences tokens]
+    python benchmark.py dedupe [--folder "goofiya data"] [--thresholds 0.7 0.8 0.9]
+    python benchmark.py startup [--module main] [--budget 2.0] [--top 15]
+    python benchmark.py embeddings [--backends huggingface onnx-fp32 onnx-int8] [--threads 4] [--k 5]
+    python benchmark.py gold-set
+    python benchmark.py retrieval [--chunk-sizes 10 20] [--chunk-overlaps 2 5] [--k 3 5 10] [--stores numpy chroma]
+    python benchmark.py retrieval-diff benchmark_results/old.json benchmark_results/new.json
+"""
+import os
+import json
+import time
+import shutil
+import hashlib
+import argparse
+import subprocess
+import sys
+import tempfile
+import itertools
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+EMBEDDING_DIM = 768  # all-mpnet-base-v2
+
+
+class PrecomputedEmbeddings(Embeddings):
+    """
+    Embedding function serving vectors generated up front.
+
+    Lets the storage backends be benchmarked on their own, without the cost
+    of running the embedding model.
+    """
+
+    def __init__(self, vectors):
+        self.vectors = vectors  # text -> vector
+
+    def embed_documents(self, texts):
+        return [self.vectors[text].tolist() for text in texts]
+
+    def embed_query(self, text):
+        return self.vectors[text].tolist()
+
+
+def synthetic_corpus(n_docs, n_queries, dim=EMBEDDING_DIM, n_topics=50, seed=0):
+    """
+    Generate clustered unit vectors that roughly mimic sentence embeddings.
+
+    Returns:
+        tuple: (doc matrix, query matrix), both float32 and row-normalized
+    """
+    rng = np.random.default_rng(seed)
+    topics = rng.standard_normal((n_topics, dim)).astype(np.float32)
+
+    def sample(n):
+        vectors = topics[rng.integers(0, n_topics, n)] + 0.8 * rng.standard_normal((n, dim)).astype(np.float32)
+        return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+    return sample(n_docs), sample(n_queries)
+
+
+def exact_top_k(docs, queries, k):
+    """Brute-force ground truth: indices of the k most similar docs per query."""
+    scores = queries @ docs.T
+    return np.argsort(-scores, axis=1)[:, :k]
+
+
+def recall_at_k(found, truth):
+    """Mean fraction of the true top k present in the returned top k."""
+    hits = [len(set(f) & set(t)) / len(t) for f, t in zip(found, truth)]
+    return float(np.mean(hits))
+
+
+def directory_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            total += os.path.getsize(os.path.join(root, name))
+    return total
+
+
+def percentile_ms(samples, q):
+    return float(np.percentile(samples, q) * 1000)
+
+
+def positive_int(value):
+    """argparse type for counts that must be at least 1."""
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {number}")
+    return number
+
+
+def _open_store(backend, path, embedding_function, collection_metadata=None):
+    if backend == "chroma":
+        from langchain_chroma import Chroma
+        return Chroma(persist_directory=path, embedding_function=embedding_function,
+                      collection_metadata=collection_metadata)
+    from numpy_store import NumpyVectorStore
+    return NumpyVectorStore(persist_directory=path, embedding_function=embedding_function)
+
+
+def benchmark_backend(backend, docs, queries, k=10, batch_size=1000):
+    """
+    Build, reopen and query one backend, measuring each step.
+
+    Returns:
+        dict: Build time, cold open time, query latency percentiles, recall and size
+    """
+    texts = [f"doc-{i}" for i in range(len(docs))]
+    query_texts = [f"query-{i}" for i in range(len(queries))]
+    embedding_function = PrecomputedEmbeddings({
+        **dict(zip(texts, docs)),
+        **dict(zip(query_texts, queries))
+    })
+
+    path = tempfile.mkdtemp(prefix=f"bench_{backend}_")
+    try:
+        start = time.perf_counter()
+        store = _open_store(backend, path, embedding_function)
+        for offset in range(0, len(texts), batch_size):
+            batch = texts[offset:offset + batch_size]
+            store.add_texts(batch, metadatas=[{"source": text} for text in batch], ids=batch)
+        build_seconds = time.perf_counter() - start
+        del store
+
+        # Cold open plus the first query, which is what a fresh app process pays
+        start = time.perf_counter()
+        store = _open_store(backend, path, embedding_function)
+        store.similarity_search(query_texts[0], k=k)
+        open_seconds = time.perf_counter() - start
+
+        latencies, found = [], []
+        for query in query_texts:
+            start = time.perf_counter()
+            results = store.similarity_search(query, k=k)
+            latencies.append(time.perf_counter() - start)
+            found.append([int(doc.metadata["source"].split("-")[1]) for doc in results])
+
+        return {
+            "backend": backend,
+            "n_docs": len(docs),
+            "build_s": round(build_seconds, 3),
+            "open_s": round(open_seconds, 3),
+            "p50_ms": round(percentile_ms(latencies, 50), 3),
+            "p95_ms": round(percentile_ms(latencies, 95), 3),
+            f"recall@{k}": round(recall_at_k(found, exact_top_k(docs, queries, k)), 4),
+            "size_mb": round(directory_size(path) / 2**20, 2),
+        }
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def print_table(rows):
+    if not rows:
+        return
+    columns = list(rows[0].keys())
+    widths = {c: max(len(c), *(len(str(r.get(c, ""))) for r in rows)) for c in columns}
+    print("  ".join(c.ljust(widths[c]) for c in columns))
+    for row in rows:
+        print("  ".join(str(row.get(c, "")).ljust(widths[c]) for c in columns))
+
+
+def run_backends(args):
+    """Compare the Chroma and NumPy backends across corpus sizes."""
+    rows = []
+    for n_docs in args.sizes:
+        docs, queries = synthetic_corpus(n_docs, args.queries)
+        for backend in args.backends:
+            try:
+                rows.append(benchmark_backend(backend, docs, queries, k=args.k))
+                print(f"Finished {backend} with {n_docs} documents")
+            except ImportError as e:
+                print(f"Skipping {backend}: {str(e)}")
+    print_table(rows)
+    return rows
+
+
+def _live_index_path(backend):
+    """Directory of a backend's live index version, else its legacy location."""
+    from config import NUMPY_INDEX_PATH, CHROMA_INDEX_PATH
+    from index_versions import current_index_path
+    return current_index_path(backend) or (NUMPY_INDEX_PATH if backend == "numpy" else CHROMA_INDEX_PATH)
+
+
+def load_corpus_vectors(source="auto"):
+    """
+    Load the embeddings of the indexed corpus.
+
+    Args:
+        source (str): "numpy", "chroma", "synthetic", or "auto" to try the
+            numpy index, then Chroma, then fall back to synthetic vectors
+
+    Returns:
+        tuple: (float32 matrix of normalized vectors, name of the source used)
+    """
+    if source in ("auto", "numpy"):
+        path = _live_index_path("numpy")
+        if os.path.exists(os.path.join(path, "manifest.json")):
+            from numpy_store import NumpyVectorStore
+            store = NumpyVectorStore(path, embedding_function=None, dtype="float32")
+            if len(store):
+                return np.asarray(store._matrix), "numpy"
+        if source == "numpy":
+            print(f"No numpy index with vectors found in {path}")
+            raise SystemExit(1)
+
+    if source in ("auto", "chroma"):
+        path = _live_index_path("chroma")
+        try:
+            from langchain_chroma import Chroma
+            stored = Chroma(persist_directory=path).get(include=["embeddings"])
+            vectors = np.asarray(stored["embeddings"], dtype=np.float32)
+            if len(vectors):
+                return vectors / np.linalg.norm(vectors, axis=1, keepdims=True), "chroma"
+            print(f"No Chroma index with vectors found in {path}")
+        except Exception as e:
+            print(f"Could not read Chroma embeddings from {path}: {str(e)}")
+        if source == "chroma":
+            raise SystemExit(1)
+
+    print("No indexed corpus found, using synthetic vectors")
+    docs, _ = synthetic_corpus(5000, 0)
+    return docs, "synthetic"
+
+
+def perturbed_queries(docs, n_queries, noise=0.6, seed=1):
+    """Noisy copies of random corpus vectors, standing in for paraphrased questions."""
+    rng = np.random.default_rng(seed)
+    picked = docs[rng.integers(0, len(docs), n_queries)]
+    noisy = picked + noise * rng.standard_normal(picked.shape).astype(np.float32) / np.sqrt(docs.shape[1])
+    return noisy / np.linalg.norm(noisy, axis=1, keepdims=True)
+
+
+def run_quantization(args):
+    """Report recall@k against memory for float32, float16 and int8 storage."""
+    from numpy_store import NumpyVectorStore
+
+    docs, source = load_corpus_vectors(args.source)
+    queries = perturbed_queries(docs, args.queries)
+    truth = exact_top_k(docs, queries, args.k)
+    print(f"Corpus: {len(docs)} vectors of dimension {docs.shape[1]} from {source}")
+
+    rows = []
+    for dtype in ("float32", "float16", "int8"):
+        factors = [1] if dtype == "float32" else [1, args.rescore_factor]
+        for factor in factors:
+            path = tempfile.mkdtemp(prefix=f"bench_{dtype}_")
+            try:
+                store = NumpyVectorStore(path, embedding_function=None, dtype=dtype, rescore_factor=factor)
+                ids = [str(i) for i in range(len(docs))]
+                store.add_vectors(docs, ids, ids=ids)
+
+                latencies, found = [], []
+                for query in queries:
+                    start = time.perf_counter()
+                    hits = store.search_vectors([query], k=args.k)[0]
+                    latencies.append(time.perf_counter() - start)
+                    found.append([i for i, _ in hits])
+
+                memory = store._compact.nbytes if store._compact is not None else store._matrix.nbytes
+                rows.append({
+                    "dtype": dtype,
+                    "rescored": "-" if dtype == "float32" else f"{args.k * factor}",
+                    "bytes/vector": round(memory / len(docs), 1),
+                    "memory_mb": round(memory / 2**20, 2),
+                    f"recall@{args.k}": round(recall_at_k(found, truth), 4),
+                    "p50_ms": round(percentile_ms(latencies, 50), 3),
+                    "p95_ms": round(percentile_ms(latencies, 95), 3),
+                })
+            finally:
+                shutil.rmtree(path, ignore_errors=True)
+
+    print_table(rows)
+    return rows
+
+
+def benchmark_hnsw(docs, queries, truth, space, m, construction_ef, search_ef, k=10, batch_size=1000):
+    """
+    Build a Chroma collection with the given HNSW parameters and measure it.
+
+    Returns:
+        dict: Parameters, build time, index size, query latency percentiles and recall
+    """
+    import chromadb
+
+    path = tempfile.mkdtemp(prefix="bench_hnsw_")
+    try:
+        client = chromadb.PersistentClient(path=path)
+        collection = client.create_collection("bench", metadata={
+            "hnsw:space": space,
+            "hnsw:M": m,
+            "hnsw:construction_ef": construction_ef,
+            "hnsw:search_ef": search_ef,
+        })
+
+        start = time.perf_counter()
+        for offset in range(0, len(docs), batch_size):
+            batch = docs[offset:offset + batch_size]
+            collection.add(ids=[str(offset + i) for i in range(len(batch))], embeddings=batch.tolist())
+        build_seconds = time.perf_counter() - start
+
+        latencies, found = [], []
+        for query in queries:
+            start = time.perf_counter()
+            result = collection.query(query_embeddings=[query.tolist()], n_results=k, include=[])
+            latencies.append(time.perf_counter() - start)
+            found.append([int(i) for i in result["ids"][0]])
+
+        return {
+            "space": space,
+            "M": m,
+            "construction_ef": construction_ef,
+            "search_ef": search_ef,
+            "build_s": round(build_seconds, 3),
+            "size_mb": round(directory_size(path) / 2**20, 2),
+            "p50_ms": round(percentile_ms(latencies, 50), 3),
+            "p95_ms": round(percentile_ms(latencies, 95), 3),
+            f"recall@{k}": round(recall_at_k(found, truth), 4),
+        }
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def run_hnsw(args):
+    """Sweep Chroma HNSW parameters against exact brute-force ground truth."""
+    docs, source = load_corpus_vectors(args.source)
+    queries = perturbed_queries(docs, args.queries)
+    truth = exact_top_k(docs, queries, args.k)
+    print(f"Corpus: {len(docs)} vectors of dimension {docs.shape[1]} from {source}")
+
+    rows = []
+    for space, m, construction_ef, search_ef in itertools.product(
+            args.space, args.m, args.construction_ef, args.search_ef):
+        rows.append(benchmark_hnsw(docs, queries, truth, space, m, construction_ef, search_ef, k=args.k))
+        print(f"Finished space={space} M={m} construction_ef={construction_ef} search_ef={search_ef}")
+
+    print_table(rows)
+    return rows
+
+
+def run_chunking(args):
+    """Count chunks that exceed the embedding model's input window for each chunking strategy."""
+    from config import FOLDER_PATH, CHUNK_MAX_TOKENS
+    from data_loader import read_txts_from_folder
+    from vector_store import build_chunks, get_text_splitter, load_embedding_tokenizer
+    from text_utils import TokenBudgetSplitter
+
+    tokenizer = load_embedding_tokenizer()
+    if tokenizer is None:
+        print("The embedding tokenizer is required to measure chunk lengths")
+        return []
+    counter = TokenBudgetSplitter(tokenizer, max_tokens=CHUNK_MAX_TOKENS)
+    file_data = read_txts_from_folder(args.folder or FOLDER_PATH)
+
+    rows = []
+    for strategy in args.strategies:
+        splitter = get_text_splitter(strategy)
+        start = time.perf_counter()
+        chunks = []
+        for data in file_data:
+            chunks.extend(build_chunks(data["file_name"], data["content"], splitter)[0])
+        elapsed = time.perf_counter() - start
+
+        # Every input also carries the model's special tokens
+        lengths = np.array(counter.count_tokens(chunks)) + (CHUNK_MAX_TOKENS - counter.budget)
+        over = lengths > CHUNK_MAX_TOKENS
+        rows.append({
+            "strategy": strategy,
+            "chunks": len(chunks),
+            "over_limit": int(over.sum()),
+            "over_limit_pct": round(100 * float(over.mean()), 1) if len(chunks) else 0.0,
+            "mean_tokens": round(float(lengths.mean()), 1) if len(chunks) else 0.0,
+            "max_tokens": int(lengths.max()) if len(chunks) else 0,
+            "truncated_tokens_pct": round(100 * float(np.maximum(lengths - CHUNK_MAX_TOKENS, 0).sum() / lengths.sum()), 1)
+            if len(chunks) else 0.0,
+            "chunking_s": round(elapsed, 3)
+        })
+        print(f"Finished strategy={strategy}")
+
+    print_table(rows)
+    return rows
+
+
+def run_dedupe(args):
+    """Count the chunks and vector bytes near-duplicate detection saves at several thresholds."""
+    from config import FOLDER_PATH
+    from data_loader import read_txts_from_folder
+    from vector_store import build_chunks, get_text_splitter
+    from near_duplicates import find_near_duplicates
+
+    splitter = get_text_splitter()
+    texts = []
+    for data in read_txts_from_folder(args.folder or FOLDER_PATH):
+        texts.extend(build_chunks(data["file_name"], data["content"], splitter)[0])
+
+    rows = []
+    for threshold in args.thresholds:
+        start = time.perf_counter()
+        canonical = find_near_duplicates(texts, threshold=threshold)
+        elapsed = time.perf_counter() - start
+        removed = sum(1 for i, root in enumerate(canonical) if root != i)
+        rows.append({
+            "threshold": threshold,
+            "chunks": len(texts),
+            "removed": removed,
+            "groups": len({root for i, root in enumerate(canonical) if root != i}),
+            "saved_pct": round(100 * removed / len(texts), 1) if texts else 0.0,
+            # float32 vectors of all-mpnet-base-v2
+            "vector_kb_saved": round(removed * args.dim * 4 / 1024, 1),
+            "detect_s": round(elapsed, 3)
+        })
+        print(f"Finished threshold={threshold}")
+
+    print_table(rows)
+    return rows
+
+
+def load_test_cases(path=None):
+    """
+    Read the question and reference answer pairs of the "TEST CASES.txt" file.
+
+    Returns:
+        list: Dictionaries with question and answer, in file order
+    """
+    from config import BASE_DIR
+    path = path or os.path.join(BASE_DIR, "TEST CASES.txt")
+    if not os.path.exists(path):
+        return []
+    cases = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.startswith("Question ===>"):
+                cases.append({"question": line.split("===>", 1)[1].strip(), "answer": ""})
+            elif cases:
+                if line.startswith("Answer ====>"):
+                    line = line.split("====>", 1)[1]
+                cases[-1]["answer"] += line
+    for case in cases:
+        case["answer"] = case["answer"].strip()
+    return cases
+
+
+def load_test_questions(path=None):
+    """
+    Read the questions of the "TEST CASES.txt" file.
+
+    Returns:
+        list: Question strings, in file order
+    """
+    return [case["question"] for case in load_test_cases(path)]
+
+
+def load_embedding_backend(name, threads=None):
+    """
+    Load an embedding function by benchmark name.
+
+    Args:
+        name (str): "huggingface", "onnx-fp32" or "onnx-int8"
+        threads (int, optional): ONNX Runtime intra-op threads
+
+    Returns:
+        Embeddings: The embedding function
+    """
+    if name == "huggingface":
+        from vector_store import load_local_embedding_function
+        return load_local_embedding_function("huggingface")
+    from onnx_embeddings import load_onnx_embeddings
+    return load_onnx_embeddings(quantize=name == "onnx-int8", num_threads=threads)
+
+
+def run_embeddings(args):
+    """Compare embedding backends on throughput, query latency and retrieval recall@k."""
+    from config import FOLDER_PATH
+    from data_loader import read_txts_from_folder
+    from vector_store import build_chunks, get_text_splitter
+
+    splitter = get_text_splitter()
+    texts = []
+    for data in read_txts_from_folder(args.folder or FOLDER_PATH):
+        texts.extend(build_chunks(data["file_name"], data["content"], splitter)[0])
+    if args.limit:
+        texts = texts[:args.limit]
+
+    # Real questions first, topped up with the openings of sampled chunks
+    queries = load_test_questions()
+    rng = np.random.default_rng(0)
+    for i in rng.permutation(len(texts))[:max(args.queries - len(queries), 0)]:
+        queries.append(" ".join(texts[i].split()[:20]))
+    queries = queries[:args.queries]
+    print(f"Corpus: {len(texts)} chunks, {len(queries)} queries")
+
+    rows, baseline = [], None
+    for name in args.backends:
+        embedding_function = load_embedding_backend(name, args.threads)
+        embed = getattr(embedding_function, "embed_array", None) or embedding_function.embed_documents
+        embed(texts[:8])  # warm up
+
+        start = time.perf_counter()
+        docs = np.asarray(embed(texts), dtype=np.float32)
+        indexing_s = time.perf_counter() - start
+
+        latencies, query_vectors = [], []
+        for query in queries:
+            start = time.perf_counter()
+            query_vectors.append(embedding_function.embed_query(query))
+            latencies.append(time.perf_counter() - start)
+
+        docs /= np.linalg.norm(docs, axis=1, keepdims=True)
+        query_vectors = np.asarray(query_vectors, dtype=np.float32)
+        query_vectors /= np.linalg.norm(query_vectors, axis=1, keepdims=True)
+        found = exact_top_k(docs, query_vectors, args.k)
+
+        row = {
+            "backend": name,
+            "docs_per_s": round(len(texts) / indexing_s, 1),
+            "query_p50_ms": round(percentile_ms(latencies, 50), 2),
+            "query_p95_ms": round(percentile_ms(latencies, 95), 2),
+        }
+        if baseline is None:
+            baseline = {"docs": docs, "found": found, "indexing_s": indexing_s, "p50": percentile_ms(latencies, 50)}
+            row.update({"index_speedup": 1.0, "query_speedup": 1.0, f"recall@{args.k}": 1.0, "mean_cosine": 1.0})
+        else:
+            row.update({
+                "index_speedup": round(baseline["indexing_s"] / indexing_s, 2),
+                "query_speedup": round(baseline["p50"] / percentile_ms(latencies, 50), 2),
+                # Overlap of the top k with what the first backend retrieves
+                f"recall@{args.k}": round(recall_at_k(found, baseline["found"]), 4),
+                "mean_cosine": round(float(np.mean(np.sum(docs * baseline["docs"], axis=1))), 4)
+            })
+        rows.append(row)
+        print(f"Finished backend={name}")
+
+    print_table(rows)
+    return rows
+
+
+def _cases_digest(cases):
+    """Content hash of gold set cases, so results from different gold sets are not compared."""
+    data = json.dumps([[case["id"], case["question"], sorted(case["expected_sources"])] for case in cases])
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()[:16]
+
+
+def load_gold_set(path=None):
+    """
+    Read the retrieval gold set.
+
+    Returns:
+        dict: version, cases_sha256 and cases, each case with id, question
+            and expected_sources (file names of the documents answering it)
+    """
+    from config import BENCHMARK_GOLD_SET_PATH
+    path = path or BENCHMARK_GOLD_SET_PATH
+    if not os.path.exists(path):
+        return {"version": 0, "cases_sha256": None, "cases": []}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def run_gold_set(args):
+    """
+    Sync the gold set with the questions of "TEST CASES.txt".
+
+    Labels already in the gold set are kept, matched by question text; new
+    questions are added with no expected sources and must be labelled by
+    hand. The version goes up whenever the cases differ from the last
+    version written, including hand edits of the labels.
+    """
+    from config import BENCHMARK_GOLD_SET_PATH
+    path = args.gold or BENCHMARK_GOLD_SET_PATH
+    gold = load_gold_set(path)
+    existing = {case["question"]: case for case in gold["cases"]}
+    next_id = max((int(case["id"][2:]) for case in gold["cases"]), default=0) + 1
+
+    cases = []
+    for test_case in load_test_cases(args.test_cases):
+        case = existing.get(test_case["question"])
+        if case is None:
+            case = {"id": f"tc{next_id:02d}", "question": test_case["question"], "expected_sources": []}
+            next_id += 1
+        cases.append(case)
+
+    digest = _cases_digest(cases)
+    changed = digest != gold.get("cases_sha256") or _cases_digest(gold["cases"]) != gold.get("cases_sha256")
+    version = gold["version"] + 1 if changed else gold["version"]
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"version": version, "cases_sha256": digest, "cases": cases}, f, indent=2, ensure_ascii=False)
+        f.write("\n")
+
+    unlabelled = [case["id"] for case in cases if not case["expected_sources"]]
+    print(f"Gold set version {version} with {len(cases)} cases written to {path}"
+          + (" (unchanged)" if not changed else ""))
+    if unlabelled:
+        print(f"Cases without expected sources, skipped by the benchmark until labelled: {', '.join(unlabelled)}")
+    return [{"id": case["id"], "expected_sources": len(case["expected_sources"]), "question": case["question"][:60]}
+            for case in cases]
+
+
+def make_splitter(strategy, chunk_size, chunk_overlap):
+    """
+    Create a splitter with explicit chunk settings.
+
+    Args:
+        strategy (str): "sentences" (sizes in sentences) or "tokens" (sizes in tokens)
+        chunk_size (int): CHUNK_SIZE, or CHUNK_MAX_TOKENS for "tokens"
+        chunk_overlap (int): CHUNK_OVERLAP, or CHUNK_OVERLAP_TOKENS for "tokens"
+    """
+    from config import TOKENIZE_BATCH_SIZE
+    from text_utils import SimpleSentenceSplitter, TokenBudgetSplitter
+    from vector_store import load_embedding_tokenizer
+
+    if strategy == "tokens":
+        tokenizer = load_embedding_tokenizer()
+        if tokenizer is None:
+            raise RuntimeError("The embedding tokenizer is required for token chunking")
+        return TokenBudgetSplitter(tokenizer, max_tokens=chunk_size, overlap_tokens=chunk_overlap,
+                                   batch_size=TOKENIZE_BATCH_SIZE)
+    return SimpleSentenceSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+
+
+def build_benchmark_index(file_data, store, embedding_function, splitter, path):
+    """
+    Index documents the way initialize_vector_store does, with the given splitter and backend.
+
+    Returns:
+        tuple: (vector store, text store, number of chunks stored)
+    """
+    from config import NEAR_DUPLICATE_DEDUP_ENABLED, CHROMA_COLLECTION_METADATA, BUILD_BATCH_SIZE
+    from vector_store import build_chunks, get_text_store, store_document_text
+    from near_duplicates import deduplicate_chunks
+    from chunk_store import add_chunks
+
+    text_store = get_text_store(path)
+    texts, metadatas = [], []
+    for data in file_data:
+        if not data.get("content"):
+            continue
+        chunks, chunk_metadatas, document_text = build_chunks(data["file_name"], data["content"], splitter)
+        if chunks:
+            store_document_text(text_store, document_text, chunk_metadatas)
+            texts.extend(chunks)
+            metadatas.extend(chunk_metadatas)
+    ids = [f"doc_{i}" for i in range(len(texts))]
+    if NEAR_DUPLICATE_DEDUP_ENABLED:
+        texts, metadatas, ids, _ = deduplicate_chunks(texts, metadatas, ids)
+
+    vector_store = _open_store(store, path, embedding_function, CHROMA_COLLECTION_METADATA)
+    for start in range(0, len(texts), BUILD_BATCH_SIZE):
+        end = start + BUILD_BATCH_SIZE
+        add_chunks(vector_store, texts[start:end], metadatas[start:end], ids[start:end])
+    return vector_store, text_store, len(texts)
+
+
+def evaluate_retriever(retriever, cases, k, repeat=3):
+    """
+    Score a retriever against gold cases.
+
+    A case's reciprocal rank is 1 / the rank of the first retrieved chunk
+    from an expected source; its recall is the share of expected sources
+    among the top k chunks' sources.
+
+    Returns:
+        tuple: (metrics dict, per-case results keyed by case id)
+    """
+    latencies, per_case = [], {}
+    for case in cases:
+        # Scored from one untimed query, which also warms caches for the timed repeats
+        docs = retriever.invoke(case["question"], k=k)
+        for _ in range(repeat):
+            start = time.perf_counter()
+            retriever.invoke(case["question"], k=k)
+            latencies.append(time.perf_counter() - start)
+
+        sources = [doc.metadata.get("source", "") for doc in docs]
+        expected = set(case["expected_sources"])
+        first = next((rank for rank, source in enumerate(sources, start=1) if source in expected), None)
+        per_case[case["id"]] = {
+            "sources": list(dict.fromkeys(sources)),
+            "first_relevant_rank": first,
+            "recall": round(len(expected & set(sources)) / len(expected), 4)
+        }
+
+    results = per_case.values()
+    metrics = {
+        "recall": round(float(np.mean([r["recall"] for r in results])), 4),
+        "hit_rate": round(float(np.mean([r["first_relevant_rank"] is not None for r in results])), 4),
+        "mrr": round(float(np.mean([1 / r["first_relevant_rank"] if r["first_relevant_rank"] else 0.0
+                                    for r in results])), 4),
+        "p50_ms": round(percentile_ms(latencies, 50), 2),
+        "p95_ms": round(percentile_ms(latencies, 95), 2)
+    }
+    return metrics, per_case
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+# Columns identifying one benchmark configuration, in result files and diffs
+RETRIEVAL_CONFIG_COLUMNS = ("embedding", "store", "mode", "strategy", "chunk_size", "chunk_overlap", "k")
+
+
+def run_retrieval(args):
+    """Recall@k, MRR and latency of retrieval over the gold set, across chunking, k and backends."""
+    from config import (FOLDER_PATH, BENCHMARK_RESULTS_PATH, CHUNKING_STRATEGY, CHUNK_SIZE, CHUNK_OVERLAP,
+                        CHUNK_MAX_TOKENS, CHUNK_OVERLAP_TOKENS, RETRIEVER_K, VECTOR_STORE_BACKEND,
+                        EMBEDDING_BACKEND, ONNX_QUANTIZE, HYBRID_SEARCH_ENABLED, HYBRID_FETCH_K, RRF_K)
+    from data_loader import read_txts_from_folder
+    from retrieval import create_retriever
+
+    gold = load_gold_set(args.gold)
+    cases = [case for case in gold["cases"] if case["expected_sources"]]
+    if not cases:
+        print("The gold set has no labelled cases; run 'python benchmark.py gold-set' and label them")
+        return []
+    if len(cases) < len(gold["cases"]):
+        print(f"Skipping {len(gold['cases']) - len(cases)} unlabelled cases")
+
+    strategy = args.strategy or CHUNKING_STRATEGY
+    sizes = args.chunk_sizes or [CHUNK_MAX_TOKENS if strategy == "tokens" else CHUNK_SIZE]
+    overlaps = args.chunk_overlaps or [CHUNK_OVERLAP_TOKENS if strategy == "tokens" else CHUNK_OVERLAP]
+    ks = args.k or [RETRIEVER_K]
+    stores = args.stores or [VECTOR_STORE_BACKEND]
+    embeddings = args.embeddings or [EMBEDDING_BACKEND if EMBEDDING_BACKEND != "onnx"
+                                     else f"onnx-{'int8' if ONNX_QUANTIZE else 'fp32'}"]
+    modes = args.modes or ["hybrid" if HYBRID_SEARCH_ENABLED else "dense"]
+
+    file_data = read_txts_from_folder(args.folder or FOLDER_PATH)
+    print(f"Gold set version {gold['version']}: {len(cases)} cases over {len(file_data)} documents")
+    missing = {source for case in cases for source in case["expected_sources"]} - {d["file_name"] for d in file_data}
+    if missing:
+        print(f"Warning: expected sources not in the corpus: {', '.join(sorted(missing))}")
+
+    rows, details = [], {}
+    for embedding in embeddings:
+        embedding_function = load_embedding_backend(embedding, args.threads)
+        for store, chunk_size, chunk_overlap in itertools.product(stores, sizes, overlaps):
+            if chunk_overlap >= chunk_size:
+                print(f"Skipping chunk_size={chunk_size} chunk_overlap={chunk_overlap}: overlap must be smaller")
+                continue
+            path = tempfile.mkdtemp(prefix=f"bench_retrieval_{store}_")
+            vector_store = None
+            try:
+                start = time.perf_counter()
+                vector_store, text_store, n_chunks = build_benchmark_index(
+                    file_data, store, embedding_function, make_splitter(strategy, chunk_size, chunk_overlap), path)
+                build_s = time.perf_counter() - start
+
+                for mode, k in itertools.product(modes, ks):
+                    retriever = create_retriever(vector_store, k=k, text_store=text_store, hybrid=mode == "hybrid")
+                    retriever.invoke(cases[0]["question"])  # warm up
+                    metrics, per_case = evaluate_retriever(retriever, cases, k, args.repeat)
+                    row = {"embedding": embedding, "store": store, "mode": mode, "strategy": strategy,
+                           "chunk_size": chunk_size, "chunk_overlap": chunk_overlap, "k": k,
+                           "chunks": n_chunks, "build_s": round(build_s, 2), **metrics}
+                    rows.append(row)
+                    details[" ".join(f"{c}={row[c]}" for c in RETRIEVAL_CONFIG_COLUMNS)] = per_case
+                    print(f"Finished {embedding} {store} {mode} size={chunk_size} overlap={chunk_overlap} k={k}")
+            finally:
+                # Release the store (Chroma holds its files open) before deleting them
+                vector_store = None
+                shutil.rmtree(path, ignore_errors=True)
+
+    print_table(rows)
+
+    result = {
+        "benchmark": "retrieval",
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "git_commit": _git_commit(),
+        "gold_set": {"version": gold["version"], "cases_sha256": gold["cases_sha256"], "cases": len(cases)},
+        "settings": {"hybrid_fetch_k": HYBRID_FETCH_K, "rrf_k": RRF_K, "repeat": args.repeat,
+                     "documents": sorted(d["file_name"] for d in file_data)},
+        "rows": rows,
+        "cases": details
+    }
+    os.makedirs(args.results_dir or BENCHMARK_RESULTS_PATH, exist_ok=True)
+    name = f"retrieval-{time.strftime('%Y%m%d-%H%M%S')}{'-' + args.label if args.label else ''}.json"
+    result_path = os.path.join(args.results_dir or BENCHMARK_RESULTS_PATH, name)
+    with open(result_path, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2, sort_keys=True, ensure_ascii=False)
+        f.write("\n")
+    print(f"Results written to {result_path}")
+    return rows
+
+
+def run_retrieval_diff(args):
+    """Compare two retrieval result files configuration by configuration."""
+    with open(args.old, encoding="utf-8") as f:
+        old = json.load(f)
+    with open(args.new, encoding="utf-8") as f:
+        new = json.load(f)
+    if old["gold_set"] != new["gold_set"]:
+        print(f"Warning: the runs used different gold sets (version {old['gold_set']['version']} "
+              f"vs {new['gold_set']['version']}), scores are not directly comparable")
+
+    def key(row):
+        return tuple(row[c] for c in RETRIEVAL_CONFIG_COLUMNS)
+
+    old_rows = {key(row): row for row in old["rows"]}
+    rows = []
+    for row in new["rows"]:
+        before = old_rows.get(key(row))
+        if before is None:
+            continue
+        diff = {c: row[c] for c in RETRIEVAL_CONFIG_COLUMNS}
+        for metric in ("recall", "mrr", "p50_ms", "p95_ms"):
+            diff[metric] = f"{before[metric]} -> {row[metric]} ({row[metric] - before[metric]:+.4g})"
+        rows.append(diff)
+    print_table(rows)
+    unmatched = len(new["rows"]) - len(rows)
+    if unmatched:
+        print(f"{unmatched} configurations only in {args.new}")
+
+    # Cases whose first relevant chunk moved, the usual cause of a recall or MRR change
+    for config, cases in new["cases"].items():
+        for case_id, result in cases.items():
+            before = old["cases"].get(config, {}).get(case_id)
+            if before and before["first_relevant_rank"] != result["first_relevant_rank"]:
+                print(f"{config}: {case_id} first relevant rank {before['first_relevant_rank']} "
+                      f"-> {result['first_relevant_rank']}")
+    return rows
+
+
+# Heavy modules that starting the app must not import; they load on first use
+DEFERRED_MODULES = [
+    "torch", "transformers", "sentence_transformers", "langchain_huggingface", "langchain_chroma",
+    "chromadb", "PyPDF2", "docx", "fitz", "groq"
+]
+
+
+def profile_imports(module):
+    """
+    Import a module in a fresh interpreter under -X importtime.
+
+    Args:
+        module (str): Module to import, e.g. "main"
+
+    Returns:
+        tuple: (import seconds, {top-level package: self seconds}, deferred modules that were loaded)
+    """
+    code = (f"import sys, time; start = time.perf_counter(); import {module}; "
+            "print(time.perf_counter() - start); "
+            f"print(','.join(m for m in {DEFERRED_MODULES!r} if m in sys.modules))")
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", code], capture_output=True, text=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__)))
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed: {result.stderr.strip().splitlines()[-1]}")
+
+    output = result.stdout.splitlines()
+    seconds = float(output[-2])
+    loaded = [name for name in output[-1].split(",") if name]
+
+    # Lines look like "import time:  self [us] | cumulative | imported package"
+    packages = {}
+    for line in result.stderr.splitlines():
+        parts = line[len("import time:"):].split("|")
+        if not line.startswith("import time:") or len(parts) != 3 or not parts[0].strip().isdigit():
+            continue
+        package = parts[2].strip().split(".")[0]
+        packages[package] = packages.get(package, 0.0) + int(parts[0]) / 1e6
+    return seconds, packages, loaded
+
+
+def run_startup(args):
+    """Break down the import time of the app and fail on regressions."""
+    runs = [profile_imports(args.module) for _ in range(args.repeat)]
+    seconds, packages, loaded = min(runs, key=lambda run: run[0])
+    total = sum(packages.values())
+
+    rows = [{"package": package, "self_ms": round(1000 * spent, 1), "share_pct": round(100 * spent / total, 1)}
+            for package, spent in sorted(packages.items(), key=lambda item: item[1], reverse=True)[:args.top]]
+    print_table(rows)
+    print(f"import {args.module}: {seconds:.3f}s (best of {args.repeat})")
+
+    failures = []
+    if loaded:
+        failures.append(f"deferred modules imported at startup: {', '.join(loaded)}")
+    if args.budget and seconds > args.budget:
+        failures.append(f"import took {seconds:.3f}s, budget is {args.budget:.3f}s")
+    for failure in failures:
+        print(f"REGRESSION: {failure}")
+    if failures:
+        raise SystemExit(1)
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Retrieval benchmarks")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    backends = subparsers.add_parser("backends", help="Compare vector store backends")
+    backends.add_argument("--sizes", type=int, nargs="+", default=[1000, 5000, 20000])
+    backends.add_argument("--queries", type=int, default=200)
+    backends.add_argument("--k", type=int, default=10)
+    backends.add_argument("--backends", nargs="+", default=["chroma", "numpy"])
+    backends.set_defaults(func=run_backends)
+
+    quantization = subparsers.add_parser("quantization", help="Recall@k vs memory of compact vector storage")
+    quantization.add_argument("--source", choices=["auto", "numpy", "chroma", "synthetic"], default="auto")
+    quantization.add_argument("--queries", type=int, default=200)
+    quantization.add_argument("--k", type=int, default=10)
+    quantization.add_argument("--rescore-factor", type=int, default=4)
+    quantization.set_defaults(func=run_quantization)
+
+    hnsw = subparsers.add_parser("hnsw", help="Sweep Chroma HNSW parameters")
+    hnsw.add_argument("--source", choices=["auto", "numpy", "chroma", "synthetic"], default="auto")
+    hnsw.add_argument("--queries", type=int, default=200)
+    hnsw.add_argument("--k", type=int, default=10)
+    hnsw.add_argument("--space", nargs="+", default=["l2", "cosine"])
+    hnsw.add_argument("--m", type=int, nargs="+", default=[8, 16, 32])
+    hnsw.add_argument("--construction-ef", type=int, nargs="+", default=[100, 200])
+    hnsw.add_argument("--search-ef", type=int, nargs="+", default=[10, 50, 100])
+    hnsw.set_defaults(func=run_hnsw)
+
+    chunking = subparsers.add_parser("chunking", help="Chunks exceeding the embedding model's input window")
+    chunking.add_argument("--folder", help="Folder of documents, defaults to FOLDER_PATH")
+    chunking.add_argument("--strategies", nargs="+", choices=["sentences", "tokens"], default=["sentences", "tokens"])
+    chunking.set_defaults(func=run_chunking)
+
+    dedupe = subparsers.add_parser("dedupe", help="Chunks saved by near-duplicate detection")
+    dedupe.add_argument("--folder", help="Folder of documents, defaults to FOLDER_PATH")
+    dedupe.add_argument("--thresholds", type=float, nargs="+", default=[0.7, 0.8, 0.85, 0.9])
+    dedupe.add_argument("--dim", type=int, default=768, help="Embedding dimension")
+    dedupe.set_defaults(func=run_dedupe)
+
+    startup = subparsers.add_parser("startup", help="Import-time breakdown and startup regression check")
+    startup.add_argument("--module", default="main", help="Module whose import is measured")
+    startup.add_argument("--repeat", type=int, default=3)
+    startup.add_argument("--top", type=int, default=15, help="Packages shown in the breakdown")
+    startup.add_argument("--budget", type=float, help="Fail if the import takes longer, in seconds")
+    startup.set_defaults(func=run_startup)
+
+    embeddings = subparsers.add_parser("embeddings", help="Speed and recall of embedding backends")
+    embeddings.add_argument("--folder", help="Folder of documents, defaults to FOLDER_PATH")
+    embeddings.add_argument("--backends", nargs="+", choices=["huggingface", "onnx-fp32", "onnx-int8"],
+                            default=["huggingface", "onnx-fp32", "onnx-int8"],
+                            help="The first backend is the reference for speedup and recall")
+    embeddings.add_argument("--threads", type=int, help="ONNX Runtime intra-op threads")
+    embeddings.add_argument("--queries", type=int, default=100)
+    embeddings.add_argument("--limit", type=int, help="Embed only the first N chunks")
+    embeddings.add_argument("--k", type=int, default=5)
+    embeddings.set_defaults(func=run_embeddings)
+
+    gold_set = subparsers.add_parser("gold-set", help="Sync the retrieval gold set with TEST CASES.txt")
+    gold_set.add_argument("--gold", help="Gold set file, defaults to BENCHMARK_GOLD_SET_PATH")
+    gold_set.add_argument("--test-cases", help="Test cases file, defaults to TEST CASES.txt")
+    gold_set.set_defaults(func=run_gold_set)
+
+    retrieval = subparsers.add_parser("retrieval", help="Recall@k, MRR and latency over the gold set")
+    retrieval.add_argument("--gold", help="Gold set file, defaults to BENCHMARK_GOLD_SET_PATH")
+    retrieval.add_argument("--folder", help="Folder of documents, defaults to FOLDER_PATH")
+    retrieval.add_argument("--strategy", choices=["sentences", "tokens"],
+                           help="Chunking strategy, defaults to CHUNKING_STRATEGY")
+    retrieval.add_argument("--chunk-sizes", type=int, nargs="+",
+                           help="CHUNK_SIZE values in sentences, or CHUNK_MAX_TOKENS values for --strategy tokens")
+    retrieval.add_argument("--chunk-overlaps", type=int, nargs="+",
+                           help="CHUNK_OVERLAP values, or CHUNK_OVERLAP_TOKENS values for --strategy tokens")
+    retrieval.add_argument("--k", type=int, nargs="+", help="RETRIEVER_K values")
+    retrieval.add_argument("--stores", nargs="+", choices=["chroma", "numpy"], help="Vector store backends")
+    retrieval.add_argument("--embeddings", nargs="+", choices=["huggingface", "onnx-fp32", "onnx-int8"],
+                           help="Embedding backends")
+    retrieval.add_argument("--modes", nargs="+", choices=["hybrid", "dense"], help="Hybrid or dense-only search")
+    retrieval.add_argument("--threads", type=int, help="ONNX Runtime intra-op threads")
+    retrieval.add_argument("--repeat", type=positive_int, default=3, help="Timed queries per case")
+    retrieval.add_argument("--results-dir", help="Defaults to BENCHMARK_RESULTS_PATH")
+    retrieval.add_argument("--label", help="Appended to the result file name, e.g. a branch name")
+    retrieval.set_defaults(func=run_retrieval)
+
+    retrieval_diff = subparsers.add_parser("retrieval-diff", help="Compare two retrieval result files")
+    retrieval_diff.add_argument("old", help="Earlier result file")
+    retrieval_diff.add_argument("new", help="Later result file")
+    retrieval_diff.set_defaults(func=run_retrieval_diff)
+
+    args = parser.parse_args()
+    rows = args.func(args)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(rows, f, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+import math
+import re
+import heapq
+import threading
+from collections import Counter
+from config import BM25_K1, BM25_B
+
+# Metadata fields kept in the metadata index for pre-filtered search
+FILTER_FIELDS = ('source', 'code', 'department', 'revision', 'doc_type')
+
+
+def tokenize(text):
+    """
+    Tokenize text for lexical search.
+
+    Document codes such as "QAG2059" stay a single token so they can be
+    matched exactly.
+
+    Args:
+        text (str): The text to tokenize
+
+    Returns:
+        list: Lowercase alphanumeric tokens
+    """
+    return re.findall(r'[a-z0-9]+', text.lower())
+
+
+class BM25Index:
+    """
+    In-memory inverted index scored with Okapi BM25.
+
+    Documents are appended incrementally, so the index can follow the vector
+    store as files are uploaded without being rebuilt. A second inverted
+    index over FILTER_FIELDS restricts searches to matching documents.
+    """
+
+    def __init__(self, k1=BM25_K1, b=BM25_B):
+        """
+        Initialize an empty index.
+
+        Args:
+            k1 (float): Term frequency saturation
+            b (float): Document length normalization
+        """
+        self.k1 = k1
+        self.b = b
+        self.postings = {}  # term -> {doc index: term frequency}
+        self.field_index = {}  # (field, value) -> set of doc indices
+        self.doc_lengths = []
+        self.ids = []
+        self.texts = []
+        self.metadatas = []
+        self._id_to_index = {}
+        self._total_length = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.ids)
+
+    def add(self, texts, metadatas=None, ids=None, stored_texts=None):
+        """
+        Add documents to the index. Documents whose id is already indexed are skipped.
+
+        Args:
+            texts (list): Document texts
+            metadatas (list, optional): Metadata dictionaries, one per text
+            ids (list, optional): Document ids, one per text
+            stored_texts (list, optional): Texts returned with search hits, defaults
+                to texts. Callers that can load texts on demand pass empty strings.
+        """
+        metadatas = metadatas or [{} for _ in texts]
+        ids = ids or [f"bm25_{len(self.ids) + i}" for i in range(len(texts))]
+        stored_texts = texts if stored_texts is None else stored_texts
+
+        with self._lock:
+            for text, metadata, doc_id, stored_text in zip(texts, metadatas, ids, stored_texts):
+                if doc_id in self._id_to_index:
+                    continue
+
+                # Index the source file name too, it usually carries the SOP code
+                tokens = tokenize(f"{metadata.get('source', '')} {text}")
+                index = len(self.ids)
+                for term, count in Counter(tokens).items():
+                    self.postings.setdefault(term, {})[index] = count
+
+                for field in FILTER_FIELDS:
+                    if metadata.get(field):
+                        self.field_index.setdefault((field, metadata[field]), set()).add(index)
+
+                self.doc_lengths.append(len(tokens))
+                self._total_length += len(tokens)
+                self.ids.append(doc_id)
+                self.texts.append(stored_text)
+                self.metadatas.append(metadata)
+                self._id_to_index[doc_id] = index
+
+    def update_metadatas(self, ids, metadatas):
+        """
+        Replace the metadata returned with search hits of indexed documents.
+
+        Filter fields are not re-indexed, so the new metadata must keep their values.
+        """
+        with self._lock:
+            for doc_id, metadata in zip(ids, metadatas):
+                index = self._id_to_index.get(doc_id)
+                if index is not None:
+                    self.metadatas[index] = metadata
+
+    def _matching(self, filters):
+        """
+        Find the documents matching every filter.
+
+        Args:
+            filters (dict): Field name to a value or a list of accepted values
+
+        Returns:
+            set: Matching doc indices, or None when there are no filters
+        """
+        if not filters:
+            return None
+
+        allowed = None
+        for field, accepted in filters.items():
+            if not isinstance(accepted, (list, tuple, set)):
+                accepted = [accepted]
+            matches = set()
+            for value in accepted:
+                matches |= self.field_index.get((field, value), set())
+            allowed = matches if allowed is None else allowed & matches
+        return allowed
+
+    def values(self, field, filters=None):
+        """
+        List the distinct values of a metadata field.
+
+        Args:
+            field (str): One of FILTER_FIELDS
+            filters (dict, optional): Only consider documents matching these filters
+
+        Returns:
+            list: Sorted distinct values
+        """
+        with self._lock:
+            allowed = self._matching(filters)
+            return sorted(
+                value for (name, value), indices in self.field_index.items()
+                if name == field and (allowed is None or indices & allowed)
+            )
+
+    def search(self, query, k=10, filters=None):
+        """
+        Return the k best matching documents for a query.
+
+        Args:
+            query (str): The search query
+            k (int): Number of results to return
+            filters (dict, optional): Field name to a value or a list of accepted values
+
+        Returns:
+            list: (doc id, text, metadata, score) tuples, best first
+        """
+        with self._lock:
+            n_docs = len(self.ids)
+            if n_docs == 0:
+                return []
+
+            allowed = self._matching(filters)
+            if allowed is not None and not allowed:
+                return []
+
+            avg_length = self._total_length / n_docs
+            scores = {}
+
+            for term in set(tokenize(query)):
+                postings = self.postings.get(term)
+                if not postings:
+                    continue
+
+                idf = math.log(1 + (n_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+                for index, tf in postings.items():
+                    if allowed is not None and index not in allowed:
+                        continue
+                    norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[index] / avg_length)
+                    scores[index] = scores.get(index, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+
+            best = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+            return [(self.ids[i], self.texts[i], self.metadatas[i], score) for i, score in best]
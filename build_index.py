@@ -0,0 +1,162 @@
+"""
+Build the search index offline and package it for serving.
+
+Usage:
+    python build_index.py build [--folder "goofiya data"] [--workers 4] [--output bundles] [--activate] [--profile]
+    python build_index.py verify bundles/index-chroma-<version>.tar
+    python build_index.py install bundles/index-chroma-<version>.tar [--no-activate]
+
+Serving replicas start from a bundle by setting INDEX_BUNDLE_PATH, or by
+running `install` before the app starts.
+"""
+import os
+import sys
+import time
+import shutil
+import argparse
+from config import FOLDER_PATH, RETRIEVER_K
+from profiling import profile_request
+
+
+def print_progress(stage, fraction, start_time, width=30):
+    """Draw a single-line progress bar with elapsed time."""
+    filled = int(width * fraction)
+    elapsed = time.perf_counter() - start_time
+    sys.stdout.write(f"\r{stage:<24} [{'#' * filled}{' ' * (width - filled)}] {fraction:6.1%}  {elapsed:7.1f}s")
+    sys.stdout.flush()
+    if fraction >= 1.0:
+        sys.stdout.write("\n")
+
+
+def directory_size(path):
+    """Total size in bytes of the files under a directory."""
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+
+
+def run_build(args):
+    """Extract, chunk, embed and index the corpus, then write a bundle."""
+    with profile_request("build", "offline", args.profile):
+        return _run_build(args)
+
+
+def _run_build(args):
+    from data_loader import read_txts_from_folder
+    from retrieval import create_retriever
+    from vector_store import get_text_store
+    from index_manager import build_index_version, count_chunks, sanity_check
+    from index_versions import current_index_path, set_current
+    from index_bundle import create_bundle
+
+    total_start = time.perf_counter()
+
+    # 1. Text extraction, files in parallel
+    folder = args.folder or FOLDER_PATH
+    start = time.perf_counter()
+    file_data = read_txts_from_folder(
+        folder, workers=args.workers,
+        progress_callback=lambda name, done, total: print_progress("Extracting text", done / total, start)
+    )
+    extraction_s = time.perf_counter() - start
+    if not file_data:
+        print(f"No documents found in {folder}")
+        return 1
+    characters = sum(len(data["content"]) for data in file_data)
+    print(f"Extracted {len(file_data)} files, {characters:,} characters in {extraction_s:.1f}s")
+
+    # 2. Chunking, embedding and indexing into a new version directory
+    start = time.perf_counter()
+    index_path, vector_store = build_index_version(
+        file_data, quiet=True,
+        progress_callback=lambda stage, fraction: print_progress(stage, fraction, start)
+    )
+    indexing_s = time.perf_counter() - start
+    n_chunks = count_chunks(vector_store)
+    print(f"Indexed {n_chunks} chunks in {indexing_s:.1f}s ({n_chunks / max(indexing_s, 1e-9):.1f} chunks/s)")
+
+    # 3. Sanity check before anything is shipped or activated
+    retriever = create_retriever(vector_store, k=RETRIEVER_K, text_store=get_text_store(index_path))
+    passed, detail = sanity_check(retriever)
+    print(f"Sanity check {'passed' if passed else 'FAILED'}: {detail}")
+    if not passed:
+        shutil.rmtree(index_path, ignore_errors=True)
+        return 1
+
+    stats = {
+        "files": len(file_data),
+        "characters": characters,
+        "chunks": n_chunks,
+        "extraction_s": round(extraction_s, 2),
+        "indexing_s": round(indexing_s, 2),
+        "chunks_per_s": round(n_chunks / max(indexing_s, 1e-9), 1),
+        "index_bytes": directory_size(index_path),
+        "sanity_check": detail
+    }
+
+    # 4. Bundle, and optionally make the new version live locally
+    bundle_path = create_bundle(index_path, args.output, stats)
+    print(f"Wrote {bundle_path} ({os.path.getsize(bundle_path) / 1e6:.1f} MB)")
+
+    if args.activate:
+        set_current(index_path, previous_path=current_index_path())
+        print(f"Activated index version {os.path.basename(index_path)}")
+    else:
+        shutil.rmtree(index_path, ignore_errors=True)
+
+    print(f"Done in {time.perf_counter() - total_start:.1f}s")
+    return 0
+
+
+def run_verify(args):
+    """Check a bundle against its checksum file and print its manifest summary."""
+    from index_bundle import verify_bundle_checksum, read_manifest
+
+    if not verify_bundle_checksum(args.bundle):
+        print(f"Checksum mismatch for {args.bundle}")
+        return 1
+    manifest = read_manifest(args.bundle)
+    print(f"Bundle {manifest['version']}: {manifest['backend']} index embedded with {manifest['embedding_model']}")
+    print(f"Created {manifest['created']}, {len(manifest['files'])} files")
+    for name, value in manifest.get("stats", {}).items():
+        print(f"  {name}: {value}")
+    return 0
+
+
+def run_install(args):
+    """Install a bundle as a new index version."""
+    from index_bundle import install_bundle
+
+    start = time.perf_counter()
+    index_path = install_bundle(args.bundle, activate=not args.no_activate)
+    state = "installed" if args.no_activate else "installed and activated"
+    print(f"Index version {os.path.basename(index_path)} {state} in {time.perf_counter() - start:.1f}s")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline index builds")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    build = subparsers.add_parser("build", help="Build the index and write a bundle")
+    build.add_argument("--folder", help="Folder of documents, defaults to FOLDER_PATH")
+    build.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Files extracted concurrently")
+    build.add_argument("--output", default="bundles", help="Folder the bundle is written to")
+    build.add_argument("--activate", action="store_true", help="Also make the new version live locally")
+    build.add_argument("--profile", action="store_true",
+                       help="Write a CPU and allocation profile of the build (PROFILING_MODE \"on_demand\")")
+    build.set_defaults(func=run_build)
+
+    verify = subparsers.add_parser("verify", help="Check a bundle's checksums")
+    verify.add_argument("bundle")
+    verify.set_defaults(func=run_verify)
+
+    install = subparsers.add_parser("install", help="Install a bundle as the live index")
+    install.add_argument("bundle")
+    install.add_argument("--no-activate", action="store_true", help="Install without making it live")
+    install.set_defaults(func=run_install)
+
+    args = parser.parse_args()
+    sys.exit(args.func(args))
+
+
+if __name__ == "__main__":
+    main()
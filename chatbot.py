@@ -1,6 +1,6 @@
 import re
-import groq
 import time # Add time import for potential delays if needed
+from functools import lru_cache
 from config import (
     GROQ_API_KEY, 
     PREMIUM_LLM_MODEL_NAME,
@@ -8,14 +8,24 @@ from config import (
     TEMPERATURE,
     TOP_P,
     SYSTEM_PROMPT_CHAT,
-    SYSTEM_PROMPT_REPORT
+    SYSTEM_PROMPT_REPORT,
+    CONTEXT_COMPRESSION_ENABLED,
+    COMPRESSION_MAX_SENTENCES,
+    COMPRESSION_MAX_SENTENCES_PER_CHUNK
 )
+from context_compression import compress_documents
+from metrics import RequestMetrics
+from tracing import NOOP_SPAN, start_span, trace, use_span
+from profiling import profiled_stream
 # Update imports for the newer LangChain version
 from langchain_core.messages import HumanMessage, AIMessage
 from langchain_core.chat_history import BaseChatMessageHistory
 
-# Initialize Groq client
-client = groq.Groq(api_key=GROQ_API_KEY)
+@lru_cache(maxsize=1)
+def get_groq_client():
+    """Create the Groq client on first use, so importing this module stays cheap."""
+    import groq
+    return groq.Groq(api_key=GROQ_API_KEY)
 
 # Create a simple chat message history implementation
 class InMemoryChatMessageHistory(BaseChatMessageHistory):
@@ -159,7 +169,70 @@ def truncate_context(context, max_tokens=MAX_CONTEXT_TOKENS):
         
     return truncated + "\n\n[Note: Some context was truncated to fit token limits]"
 
-def get_bot_response(user_query, retriever, is_report_mode=False, use_premium_model=True, session_id="default"):
+def compress_context(user_query, context_docs, retriever, context, is_report_mode=False):
+    """
+    Compress retrieved chunks down to their most query-relevant sentences.
+    
+    Args:
+        user_query (str): The user's query
+        context_docs (list): Documents returned by the retriever
+        retriever: The document retriever object, used to find its embedding function
+        context (str): The uncompressed context, returned if compression is unavailable
+        is_report_mode (bool): Reports keep a larger sentence budget
+    
+    Returns:
+        str: Compressed context
+    """
+    if not CONTEXT_COMPRESSION_ENABLED:
+        return context
+    
+    vectorstore = getattr(retriever, "vectorstore", None)
+    embedding_function = getattr(vectorstore, "embeddings", None)
+    if embedding_function is None:
+        return context
+    
+    # Reports need far more supporting detail than a chat answer
+    scale = 3 if is_report_mode else 1
+    try:
+        compressed = compress_documents(user_query, context_docs, embedding_function,
+                                        max_sentences=COMPRESSION_MAX_SENTENCES * scale,
+                                        max_per_chunk=COMPRESSION_MAX_SENTENCES_PER_CHUNK * scale)
+        return compressed or context
+    except Exception as e:
+        print(f"Error compressing context, using full context: {str(e)}")
+        return context
+
+def estimate_tokens(text):
+    """Approximate token count, using the same 4 characters per token as truncate_context."""
+    return len(text) // 4
+
+def record_llm_usage(metrics, messages, response, usage, llm_start, first_token_at):
+    """
+    Record token counts and generation speed of an LLM call.
+    
+    Args:
+        metrics (RequestMetrics): Metrics of the request
+        messages (list): Messages sent to the LLM
+        response (str): The streamed response
+        usage: Usage reported by the API, None to estimate the counts from the text
+        llm_start (float): perf_counter() when the call was made
+        first_token_at (float): perf_counter() when the first token arrived, None if none did
+    """
+    if usage is not None:
+        prompt_tokens, completion_tokens = usage.prompt_tokens, usage.completion_tokens
+    else:
+        prompt_tokens = estimate_tokens("".join(message["content"] for message in messages))
+        completion_tokens = estimate_tokens(response)
+    end = time.perf_counter()
+    generation_s = end - first_token_at if first_token_at is not None else 0.0
+    metrics.stages["llm_generation"] = generation_s
+    metrics.set(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens,
+                tokens_estimated=usage is None, response_chars=len(response),
+                completion_tokens_per_s=round(completion_tokens / generation_s, 1) if generation_s > 0 else None)
+
+@profiled_stream("chat")
+def get_bot_response(user_query, retriever, is_report_mode=False, use_premium_model=True, session_id="default", filters=None,
+                     profile=False):
     """
     Generate a response to the user query using the retriever and LLM, yielding chunks for streaming.
     
@@ -169,89 +242,146 @@ def get_bot_response(user_query, retriever, is_report_mode=False, use_premium_mo
         is_report_mode (bool): Whether to generate a detailed report
         use_premium_model (bool): Whether to use the premium LLM model
         session_id (str): Session identifier for chat history
+        filters (dict, optional): Metadata filters (e.g. {"department": "QA"}) restricting the search
+        profile (bool): Write a CPU and allocation profile of this request (PROFILING_MODE "on_demand")
         
     Yields:
         str: Chunks of the response from the LLM
     """
-    try:
-        # Retrieve context based on the user query
-        context_docs = retriever.invoke(user_query)
-        context = "\n".join([doc.page_content for doc in context_docs])
-        if not context:
-            yield "I couldn't find any relevant information to answer your question. Please try rephrasing your query or check if the documents contain the information you're looking for."
-            return # Stop execution if no context
-    except Exception as e:
-        yield f"Error retrieving documents: {str(e)}"
-        return # Stop execution on error
-
-    # Truncate context to avoid token limit issues
-    context = truncate_context(context)
-
     model = PREMIUM_LLM_MODEL_NAME if use_premium_model else LLM_MODEL_NAME
+    metrics = RequestMetrics("report" if is_report_mode else "chat", session_id=session_id, model=model,
+                             filtered=bool(filters))
+    # Only made active between yields, so it cannot leak into the code consuming the stream
+    response_span = start_span("chatbot.get_bot_response", session_id=session_id, model=model,
+                               mode="report" if is_report_mode else "chat")
+    metrics.set(trace_id=response_span.trace_id)
+    pack_span = llm_span = NOOP_SPAN
+    try:
+        try:
+            # Retrieve context based on the user query; cache lookups below report to this request
+            with use_span(response_span), metrics.activate(), metrics.stage("retrieval"), \
+                    trace("retrieval", filtered=bool(filters)) as span:
+                if filters:
+                    context_docs = retriever.invoke(user_query, filters=filters)
+                else:
+                    context_docs = retriever.invoke(user_query)
+                span.set_attribute("chunks", len(context_docs))
+            context = "\n".join([doc.page_content for doc in context_docs])
+            metrics.set(retrieved_chunks=len(context_docs), retrieved_chars=len(context))
+            if not context:
+                metrics.error = "no context retrieved"
+                yield "I couldn't find any relevant information to answer your question. Please try rephrasing your query or check if the documents contain the information you're looking for."
+                return # Stop execution if no context
+        except Exception as e:
+            metrics.error = f"retrieval: {str(e)}"
+            yield f"Error retrieving documents: {str(e)}"
+            return # Stop execution on error
+
+        # Compression, truncation and prompt building share one span between retrieval and the LLM
+        pack_span = start_span("context.pack", parent=response_span)
+
+        # Keep only the sentences relevant to the query before truncating
+        with use_span(pack_span), metrics.activate(), metrics.stage("compression"):
+            compressed = compress_context(user_query, context_docs, retriever, context,
+                                          is_report_mode=is_report_mode)
+
+        # Truncate context to avoid token limit issues
+        with use_span(pack_span), metrics.stage("prompt"):
+            context = truncate_context(compressed)
+            metrics.set(context_chars=len(context), context_tokens=estimate_tokens(context))
+
+            # Get chat history for this session
+            chat_history = get_chat_history(session_id)
+            
+            # Add the new user message to history
+            chat_history.add_message(HumanMessage(content=user_query))
 
-    # Get chat history for this session
-    chat_history = get_chat_history(session_id)
-    
-    # Add the new user message to history
-    chat_history.add_message(HumanMessage(content=user_query))
-
-    # Prepare messages for the API call
-    messages = []
-    
-    if is_report_mode:
-        # Generate the single report prompt
-        messages = generate_report_prompt(context, user_query)
-    else:
-        # Standard chat mode - use history and context
-        messages.append({"role": "system", "content": SYSTEM_PROMPT_CHAT})
-        
-        # Add limited history for chat context
-        history_messages = chat_history.messages[-(MAX_HISTORY_MESSAGES*2)-1:-1] if len(chat_history.messages) > (MAX_HISTORY_MESSAGES*2 + 1) else chat_history.messages[:-1]
-        for msg in history_messages:
-            if isinstance(msg, HumanMessage):
-                messages.append({"role": "user", "content": msg.content})
-            elif isinstance(msg, AIMessage):
-                messages.append({"role": "assistant", "content": msg.content})
-        
-        # Add the current query with context
-        context_query = f"""Based on the following context, please answer my question:
+            # Prepare messages for the API call
+            messages = []
+            
+            if is_report_mode:
+                # Generate the single report prompt
+                messages = generate_report_prompt(context, user_query)
+            else:
+                # Standard chat mode - use history and context
+                messages.append({"role": "system", "content": SYSTEM_PROMPT_CHAT})
+                
+                # Add limited history for chat context
+                history_messages = chat_history.messages[-(MAX_HISTORY_MESSAGES*2)-1:-1] if len(chat_history.messages) > (MAX_HISTORY_MESSAGES*2 + 1) else chat_history.messages[:-1]
+                for msg in history_messages:
+                    if isinstance(msg, HumanMessage):
+                        messages.append({"role": "user", "content": msg.content})
+                    elif isinstance(msg, AIMessage):
+                        messages.append({"role": "assistant", "content": msg.content})
+                
+                # Add the current query with context
+                context_query = f"""Based on the following context, please answer my question:
             
 Context:
 {context}
 
 Question: {user_query}"""
-        messages.append({"role": "user", "content": context_query})
-
-    try:
-        # Enable streaming
-        stream = client.chat.completions.create(
-            messages=messages,
-            model=model,
-            temperature=TEMPERATURE,
-            top_p=TOP_P,
-            max_tokens=4096, 
-            stream=True, # Enable streaming
-        )
-        
-        full_response = ""
-        # Iterate over the stream and yield chunks
-        for chunk in stream:
-            content = chunk.choices[0].delta.content
-            if content:
-                yield content
-                full_response += content # Accumulate the full response
-        
-        # Add the complete response to chat history after streaming is finished
-        if full_response:
-             chat_history.add_message(AIMessage(content=full_response))
-
-    except Exception as e:
-        match = re.search(r"'message':\s*'(.*?)'", str(e))
-        if match:
-            error_message = match.group(1)
-        else:
-            error_message = str(e)
-        yield error_message
-        
-
-
+                messages.append({"role": "user", "content": context_query})
+        pack_span.set_attributes(context_chars=len(context), context_tokens=metrics.fields["context_tokens"],
+                                 messages=len(messages))
+        pack_span.end()
+
+        try:
+            # Enable streaming
+            llm_span = start_span("llm.stream", parent=response_span, model=model)
+            llm_start = time.perf_counter()
+            stream = get_groq_client().chat.completions.create(
+                messages=messages,
+                model=model,
+                temperature=TEMPERATURE,
+                top_p=TOP_P,
+                max_tokens=4096, 
+                stream=True, # Enable streaming
+            )
+            
+            full_response = ""
+            first_token_at = None
+            usage = None
+            # Iterate over the stream and yield chunks
+            for chunk in stream:
+                # Groq reports token usage on the last chunk
+                usage = getattr(getattr(chunk, "x_groq", None), "usage", None) or getattr(chunk, "usage", None) or usage
+                if not chunk.choices:
+                    continue
+                content = chunk.choices[0].delta.content
+                if content:
+                    if first_token_at is None:
+                        first_token_at = time.perf_counter()
+                        metrics.stages["llm_wait"] = first_token_at - llm_start
+                        metrics.mark_first_token()
+                        llm_span.add_event("first_token")
+                    yield content
+                    full_response += content # Accumulate the full response
+            
+            # Add the complete response to chat history after streaming is finished
+            if full_response:
+                 chat_history.add_message(AIMessage(content=full_response))
+            record_llm_usage(metrics, messages, full_response, usage, llm_start, first_token_at)
+            llm_span.set_attributes(prompt_tokens=metrics.fields.get("prompt_tokens"),
+                                    completion_tokens=metrics.fields.get("completion_tokens"))
+
+        except Exception as e:
+            match = re.search(r"'message':\s*'(.*?)'", str(e))
+            if match:
+                error_message = match.group(1)
+            else:
+                error_message = str(e)
+            metrics.error = f"llm: {error_message}"
+            llm_span.set_error(error_message)
+            yield error_message
+    except GeneratorExit:
+        # The client stopped reading mid-answer
+        metrics.error = metrics.error or "cancelled"
+        raise
+    finally:
+        pack_span.end()
+        llm_span.end()
+        if metrics.error:
+            response_span.set_error(metrics.error)
+        response_span.end()
+        metrics.finish()
@@ -0,0 +1,221 @@
+import os
+import zlib
+import hashlib
+import threading
+from collections import OrderedDict
+from langchain_core.documents import Document
+from config import TEXT_STORE_CACHE_SIZE
+from numpy_store import NumpyVectorStore
+from metrics import record_cache
+from tracing import trace
+
+# Metadata fields locating a chunk's window in its document's text
+DOC_KEY_FIELD = "doc_key"
+START_FIELD = "text_start"
+END_FIELD = "text_end"
+
+
+class DocumentTextStore:
+    """
+    Compressed store holding one copy of each document's chunkable text.
+
+    Chunks refer to their text by (doc_key, text_start, text_end) offsets
+    instead of carrying it, so text shared by overlapping chunks is stored
+    once. Windows are cut out when a retrieved chunk is returned, and
+    recently used documents are kept decompressed in an LRU cache.
+    """
+
+    def __init__(self, directory, cache_size=TEXT_STORE_CACHE_SIZE):
+        """
+        Initialize the store.
+
+        Args:
+            directory (str): Folder holding one compressed file per document
+            cache_size (int): Number of decompressed documents kept in memory
+        """
+        self.directory = directory
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _path(self, doc_key):
+        return os.path.join(self.directory, f"{doc_key}.txt.z")
+
+    def put(self, text):
+        """
+        Store a document's text.
+
+        Args:
+            text (str): The document's text, as chunk offsets index it
+
+        Returns:
+            str: Key of the document, derived from its text
+        """
+        doc_key = hashlib.sha256(text.encode("utf-8")).hexdigest()[:32]
+        path = self._path(doc_key)
+        if not os.path.exists(path):
+            os.makedirs(self.directory, exist_ok=True)
+
+            # Write to a temporary name first so a partial file is never read
+            temp_path = f"{path}.{os.getpid()}.tmp"
+            with open(temp_path, "wb") as f:
+                f.write(zlib.compress(text.encode("utf-8"), 6))
+            os.replace(temp_path, path)
+        return doc_key
+
+    def get(self, doc_key):
+        """
+        Load a document's text.
+
+        Args:
+            doc_key (str): Key returned by put()
+
+        Returns:
+            str: The document's text
+        """
+        with self._lock:
+            if doc_key in self._cache:
+                self._cache.move_to_end(doc_key)
+                record_cache("document_text", 1, 0)
+                return self._cache[doc_key]
+
+        record_cache("document_text", 0, 1)
+        with open(self._path(doc_key), "rb") as f:
+            text = zlib.decompress(f.read()).decode("utf-8")
+
+        with self._lock:
+            self._cache[doc_key] = text
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return text
+
+    def window(self, metadata):
+        """Cut a chunk's text out of its document using the offsets in its metadata."""
+        return self.get(metadata[DOC_KEY_FIELD])[metadata[START_FIELD]:metadata[END_FIELD]]
+
+    def materialize(self, documents):
+        """
+        Fill in the text of offset-stored chunks.
+
+        Args:
+            documents (list): Retrieved LangChain Documents
+
+        Returns:
+            list: Documents with their page_content restored; chunks stored
+                with their text inline are returned unchanged
+        """
+        materialized = []
+        for doc in documents:
+            if not doc.page_content and DOC_KEY_FIELD in doc.metadata:
+                try:
+                    doc = Document(page_content=self.window(doc.metadata), metadata=doc.metadata,
+                                   id=getattr(doc, "id", None))
+                except Exception as e:
+                    print(f"Error loading text of chunk {getattr(doc, 'id', None)}: {str(e)}")
+            materialized.append(doc)
+        return materialized
+
+    def size_on_disk(self):
+        """Total size of the stored documents in bytes."""
+        if not os.path.isdir(self.directory):
+            return 0
+        return sum(os.path.getsize(os.path.join(self.directory, name)) for name in os.listdir(self.directory))
+
+
+def is_offset_chunk(metadata):
+    """Whether a chunk refers to its text by offsets instead of carrying it."""
+    return DOC_KEY_FIELD in (metadata or {})
+
+
+def _chroma_collection(vector_store):
+    """
+    The chromadb collection underneath a langchain_chroma store.
+
+    langchain_chroma's public methods always store the text they embed and
+    cannot change metadata without embedding again, so storing vectors
+    without their text and updating metadata go through the collection.
+    This is the one place that reaches into the wrapper.
+
+    Returns:
+        chromadb Collection, or None if the wrapper no longer exposes it
+    """
+    collection = getattr(vector_store, "_collection", None)
+    if collection is None or not hasattr(collection, "upsert"):
+        return None
+    return collection
+
+
+def _chroma_add_vectors(vector_store, vectors, texts, stored_texts, metadatas, ids):
+    """
+    Store precomputed vectors in a Chroma vector store.
+
+    If the collection is not accessible, the chunks are added with
+    add_texts instead: they are embedded again and keep their full text
+    inline, which is correct but forgoes the savings.
+
+    Args:
+        vector_store: langchain_chroma Chroma store
+        vectors: Embeddings of the chunks
+        texts (list): Full chunk texts
+        stored_texts (list): Texts to store, empty for offset chunks
+        metadatas (list): Metadata dictionaries, one per chunk
+        ids (list): Chunk ids, one per chunk
+    """
+    collection = _chroma_collection(vector_store)
+    if collection is None:
+        print("Chroma collection not accessible, storing chunk texts inline")
+        vector_store.add_texts(texts=texts, metadatas=metadatas, ids=ids)
+        return
+    collection.upsert(ids=ids, embeddings=vectors, metadatas=metadatas, documents=stored_texts)
+
+
+def update_chunk_metadatas(vector_store, ids, metadatas):
+    """
+    Replace the metadata of stored chunks without embedding them again.
+
+    Args:
+        vector_store: Chroma or NumpyVectorStore
+        ids (list): Chunk ids
+        metadatas (list): New metadata dictionaries, one per id
+    """
+    if isinstance(vector_store, NumpyVectorStore):
+        vector_store.update_metadatas(ids, metadatas)
+        return
+    collection = _chroma_collection(vector_store)
+    if collection is None:
+        print("Chroma collection not accessible, chunk metadata not updated")
+        return
+    collection.update(ids=ids, metadatas=metadatas)
+
+
+def add_chunks(vector_store, texts, metadatas, ids):
+    """
+    Embed chunks and add them to a vector store.
+
+    Chunks whose metadata holds text offsets are embedded from their text
+    but stored with an empty document, so the vector store does not keep a
+    second copy of text already in the DocumentTextStore.
+
+    Args:
+        vector_store: Chroma or NumpyVectorStore
+        texts (list): Chunk texts
+        metadatas (list): Metadata dictionaries, one per chunk
+        ids (list): Chunk ids, one per chunk
+    """
+    if not any(is_offset_chunk(metadata) for metadata in metadatas):
+        with trace("vector_store.add_texts", chunks=len(texts)):
+            vector_store.add_texts(texts=texts, metadatas=metadatas, ids=ids)
+        return
+
+    embeddings = vector_store.embeddings
+    with trace("vector_store.embed_documents", chunks=len(texts)):
+        if hasattr(embeddings, "embed_array"):
+            # The embedding server's float32 buffer, without a round trip through Python lists
+            vectors = embeddings.embed_array(texts)
+        else:
+            vectors = embeddings.embed_documents(list(texts))
+    stored_texts = ["" if is_offset_chunk(metadata) else text for text, metadata in zip(texts, metadatas)]
+    if isinstance(vector_store, NumpyVectorStore):
+        vector_store.add_vectors(vectors, stored_texts, metadatas, ids)
+    else:
+        _chroma_add_vectors(vector_store, vectors, texts, stored_texts, metadatas, ids)
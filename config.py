@@ -9,16 +9,73 @@ BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
 # Paths
 CHROMA_INDEX_PATH = os.path.join(BASE_DIR, "chroma_embeddings")
+NUMPY_INDEX_PATH = os.path.join(BASE_DIR, "numpy_embeddings")
 FOLDER_PATH = os.path.join(BASE_DIR, "goofiya data")
 UPLOAD_FOLDER = os.path.join(BASE_DIR, "uploads")
+TEXT_CACHE_PATH = os.path.join(BASE_DIR, "text_cache")
+INDEX_VERSIONS_PATH = os.path.join(BASE_DIR, "indexes")
 
 # RAG Configuration
 RETRIEVER_SEARCH_DISTANCE = 0.5  # Similarity threshold for retrieval
 RETRIEVER_K = 5  # Number of documents to retrieve
 
+# Vector Store Configuration
+# "chroma": SQLite + HNSW approximate search
+# "numpy": exact brute-force search over a memory-mapped float32 matrix, fastest for small corpora
+VECTOR_STORE_BACKEND = os.environ.get("VECTOR_STORE_BACKEND", "chroma")
+# Precision of the in-memory vectors searched by the numpy backend: "float32", "float16" or "int8".
+# Compact types cut memory 2x / 4x; the best candidates are rescored against float32 rows on disk.
+NUMPY_VECTOR_DTYPE = "float32"
+QUANTIZED_RESCORE_FACTOR = 4  # Candidates rescored at full precision per requested result
+
+# Chroma HNSW index parameters, applied when the collection is first created
+# (run `python benchmark.py hnsw` to measure recall and latency for other values)
+CHROMA_HNSW_SPACE = "l2"  # Distance metric: "l2", "cosine" or "ip"
+CHROMA_HNSW_M = 16  # Graph links per node, higher improves recall at the cost of memory
+CHROMA_HNSW_CONSTRUCTION_EF = 100  # Candidate list size while building the graph
+CHROMA_HNSW_SEARCH_EF = 100  # Candidate list size while querying, higher improves recall; keep it above HYBRID_FETCH_K
+CHROMA_COLLECTION_METADATA = {
+    "hnsw:space": CHROMA_HNSW_SPACE,
+    "hnsw:M": CHROMA_HNSW_M,
+    "hnsw:construction_ef": CHROMA_HNSW_CONSTRUCTION_EF,
+    "hnsw:search_ef": CHROMA_HNSW_SEARCH_EF,
+}
+
+# Hybrid Retrieval Configuration
+HYBRID_SEARCH_ENABLED = True  # Fuse BM25 keyword search with dense vector search
+HYBRID_FETCH_K = 20  # Candidates taken from each search leg before fusion
+RRF_K = 60  # Reciprocal rank fusion constant, higher flattens the rank weighting
+BM25_K1 = 1.5  # Term frequency saturation
+BM25_B = 0.75  # Document length normalization
+
+# PDF Extraction Configuration
+PDF_EXTRACTOR = "auto"  # "auto" (PyMuPDF when installed, else PyPDF2), "pymupdf" or "pypdf2"
+PDF_EXTRACTION_WORKERS = None  # Worker processes for large PDFs, None uses every CPU
+PDF_PAGES_PER_SHARD = 16  # Pages extracted per worker task
+TEXT_CACHE_ENABLED = True  # Reuse extracted text of unchanged files, keyed by content hash and extractor version
+
 # Text Processing Configuration
-CHUNK_SIZE = 20  # Number of sentences per chunk
-CHUNK_OVERLAP = 5  # Overlap between chunks
+CHUNKING_STRATEGY = "tokens"  # "tokens": fill chunks up to the embedding model's input window, "sentences": fixed sentence count
+CHUNK_MAX_TOKENS = 384  # Maximum sequence length of the embedding model, longer input is truncated
+CHUNK_OVERLAP_TOKENS = 64  # Tokens of whole sentences shared between consecutive chunks
+TOKENIZE_BATCH_SIZE = 256  # Sentences tokenized per tokenizer call
+# "offsets": chunks point into one compressed copy of their document, so overlapping text is stored once.
+# "inline": every chunk's full text is stored in the vector store.
+CHUNK_TEXT_STORAGE = "offsets"
+TEXT_STORE_CACHE_SIZE = 64  # Decompressed documents kept in memory for materializing retrieved chunks
+NEAR_DUPLICATE_DEDUP_ENABLED = True  # Store one canonical copy of boilerplate chunks repeated across documents
+NEAR_DUPLICATE_THRESHOLD = 0.85  # Estimated Jaccard similarity of word shingles above which chunks are copies
+MINHASH_PERMUTATIONS = 128  # MinHash signature length
+MINHASH_BANDS = 16  # LSH bands, must divide MINHASH_PERMUTATIONS
+MINHASH_SHINGLE_SIZE = 5  # Words per shingle
+CHUNK_SIZE = 20  # Number of sentences per chunk ("sentences" strategy)
+CHUNK_OVERLAP = 5  # Overlap between chunks ("sentences" strategy)
+
+# Context Compression Configuration
+CONTEXT_COMPRESSION_ENABLED = True  # Keep only the retrieved sentences most relevant to the query
+COMPRESSION_MAX_SENTENCES = 12  # Sentences kept across all retrieved chunks
+COMPRESSION_MAX_SENTENCES_PER_CHUNK = 3  # Sentences kept from any single chunk
+COMPRESSION_CACHE_SIZE = 20000  # Sentence embeddings kept in memory
 
 # LLM Configuration
 # Groq API (Llama-3.1-70b-Instructy)
@@ -28,6 +85,16 @@ PREMIUM_LLM_MODEL_NAME = "llama-3.3-70b-versatile"  # Use premium model for bett
 
 # Embedding Model Configuration
 EMBEDDING_MODEL_NAME = "all-mpnet-base-v2"
+EMBEDDING_BACKEND = os.environ.get("EMBEDDING_BACKEND", "huggingface")  # "huggingface" (PyTorch fp32) or "onnx" (ONNX Runtime)
+ONNX_MODEL_PATH = os.path.join(BASE_DIR, "onnx_models")  # Exported models, created on first use of the "onnx" backend
+ONNX_QUANTIZE = True  # int8 dynamic quantization of the exported model's weights
+ONNX_NUM_THREADS = None  # Intra-op threads of ONNX Runtime, None uses every physical core
+ONNX_BATCH_SIZE = 32  # Texts per ONNX Runtime call
+# Shared embedding server (see embedding_server.py); when set and the socket exists, app processes
+# send texts to it instead of each loading the model
+EMBEDDING_SERVER_SOCKET = os.environ.get("EMBEDDING_SERVER_SOCKET")
+EMBEDDING_BATCH_WINDOW_MS = 5  # How long the server waits for more requests to join a batch
+EMBEDDING_MAX_BATCH = 64  # Texts per model call; a larger single request runs as its own batch
 
 # LLM Generation Parameters
 TEMPERATURE = 0.7    # Higher for more creative, lower for more deterministic
@@ -56,13 +123,53 @@ comprehensive yet focused on the specific query. Use precise language, industry-
 # Supported file types for upload
 SUPPORTED_FILE_TYPES = ["txt", "pdf", "docx"]
 
+# Upload ingestion
+INGEST_BATCH_SIZE = 32  # Chunks embedded and stored per batch, progress is reported per batch
+UPLOAD_POLL_INTERVAL = 1.0  # Seconds between UI refreshes of upload progress
+BUILD_BATCH_SIZE = 256  # Chunks embedded and stored per batch when building a whole index
+
+# Index Versioning Configuration
+INDEX_AUTO_REBUILD = True  # Rebuild in the background when the live index was built with other settings
+INDEX_SANITY_SAMPLES = 20  # Stored chunks queried to check a new index finds its own documents
+INDEX_SANITY_MIN_HIT_RATE = 0.8  # Share of sample queries that must return their source document
+INDEX_SANITY_MIN_CHUNK_RATIO = 0.5  # A new index must hold at least this share of the live index's chunks
+# Prebuilt index bundle (see build_index.py) installed at startup when there is no index yet,
+# or when it is not the bundle last applied
+INDEX_BUNDLE_PATH = os.environ.get("INDEX_BUNDLE_PATH")
+
+# HTTP API (see api.py)
+API_HOST = os.environ.get("API_HOST", "127.0.0.1")
+API_PORT = int(os.environ.get("API_PORT", "8000"))
+API_URL = os.environ.get("API_URL")  # When set, the Streamlit UI is a client of this API instead of loading the index itself
+API_TIMEOUT = 300  # Seconds the UI waits on an API call, long enough for a full report stream
+
+# Request metrics (see metrics.py)
+METRICS_ENABLED = True  # Record per-request timings, token counts and cache hits
+METRICS_LOG_PATH = os.path.join(BASE_DIR, "logs", "requests.jsonl")  # One JSON line per request, None to disable
+LOG_MAX_BYTES = 10 * 2**20  # JSON-lines logs in logs/ are rotated once they reach this size
+LOG_BACKUP_COUNT = 3  # Rotated files kept per log (requests.jsonl.1 ...), older ones are deleted
+METRICS_PORT = int(os.environ["METRICS_PORT"]) if os.environ.get("METRICS_PORT") else None  # Prometheus endpoint of the Streamlit process; the API serves /metrics itself
+
+# Tracing (see tracing.py)
+TRACING_EXPORTER = os.environ.get("TRACING_EXPORTER", "none")  # "none", "file" or "otlp" (OTLP/HTTP JSON collector)
+TRACE_LOG_PATH = os.path.join(BASE_DIR, "logs", "traces.jsonl")  # Finished spans, one JSON line each ("file" exporter)
+OTLP_ENDPOINT = os.environ.get("OTEL_EXPORTER_OTLP_ENDPOINT", "http://localhost:4318")  # Collector base URL ("otlp" exporter)
+TRACE_SERVICE_NAME = os.environ.get("OTEL_SERVICE_NAME", "pharma-rag")
+TRACE_EXPORT_INTERVAL = 2.0  # Seconds between batched exports of finished spans
+
+# Profiling (see profiling.py)
+PROFILING_MODE = os.environ.get("PROFILING_MODE", "off")  # "off", "on_demand" (requests that ask for it) or "all"
+PROFILE_OUTPUT_PATH = os.path.join(BASE_DIR, "profiles")  # One report per profiled request
+PROFILE_SAMPLE_INTERVAL_MS = 5  # Stack sampling interval of the CPU profiler
+PROFILE_ALLOCATIONS = True  # Track allocations with tracemalloc while a profiled request runs
+PROFILE_TOP_N = 25  # Functions and allocation sites listed in a report
+
+# Retrieval benchmark (see benchmark.py)
+BENCHMARK_GOLD_SET_PATH = os.path.join(BASE_DIR, "retrieval_gold_set.json")  # TEST CASES.txt questions with the documents answering them
+BENCHMARK_RESULTS_PATH = os.path.join(BASE_DIR, "benchmark_results")  # One JSON file per retrieval benchmark run
+
 # UI Configuration
 APP_TITLE = "Pharma RAG"
 APP_LAYOUT = "wide"
 APP_THEME = "dark"
-
-# Ensure necessary directories exist
-for directory in [CHROMA_INDEX_PATH, UPLOAD_FOLDER]:
-    if not os.path.exists(directory):
-        os.makedirs(directory)
-        print(f"Created directory: {directory}")
+CHAT_VISIBLE_TURNS = 10  # Chat turns rendered on each rerun; older ones load a page at a time on request
@@ -0,0 +1,143 @@
+import threading
+from collections import OrderedDict
+import numpy as np
+from config import (
+    COMPRESSION_MAX_SENTENCES,
+    COMPRESSION_MAX_SENTENCES_PER_CHUNK,
+    COMPRESSION_CACHE_SIZE
+)
+from text_utils import split_sentences
+from metrics import record_cache
+
+
+class SentenceEmbeddingCache:
+    """
+    Bounded LRU cache of normalized sentence embeddings.
+
+    The same chunks are retrieved again and again for related questions, so
+    caching per sentence means only sentences never seen before are embedded.
+    """
+
+    def __init__(self, max_size=COMPRESSION_CACHE_SIZE):
+        """
+        Initialize the cache.
+
+        Args:
+            max_size (int): Maximum number of sentence embeddings to keep
+        """
+        self.max_size = max_size
+        self._vectors = OrderedDict()
+        self._lock = threading.RLock()
+
+    def get_matrix(self, sentences, embedding_function):
+        """
+        Return a matrix with one normalized embedding row per sentence.
+
+        Args:
+            sentences (list): Sentences to embed
+            embedding_function: LangChain-compatible embedding function
+
+        Returns:
+            numpy.ndarray: float32 matrix of shape (len(sentences), dim)
+        """
+        with self._lock:
+            unique = dict.fromkeys(sentences)
+            missing = [s for s in unique if s not in self._vectors]
+        record_cache("sentence_embeddings", len(unique) - len(missing), len(missing))
+
+        fresh = {}
+        if missing:
+            # Embed every unseen sentence in a single batch
+            new_vectors = _normalize(np.asarray(embedding_function.embed_documents(missing), dtype=np.float32))
+            fresh = dict(zip(missing, new_vectors))
+
+        with self._lock:
+            self._vectors.update(fresh)
+            rows = []
+            for sentence in sentences:
+                vector = self._vectors.get(sentence)
+                if vector is None:
+                    # Evicted by a concurrent request since the lookup above, start over
+                    return self.get_matrix(sentences, embedding_function)
+                self._vectors.move_to_end(sentence)
+                rows.append(vector)
+
+            while len(self._vectors) > self.max_size:
+                self._vectors.popitem(last=False)
+
+        return np.vstack(rows)
+
+    def clear(self):
+        with self._lock:
+            self._vectors.clear()
+
+
+# Shared cache used by all sessions
+sentence_cache = SentenceEmbeddingCache()
+
+
+def _normalize(matrix):
+    """Scale rows to unit length so a dot product is the cosine similarity."""
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def compress_documents(query, documents, embedding_function,
+                       max_sentences=COMPRESSION_MAX_SENTENCES,
+                       max_per_chunk=COMPRESSION_MAX_SENTENCES_PER_CHUNK,
+                       cache=None):
+    """
+    Extract the sentences of the retrieved chunks that are most relevant to the query.
+
+    Every sentence is scored against the query embedding in one matrix-vector
+    product. The best sentences are kept, at most max_per_chunk per chunk, and
+    emitted in their original order so each chunk still reads naturally.
+
+    Args:
+        query (str): The user's query
+        documents (list): Retrieved LangChain Documents
+        embedding_function: LangChain-compatible embedding function
+        max_sentences (int): Maximum sentences kept in total
+        max_per_chunk (int): Maximum sentences kept from any one chunk
+        cache (SentenceEmbeddingCache, optional): Cache to use, defaults to the shared one
+
+    Returns:
+        str: Compressed context, one paragraph per chunk that kept any sentences
+    """
+    cache = cache or sentence_cache
+
+    sentences, owners = [], []
+    for doc_index, doc in enumerate(documents):
+        for sentence in split_sentences(doc.page_content):
+            sentences.append(sentence.strip())
+            owners.append(doc_index)
+
+    if not sentences:
+        return ""
+
+    # Nothing to drop, skip the embedding work entirely
+    if len(sentences) <= max_sentences and max(owners.count(i) for i in set(owners)) <= max_per_chunk:
+        return "\n\n".join(doc.page_content for doc in documents)
+
+    query_vector = _normalize(np.asarray(embedding_function.embed_query(query), dtype=np.float32))
+    scores = cache.get_matrix(sentences, embedding_function) @ query_vector
+
+    # Greedily take the best sentences while respecting the per-chunk cap
+    kept_per_chunk = {}
+    selected = []
+    for index in np.argsort(-scores, kind="stable"):
+        owner = owners[index]
+        if kept_per_chunk.get(owner, 0) >= max_per_chunk:
+            continue
+        kept_per_chunk[owner] = kept_per_chunk.get(owner, 0) + 1
+        selected.append(int(index))
+        if len(selected) >= max_sentences:
+            break
+
+    # Restore document order, then sentence order within each chunk
+    paragraphs = {}
+    for index in sorted(selected):
+        paragraphs.setdefault(owners[index], []).append(sentences[index])
+
+    return "\n\n".join(" ".join(paragraphs[owner]) for owner in sorted(paragraphs))
@@ -1,16 +1,26 @@
+import io
 import os
 import re
+import gzip
+import hashlib
 import tempfile
-from config import SUPPORTED_FILE_TYPES
-import PyPDF2
-import docx
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from config import (SUPPORTED_FILE_TYPES, PDF_EXTRACTOR, PDF_EXTRACTION_WORKERS, PDF_PAGES_PER_SHARD,
+                    TEXT_CACHE_PATH, TEXT_CACHE_ENABLED)
+from text_utils import PAGE_BREAK, SECTION_BREAK, TABLE_ROW
 
-def read_txts_from_folder(folder_path):
+def read_txts_from_folder(folder_path, workers=1, progress_callback=None):
     """
     Read content from text files in the specified folder.
     
     Args:
         folder_path (str): Path to the folder containing text files
+        workers (int): Files extracted concurrently
+        progress_callback (callable, optional): Called as progress_callback(file_name, done, total)
+            after each file
         
     Returns:
         list: List of dictionaries with file_name and content
@@ -22,33 +32,173 @@ def read_txts_from_folder(folder_path):
         print(f"Warning: Folder path does not exist: {folder_path}")
         return file_data
     
-    for file_name in os.listdir(folder_path):
+    files = []
+    for file_name in sorted(os.listdir(folder_path)):
         # Get file extension
         _, ext = os.path.splitext(file_name)
         ext = ext.lower().lstrip('.')
         
         if ext in SUPPORTED_FILE_TYPES:
-            file_path = os.path.join(folder_path, file_name)
-            try:
-                content = extract_text_from_file(file_path, ext)
-                if content:
-                    file_data.append({"file_name": file_name, "content": content})
-            except Exception as e:
-                print(f"Error processing file {file_name}: {str(e)}")
+            files.append((file_name, ext))
+    
+    def read_file(file):
+        file_name, ext = file
+        try:
+            return extract_text_from_file(os.path.join(folder_path, file_name), ext)
+        except Exception as e:
+            print(f"Error processing file {file_name}: {str(e)}")
+            return ""
+    
+    # Threads are enough here, large PDFs are split across processes by the PDF extractor
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        for done, ((file_name, _), content) in enumerate(zip(files, executor.map(read_file, files)), start=1):
+            if content:
+                file_data.append({"file_name": file_name, "content": content})
+            if progress_callback:
+                progress_callback(file_name, done, len(files))
     
     if not file_data:
         print(f"Warning: No supported files found in {folder_path}")
         
     return file_data
 
-def extract_text_from_file(file_path, file_type=None):
+# Document codes look like "QAG2059 05 Document Management...": three letter
+# series, four digit number, then a two digit revision
+DOCUMENT_CODE_PATTERN = re.compile(r'^([A-Z]{3})(\d{4})(?:[\s_-]+(\d{2})\b)?')
+
+def parse_file_metadata(file_name):
     """
-    Extract text content from a file based on its type
+    Parse structured metadata from a document file name.
+    
+    Args:
+        file_name (str): Name of the file, e.g. "ENO2113 03 Operation of RO plant.docx"
+        
+    Returns:
+        dict: code, department, revision, doc_type and file_type. Missing values are
+            empty strings because Chroma metadata cannot hold None.
+    """
+    stem, ext = os.path.splitext(os.path.basename(file_name))
+    match = DOCUMENT_CODE_PATTERN.match(stem.strip().upper())
+    
+    if match:
+        series, number, revision = match.groups()
+        code = f"{series}{number}"
+        # The first two letters of the series name the department (QA, QC, EN, ...)
+        department = series[:2]
+        doc_type = "sop"
+    else:
+        code, department, revision = "", "", None
+        doc_type = "guideline" if re.search(r'guide|gmp|annex', stem, re.IGNORECASE) else "document"
+    
+    return {
+        'code': code,
+        'department': department,
+        'revision': revision or "",
+        'doc_type': doc_type,
+        'file_type': ext.lower().lstrip('.')
+    }
+
+# Bump the version of a file type whenever its extractor output changes,
+# so text cached by the previous extractor is no longer used
+EXTRACTOR_VERSIONS = {
+    'txt': 1,
+    'pdf': 1,
+    'docx': 2
+}
+
+def extractor_version(file_type):
+    """
+    Identify the extractor that produces text for a file type.
     
     Args:
-        file_path (str): Path to the file
         file_type (str): Type/extension of the file (txt, pdf, docx)
         
+    Returns:
+        str: Version tag, e.g. "pdf-1-pymupdf"
+    """
+    version = f"{file_type}-{EXTRACTOR_VERSIONS[file_type]}"
+    if file_type == 'pdf':
+        # PDF backends lay out the same page differently
+        version = f"{version}-{get_pdf_backend()}"
+    return version
+
+def text_cache_path(digest, file_type, cache_dir=TEXT_CACHE_PATH):
+    """Location of the cached text extracted from a file's contents."""
+    return os.path.join(cache_dir, f"{digest}.{extractor_version(file_type)}.txt.gz")
+
+def load_cached_text(digest, file_type, cache_dir=TEXT_CACHE_PATH):
+    """
+    Load previously extracted text.
+    
+    Args:
+        digest (str): Content hash of the file
+        file_type (str): Type/extension of the file
+        cache_dir (str): Folder holding the text cache
+        
+    Returns:
+        str: Cached text, or None on a cache miss
+    """
+    try:
+        with gzip.open(text_cache_path(digest, file_type, cache_dir), 'rt', encoding='utf-8') as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        print(f"Ignoring unreadable text cache entry for {digest}: {str(e)}")
+        return None
+
+def save_cached_text(digest, file_type, text, cache_dir=TEXT_CACHE_PATH):
+    """
+    Store extracted text in the cache.
+    
+    Args:
+        digest (str): Content hash of the file
+        file_type (str): Type/extension of the file
+        text (str): Extracted text
+        cache_dir (str): Folder holding the text cache
+    """
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        cache_path = text_cache_path(digest, file_type, cache_dir)
+        
+        # Write to a temporary name first so readers never see a partial entry
+        temp_path = f"{cache_path}.{os.getpid()}.tmp"
+        with gzip.open(temp_path, 'wt', encoding='utf-8', compresslevel=1) as f:
+            f.write(text)
+        os.replace(temp_path, cache_path)
+    except Exception as e:
+        print(f"Error writing text cache entry for {digest}: {str(e)}")
+
+def file_digest(file_path):
+    """Content hash of a file path or binary file-like object."""
+    if hasattr(file_path, 'getbuffer'):
+        with file_path.getbuffer() as buffer:
+            return content_hash(buffer)
+    if hasattr(file_path, 'read'):
+        file_path.seek(0)
+        return content_hash(file_path.read())
+    
+    hasher = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+def extract_text_from_file(file_path, file_type=None, digest=None, use_cache=TEXT_CACHE_ENABLED):
+    """
+    Extract text content from a file based on its type
+    
+    Extracted text is cached on disk by content hash and extractor version,
+    so unchanged files are only parsed once across rebuilds and uploads.
+    
+    Args:
+        file_path (str or file-like): Path to the file, or a binary file-like
+            object (e.g. BytesIO) holding its contents
+        file_type (str): Type/extension of the file (txt, pdf, docx). Required
+            when file_path is a file-like object
+        digest (str, optional): Content hash of the file, if already known
+        use_cache (bool): Whether to read and write the text cache
+        
     Returns:
         str: Extracted text content
     """
@@ -57,62 +207,297 @@ def extract_text_from_file(file_path, file_type=None):
         file_type = ext.lower().lstrip('.')
     
     if file_type == 'txt':
-        return read_text_file(file_path)
+        extractor = read_text_file
     elif file_type == 'pdf':
-        return extract_text_from_pdf(file_path)
+        extractor = extract_text_from_pdf
     elif file_type == 'docx':
-        return extract_text_from_docx(file_path)
+        extractor = extract_text_from_docx
     else:
         raise ValueError(f"Unsupported file type: {file_type}")
+    
+    if not use_cache:
+        return extractor(file_path)
+    
+    digest = digest or file_digest(file_path)
+    text = load_cached_text(digest, file_type)
+    if text is not None:
+        return text
+    
+    text = extractor(file_path)
+    # Extractors return an empty string on failure, which is not worth keeping
+    if text:
+        save_cached_text(digest, file_type, text)
+    return text
 
 def read_text_file(file_path):
-    """Read text from a .txt file"""
+    """Read text from a .txt file path or binary file-like object"""
+    if hasattr(file_path, 'read'):
+        file_path.seek(0)
+        data = file_path.read()
+    else:
+        with open(file_path, 'rb') as file:
+            data = file.read()
+    
     try:
-        with open(file_path, 'r', encoding='utf-8') as file:
-            return file.read()
+        return data.decode('utf-8')
     except UnicodeDecodeError:
         # Fallback to ISO-8859-1 encoding if UTF-8 fails
-        with open(file_path, 'r', encoding='ISO-8859-1') as file:
-            return file.read()
+        return data.decode('ISO-8859-1')
 
-def extract_text_from_pdf(file_path):
-    """Extract text from a PDF file"""
+def get_pdf_backend():
+    """
+    Pick the PDF text extractor.
+    
+    PyMuPDF is several times faster than PyPDF2 and is used automatically
+    when it is installed, unless PDF_EXTRACTOR names a backend explicitly.
+    
+    Returns:
+        str: "pymupdf" or "pypdf2"
+    """
+    if PDF_EXTRACTOR != "auto":
+        return PDF_EXTRACTOR
+    try:
+        import fitz  # PyMuPDF
+        return "pymupdf"
+    except ImportError:
+        return "pypdf2"
+
+def _open_pdf(source, backend):
+    """Open a PDF from a path or bytes with the given backend."""
+    if backend == "pymupdf":
+        import fitz
+        if isinstance(source, (bytes, bytearray)):
+            return fitz.open(stream=source, filetype="pdf")
+        return fitz.open(source)
+    # Parsers are imported on first use, so startup does not pay for them
+    import PyPDF2
+    if isinstance(source, (bytes, bytearray)):
+        return PyPDF2.PdfReader(io.BytesIO(source))
+    return PyPDF2.PdfReader(source)
+
+def _count_pdf_pages(document, backend):
+    """Number of pages of an open PDF, without loading its page tree."""
+    if backend == "pymupdf":
+        return document.page_count
+    try:
+        # The page tree's root records the total, so the pages need not be walked
+        return int(document.trailer["/Root"]["/Pages"]["/Count"])
+    except Exception:
+        return len(document.pages)
+
+# Document last opened by this worker process, as (file key, backend, document)
+_worker_pdf = None
+
+def _worker_open_pdf(path, backend):
+    """Open a PDF in a worker process, reusing it for the document's other shards."""
+    global _worker_pdf
+    stat = os.stat(path)
+    # A file changed in place gets a new key, so its old pages are never served
+    key = (path, stat.st_mtime_ns, stat.st_size)
+    if _worker_pdf is None or _worker_pdf[:2] != (key, backend):
+        if _worker_pdf is not None and _worker_pdf[1] == "pymupdf":
+            _worker_pdf[2].close()
+        # Read the file into memory rather than keeping it open, so the caller can delete it
+        with open(path, 'rb') as f:
+            _worker_pdf = (key, backend, _open_pdf(f.read(), backend))
+    return _worker_pdf[2]
+
+def _read_pdf_pages(document, start, end, backend):
+    if backend == "pymupdf":
+        return [document[page_num].get_text() for page_num in range(start, end)]
+    return [document.pages[page_num].extract_text() or "" for page_num in range(start, end)]
+
+def _extract_pdf_page_range(path, start, end, backend):
+    """
+    Extract the text of pages [start, end) of a PDF file.
+    
+    Runs in a worker process, which opens each document once for all the
+    shards it is given.
+    
+    Returns:
+        list: Page texts in page order
+    """
+    return _read_pdf_pages(_worker_open_pdf(path, backend), start, end, backend)
+
+_pdf_pool = None
+_pdf_pool_lock = threading.Lock()
+
+def _get_pdf_pool():
+    """
+    The worker processes shared by every PDF extraction, started on first use.
+    
+    Workers are spawned rather than forked: extraction is called from worker
+    threads, and forking a process while other threads hold locks can
+    deadlock the child.
+    """
+    global _pdf_pool
+    with _pdf_pool_lock:
+        if _pdf_pool is None:
+            _pdf_pool = ProcessPoolExecutor(
+                max_workers=PDF_EXTRACTION_WORKERS or os.cpu_count() or 1,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return _pdf_pool
+
+def _reset_pdf_pool():
+    """Drop a pool whose worker died, so the next extraction starts a new one."""
+    global _pdf_pool
+    with _pdf_pool_lock:
+        if _pdf_pool is not None:
+            _pdf_pool.shutdown(wait=False, cancel_futures=True)
+            _pdf_pool = None
+
+def extract_pdf_pages(file_path, backend=None):
+    """
+    Extract the text of every page of a PDF, in parallel for large documents.
+    
+    The page list is split into shards of PDF_PAGES_PER_SHARD pages. This
+    process extracts the first shard from the document it opened to count
+    the pages, while a shared pool of worker processes extracts the rest;
+    the shards are reassembled in page order. Workers are sent the file's
+    path, never its contents; an upload held in memory is written to a
+    temporary file first.
+    
+    Args:
+        file_path (str or file-like): Path to the PDF, or a binary file-like object
+        backend (str, optional): "pymupdf" or "pypdf2", defaults to get_pdf_backend()
+        
+    Returns:
+        list: (page number, text) tuples, page numbers starting at 1
+    """
+    backend = backend or get_pdf_backend()
+    
+    if hasattr(file_path, 'read'):
+        file_path.seek(0)
+        source = file_path.read()
+    else:
+        source = file_path
+    
+    document = _open_pdf(source, backend)
+    n_pages = _count_pdf_pages(document, backend)
+    shards = [(start, min(start + PDF_PAGES_PER_SHARD, n_pages))
+              for start in range(0, n_pages, PDF_PAGES_PER_SHARD)]
+    workers = min(PDF_EXTRACTION_WORKERS or os.cpu_count() or 1, len(shards))
+    
+    if workers <= 1:
+        texts = _read_pdf_pages(document, 0, n_pages, backend)
+        return list(enumerate(texts, start=1))
+    
+    temp_path = None
     try:
-        # We need to import PyPDF2 dynamically to avoid dependency issues if not installed
-        text = ""
+        if isinstance(source, bytes):
+            with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as temp_file:
+                temp_file.write(source)
+            source = temp_path = temp_file.name
         
-        with open(file_path, 'rb') as file:
-            pdf_reader = PyPDF2.PdfReader(file)
-            for page_num in range(len(pdf_reader.pages)):
-                text += pdf_reader.pages[page_num].extract_text() + "\n"
+        pool = _get_pdf_pool()
+        futures = [pool.submit(_extract_pdf_page_range, source, start, end, backend) for start, end in shards[1:]]
+        texts = _read_pdf_pages(document, *shards[0], backend)
+        # Collect in submission order, which keeps the pages in order
+        texts += [text for future in futures for text in future.result()]
+    except BrokenProcessPool:
+        _reset_pdf_pool()
+        raise
+    finally:
+        if temp_path:
+            try:
+                os.remove(temp_path)
+            except OSError as e:
+                print(f"Error removing temporary PDF {temp_path}: {str(e)}")
+    
+    return list(enumerate(texts, start=1))
+
+def extract_text_from_pdf(file_path):
+    """Extract text from a PDF file path or binary file-like object"""
+    try:
+        pages = extract_pdf_pages(file_path)
         
-        return text
+        # Separate pages with form feeds so chunks can record their page numbers
+        return PAGE_BREAK.join(text for _, text in pages)
     except ImportError:
-        print("PyPDF2 not installed. Install it using: pip install PyPDF2")
+        package = "PyMuPDF" if get_pdf_backend() == "pymupdf" else "PyPDF2"
+        print(f"{package} not installed. Install it using: pip install {package}")
         return ""
     except Exception as e:
         print(f"Error extracting text from PDF: {str(e)}")
         return ""
 
+# SOP templates mark their sections with short paragraphs such as "Objective:"
+HEADING_MAX_WORDS = 8
+
+def _is_docx_heading(paragraph, text):
+    """Whether a DOCX paragraph is a section heading."""
+    style_name = paragraph.style.name if paragraph.style is not None else ""
+    if style_name.startswith(("Heading", "Title")):
+        return True
+    return text.endswith(":") and len(text.split()) <= HEADING_MAX_WORDS
+
+def _iter_docx_blocks(parent):
+    """Yield the paragraphs and tables directly inside a document body or table cell, in order."""
+    from docx.oxml.table import CT_Tbl
+    from docx.oxml.text.paragraph import CT_P
+    from docx.table import Table
+    from docx.text.paragraph import Paragraph
+    
+    parent_element = parent.element.body if hasattr(parent, 'element') else parent._tc
+    for child in parent_element.iterchildren():
+        if isinstance(child, CT_P):
+            yield Paragraph(child, parent)
+        elif isinstance(child, CT_Tbl):
+            yield Table(child, parent)
+
+def _docx_lines(parent):
+    """
+    Extract the lines of a document body or table cell in document order.
+    
+    Headings are prefixed with SECTION_BREAK and table rows with TABLE_ROW.
+    
+    Returns:
+        list: Text lines
+    """
+    from docx.text.paragraph import Paragraph
+    
+    lines = []
+    for block in _iter_docx_blocks(parent):
+        if isinstance(block, Paragraph):
+            text = block.text.strip()
+            if text:
+                lines.append(f"{SECTION_BREAK}{text}" if _is_docx_heading(block, text) else text)
+            continue
+        
+        # python-docx returns a merged cell once per grid position it spans,
+        # so cells already seen in this table are skipped
+        seen_cells = set()
+        for row in block.rows:
+            cells = []
+            for cell in row.cells:
+                if cell._tc not in seen_cells:
+                    seen_cells.add(cell._tc)
+                    cells.append(cell)
+            
+            if len(cells) == 1:
+                # Single-cell rows are layout boxes around ordinary text
+                lines.extend(_docx_lines(cells[0]))
+                continue
+            
+            cell_texts = [" ".join(cell.text.split()) for cell in cells]
+            row_text = " | ".join(text for text in cell_texts if text)
+            if row_text:
+                lines.append(f"{TABLE_ROW}{row_text}")
+    return lines
+
 def extract_text_from_docx(file_path):
-    """Extract text from a .docx file"""
+    """Extract text from a .docx file path or binary file-like object"""
     try:
-        # Import docx dynamically to avoid dependency issues if not installed
-        
+        # Imported on first use, so startup does not pay for python-docx
+        import docx
         
+        if hasattr(file_path, 'read'):
+            file_path.seek(0)
         doc = docx.Document(file_path)
-        full_text = []
-        
-        for para in doc.paragraphs:
-            full_text.append(para.text)
-            
-        # Also get text from tables
-        for table in doc.tables:
-            for row in table.rows:
-                for cell in row.cells:
-                    full_text.append(cell.text)
         
-        return '\n'.join(full_text)
+        # Walk the body once, so tables stay where they appear in the document
+        return '\n'.join(_docx_lines(doc))
     except ImportError:
         print("python-docx not installed. Install it using: pip install python-docx")
         return ""
@@ -120,32 +505,73 @@ def extract_text_from_docx(file_path):
         print(f"Error extracting text from DOCX: {str(e)}")
         return ""
 
-def handle_uploaded_file(uploaded_file, upload_folder):
+def content_hash(data):
+    """
+    Compute the SHA-256 digest identifying a file's contents.
+    
+    Args:
+        data (bytes-like): File contents
+        
+    Returns:
+        str: Hex digest
+    """
+    return hashlib.sha256(data).hexdigest()
+
+def content_addressed_path(upload_folder, digest, file_type):
+    """Location of an uploaded file in content-addressed storage."""
+    return os.path.join(upload_folder, f"{digest}.{file_type}")
+
+def handle_uploaded_file(uploaded_file, upload_folder, is_indexed=None):
     """
     Handle an uploaded file from Streamlit
     
+    The file is parsed straight from the in-memory upload and never written
+    to disk here. Its contents are hashed first: an upload byte-identical to a
+    file already in content-addressed storage, or to a document already in the
+    live index, is reported as a duplicate without being parsed again. Call
+    save_uploaded_file once the document has been indexed to record it.
+    
     Args:
         uploaded_file: Streamlit UploadedFile object
-        upload_folder (str): Folder to save the uploaded file
+        upload_folder (str): Folder holding content-addressed uploads
+        is_indexed (callable, optional): Called with the content hash, returns
+            True if the live index already holds that document
         
     Returns:
-        tuple: (file_path, file_name, content)
+        tuple: (file_path, file_name, content, is_duplicate). file_path is the
+            content-addressed location; content is None for duplicates
     """
-    # Create temp file path
     file_extension = os.path.splitext(uploaded_file.name)[1].lower()
     file_name = uploaded_file.name
+    file_type = file_extension.lstrip('.')
     
-    # Save the file
-    file_path = os.path.join(upload_folder, file_name)
+    if file_type not in SUPPORTED_FILE_TYPES:
+        raise ValueError(f"Unsupported file type: {file_type}")
     
-    with open(file_path, "wb") as f:
-        f.write(uploaded_file.getbuffer())
+    # Hash the upload buffer in place, without copying it
+    with uploaded_file.getbuffer() as buffer:
+        digest = content_hash(buffer)
     
-    # Extract text based on file type
-    file_type = file_extension.lstrip('.')
-    if file_type in SUPPORTED_FILE_TYPES:
-        content = extract_text_from_file(file_path, file_type)
-        return file_path, file_name, content
-    else:
-        raise ValueError(f"Unsupported file type: {file_type}")
+    file_path = content_addressed_path(upload_folder, digest, file_type)
+    if os.path.exists(file_path) or (is_indexed is not None and is_indexed(digest)):
+        return file_path, file_name, None, True
+    
+    # UploadedFile is a BytesIO, so the readers can parse it directly
+    content = extract_text_from_file(uploaded_file, file_type, digest=digest)
+    return file_path, file_name, content, False
 
+def save_uploaded_file(uploaded_file, file_path):
+    """
+    Persist an uploaded file to its content-addressed location.
+    
+    Args:
+        uploaded_file: Streamlit UploadedFile object
+        file_path (str): Path returned by handle_uploaded_file
+    """
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    
+    # Write to a temporary name first so a partial file never looks indexed
+    temp_path = f"{file_path}.tmp"
+    with open(temp_path, "wb") as f, uploaded_file.getbuffer() as buffer:
+        f.write(buffer)
+    os.replace(temp_path, file_path)
@@ -0,0 +1,287 @@
+"""
+Embedding server shared by the app processes on one machine.
+
+The model is loaded once and reached over a Unix socket. Requests that
+arrive within EMBEDDING_BATCH_WINDOW_MS of each other are embedded in one
+model call, and vectors go back as raw float32 bytes.
+
+Usage:
+    python embedding_server.py [--socket /tmp/rag-embeddings.sock]
+
+Then start the app with EMBEDDING_SERVER_SOCKET set to the same path.
+
+Wire format (all integers are unsigned 32-bit big-endian):
+    request:  count, then count times (length, UTF-8 bytes)
+    response: status 0, rows, dim, then rows * dim little-endian float32
+              status 1, length, UTF-8 error message
+"""
+import os
+import time
+import socket
+import struct
+import asyncio
+import argparse
+import threading
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from config import EMBEDDING_SERVER_SOCKET, EMBEDDING_BATCH_WINDOW_MS, EMBEDDING_MAX_BATCH
+
+UINT32 = struct.Struct("!I")
+RESPONSE_HEADER = struct.Struct("!III")
+STATUS_OK = 0
+STATUS_ERROR = 1
+DEFAULT_SOCKET = "/tmp/rag-embeddings.sock"
+
+
+def encode_request(texts):
+    """Serialize texts into a request frame."""
+    parts = [UINT32.pack(len(texts))]
+    for text in texts:
+        data = text.encode("utf-8")
+        parts.append(UINT32.pack(len(data)))
+        parts.append(data)
+    return b"".join(parts)
+
+
+def encode_vectors(vectors):
+    """Serialize a float32 matrix into a success response frame."""
+    vectors = np.ascontiguousarray(vectors, dtype="<f4")
+    return RESPONSE_HEADER.pack(STATUS_OK, vectors.shape[0], vectors.shape[1]) + vectors.tobytes()
+
+
+def encode_error(message):
+    data = message.encode("utf-8")
+    return UINT32.pack(STATUS_ERROR) + UINT32.pack(len(data)) + data
+
+
+class MicroBatcher:
+    """
+    Collects concurrent embedding requests into shared model calls.
+
+    The first waiting request opens a batch; requests arriving within the
+    batch window, up to max_batch texts in total, join it. The model runs
+    on a worker thread so the event loop keeps accepting requests meanwhile.
+    """
+
+    def __init__(self, embedding_function, window_ms=EMBEDDING_BATCH_WINDOW_MS, max_batch=EMBEDDING_MAX_BATCH):
+        """
+        Args:
+            embedding_function: LangChain embeddings running the model
+            window_ms (float): Time to wait for more requests after the first
+            max_batch (int): Texts per model call
+        """
+        self.embedding_function = embedding_function
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self._queue = asyncio.Queue()
+        self.batches = 0
+        self.texts = 0
+
+    async def embed(self, texts):
+        """Embed texts as part of the next batch and return their float32 matrix."""
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((texts, future))
+        return await future
+
+    async def run(self):
+        """Form and run batches until cancelled."""
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            size = len(batch[0][0])
+            deadline = loop.time() + self.window
+            while size < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                batch.append(item)
+                size += len(item[0])
+
+            texts = [text for item_texts, _ in batch for text in item_texts]
+            try:
+                vectors = await asyncio.to_thread(self._embed, texts)
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            self.batches += 1
+            self.texts += len(texts)
+            start = 0
+            for item_texts, future in batch:
+                if not future.done():
+                    future.set_result(vectors[start:start + len(item_texts)])
+                start += len(item_texts)
+
+    def _embed(self, texts):
+        return np.asarray(self.embedding_function.embed_documents(texts), dtype=np.float32)
+
+
+async def handle_connection(reader, writer, batcher):
+    """Serve the requests of one client connection until it closes."""
+    try:
+        while True:
+            try:
+                (count,) = UINT32.unpack(await reader.readexactly(UINT32.size))
+            except asyncio.IncompleteReadError:
+                break
+            texts = []
+            for _ in range(count):
+                (length,) = UINT32.unpack(await reader.readexactly(UINT32.size))
+                texts.append((await reader.readexactly(length)).decode("utf-8"))
+
+            try:
+                response = encode_vectors(await batcher.embed(texts)) if texts else encode_vectors(np.zeros((0, 0)))
+            except Exception as e:
+                print(f"Error embedding {len(texts)} texts: {str(e)}")
+                response = encode_error(str(e))
+            writer.write(response)
+            await writer.drain()
+    except Exception as e:
+        print(f"Embedding client connection failed: {str(e)}")
+    finally:
+        writer.close()
+
+
+async def serve(socket_path, embedding_function=None, ready=None):
+    """
+    Run the embedding server until cancelled.
+
+    Args:
+        socket_path (str): Unix socket to listen on; a stale file is replaced
+        embedding_function (optional): Embeddings to serve, defaults to the
+            local model from vector_store.get_embedding_function
+        ready (threading.Event, optional): Set once the socket accepts connections
+    """
+    if embedding_function is None:
+        from vector_store import load_local_embedding_function
+        embedding_function = load_local_embedding_function()
+
+    batcher = MicroBatcher(embedding_function)
+    batch_task = asyncio.create_task(batcher.run())
+
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+    server = await asyncio.start_unix_server(
+        lambda reader, writer: handle_connection(reader, writer, batcher), path=socket_path
+    )
+    print(f"Embedding server listening on {socket_path}")
+    if ready is not None:
+        ready.set()
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        batch_task.cancel()
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        print(f"Embedding server stopped after {batcher.batches} batches, {batcher.texts} texts")
+
+
+def _recv_exactly(sock, size):
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    received = 0
+    while received < size:
+        n = sock.recv_into(view[received:])
+        if n == 0:
+            raise ConnectionError("embedding server closed the connection")
+        received += n
+    return buffer
+
+
+class SocketEmbeddings(Embeddings):
+    """
+    LangChain embeddings computed by the embedding server.
+
+    Each thread keeps its own connection, so concurrent queries from the
+    app's threads reach the server together and share a batch.
+    """
+
+    def __init__(self, socket_path, timeout=60):
+        """
+        Args:
+            socket_path (str): Unix socket of the embedding server
+            timeout (float): Seconds to wait for a response
+        """
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connection(self):
+        sock = getattr(self._local, "sock", None)
+        if sock is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            sock.connect(self.socket_path)
+            self._local.sock = sock
+        return sock
+
+    def _close(self):
+        sock = getattr(self._local, "sock", None)
+        if sock is not None:
+            sock.close()
+            self._local.sock = None
+
+    def embed_array(self, texts):
+        """
+        Embed texts and return the vectors as one float32 matrix.
+
+        Returns:
+            np.ndarray: Shape (len(texts), dim)
+        """
+        texts = list(texts)
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        request = encode_request(texts)
+        try:
+            sock = self._connection()
+            sock.sendall(request)
+            (status,) = UINT32.unpack(_recv_exactly(sock, UINT32.size))
+        except OSError:
+            # The server may have restarted since this connection was opened; retry once
+            self._close()
+            sock = self._connection()
+            sock.sendall(request)
+            (status,) = UINT32.unpack(_recv_exactly(sock, UINT32.size))
+
+        try:
+            if status != STATUS_OK:
+                (length,) = UINT32.unpack(_recv_exactly(sock, UINT32.size))
+                raise RuntimeError(f"Embedding server error: {bytes(_recv_exactly(sock, length)).decode('utf-8')}")
+            rows, dim = struct.unpack("!II", _recv_exactly(sock, 8))
+            data = _recv_exactly(sock, rows * dim * 4)
+        except OSError:
+            self._close()
+            raise
+        return np.frombuffer(data, dtype="<f4").reshape(rows, dim)
+
+    def embed_documents(self, texts):
+        return self.embed_array(texts).tolist()
+
+    def embed_query(self, text):
+        return self.embed_array([text])[0].tolist()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Shared embedding server")
+    parser.add_argument("--socket", default=EMBEDDING_SERVER_SOCKET or DEFAULT_SOCKET, help="Unix socket path")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    from vector_store import load_local_embedding_function
+    embedding_function = load_local_embedding_function()
+    print(f"Model loaded in {time.perf_counter() - start:.1f}s")
+    try:
+        asyncio.run(serve(args.socket, embedding_function))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
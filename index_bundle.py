@@ -0,0 +1,217 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import tarfile
+import tempfile
+from config import VECTOR_STORE_BACKEND, EMBEDDING_MODEL_NAME
+from index_versions import versions_root, current_index_path, set_current, read_build_info
+
+# Manifest stored at the top of every bundle
+MANIFEST_NAME = "manifest.json"
+# Folder inside the bundle holding the index directory
+INDEX_ARCHIVE_DIR = "index"
+BUNDLE_FORMAT_VERSION = 1
+# Record of the last bundle installed by ensure_bundle_installed, next to the version pointer
+APPLIED_BUNDLE_FILE = "bundle.json"
+
+
+def file_sha256(path):
+    """SHA-256 hex digest of a file, read in blocks."""
+    hasher = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+
+def _index_files(index_path):
+    """Relative paths of every file in an index directory, sorted."""
+    files = []
+    for root, _, names in os.walk(index_path):
+        for name in names:
+            files.append(os.path.relpath(os.path.join(root, name), index_path).replace(os.sep, "/"))
+    return sorted(files)
+
+
+def create_bundle(index_path, output_dir, stats=None):
+    """
+    Package an index version as a checksummed bundle.
+
+    The bundle is an uncompressed tar holding a manifest and the index
+    directory. The manifest lists the SHA-256 of every file, and a
+    <bundle>.sha256 file next to the bundle holds the digest of the bundle
+    itself.
+
+    Args:
+        index_path (str): Index version directory
+        output_dir (str): Folder the bundle is written to
+        stats (dict, optional): Build statistics recorded in the manifest
+
+    Returns:
+        str: Path of the bundle
+    """
+    version = os.path.basename(os.path.normpath(index_path))
+    manifest = {
+        "format": BUNDLE_FORMAT_VERSION,
+        "version": version,
+        "backend": VECTOR_STORE_BACKEND,
+        "embedding_model": EMBEDDING_MODEL_NAME,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "build_settings": read_build_info(index_path),
+        "stats": stats or {},
+        "files": {name: {"sha256": file_sha256(os.path.join(index_path, name)),
+                         "size": os.path.getsize(os.path.join(index_path, name))}
+                  for name in _index_files(index_path)}
+    }
+
+    os.makedirs(output_dir, exist_ok=True)
+    bundle_path = os.path.join(output_dir, f"index-{VECTOR_STORE_BACKEND}-{version}.tar")
+    temp_path = f"{bundle_path}.tmp"
+    with tarfile.open(temp_path, "w") as tar, tempfile.TemporaryDirectory() as temp_dir:
+        manifest_path = os.path.join(temp_dir, MANIFEST_NAME)
+        with open(manifest_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2)
+        tar.add(manifest_path, arcname=MANIFEST_NAME)
+        for name in manifest["files"]:
+            tar.add(os.path.join(index_path, name), arcname=f"{INDEX_ARCHIVE_DIR}/{name}")
+    os.replace(temp_path, bundle_path)
+
+    with open(f"{bundle_path}.sha256", "w", encoding="utf-8") as f:
+        f.write(f"{file_sha256(bundle_path)}  {os.path.basename(bundle_path)}\n")
+    return bundle_path
+
+
+def read_manifest(bundle_path):
+    """Read the manifest of a bundle without extracting it."""
+    with tarfile.open(bundle_path, "r") as tar:
+        return json.load(tar.extractfile(MANIFEST_NAME))
+
+
+def verify_bundle_checksum(bundle_path):
+    """
+    Compare a bundle with the digest in its .sha256 file.
+
+    Returns:
+        bool: True if they match, or if there is no .sha256 file
+    """
+    checksum_path = f"{bundle_path}.sha256"
+    if not os.path.exists(checksum_path):
+        return True
+    with open(checksum_path, encoding="utf-8") as f:
+        expected = f.read().split()[0]
+    return file_sha256(bundle_path) == expected
+
+
+def install_bundle(bundle_path, activate=True):
+    """
+    Install a prebuilt index bundle as a new index version.
+
+    The bundle is checked against its .sha256 file, extracted next to the
+    other versions, and every file is checked against the manifest before
+    the directory is renamed into place, so a corrupt bundle is never
+    activated. Opening the installed index needs no extraction or embedding.
+
+    Args:
+        bundle_path (str): Bundle written by create_bundle
+        activate (bool): Whether to make the installed version live
+
+    Returns:
+        str: Directory of the installed index version
+    """
+    if not verify_bundle_checksum(bundle_path):
+        raise ValueError(f"Checksum mismatch for {bundle_path}")
+
+    manifest = read_manifest(bundle_path)
+    if manifest.get("backend") != VECTOR_STORE_BACKEND:
+        raise ValueError(f"Bundle is a {manifest.get('backend')} index, the app uses {VECTOR_STORE_BACKEND}")
+    if manifest.get("embedding_model") != EMBEDDING_MODEL_NAME:
+        raise ValueError(f"Bundle was embedded with {manifest.get('embedding_model')}, "
+                         f"the app uses {EMBEDDING_MODEL_NAME}")
+
+    root = versions_root()
+    index_path = os.path.join(root, manifest["version"])
+    if not os.path.isdir(index_path):
+        os.makedirs(root, exist_ok=True)
+        temp_dir = tempfile.mkdtemp(prefix=".install-", dir=root)
+        try:
+            with tarfile.open(bundle_path, "r") as tar:
+                members = [m for m in tar.getmembers() if m.name.startswith(f"{INDEX_ARCHIVE_DIR}/")]
+                if hasattr(tarfile, "data_filter"):
+                    tar.extractall(temp_dir, members=members, filter="data")
+                else:
+                    tar.extractall(temp_dir, members=members)
+
+            extracted = os.path.join(temp_dir, INDEX_ARCHIVE_DIR)
+            for name, info in manifest["files"].items():
+                if file_sha256(os.path.join(extracted, name)) != info["sha256"]:
+                    raise ValueError(f"Checksum mismatch for {name} in {bundle_path}")
+            os.replace(extracted, index_path)
+        finally:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+    if activate:
+        live_path = current_index_path()
+        if live_path is None or os.path.abspath(live_path) != os.path.abspath(index_path):
+            set_current(index_path, previous_path=live_path)
+    return index_path
+
+
+def bundle_digest(bundle_path):
+    """SHA-256 of a bundle, from its .sha256 file when there is one."""
+    checksum_path = f"{bundle_path}.sha256"
+    if os.path.exists(checksum_path):
+        with open(checksum_path, encoding="utf-8") as f:
+            return f.read().split()[0]
+    return file_sha256(bundle_path)
+
+
+def read_applied_bundle():
+    """The version and digest of the bundle last installed at startup, or an empty dict."""
+    try:
+        with open(os.path.join(versions_root(), APPLIED_BUNDLE_FILE), encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except Exception as e:
+        print(f"Error reading applied bundle record: {str(e)}")
+        return {}
+
+
+def write_applied_bundle(version, digest):
+    root = versions_root()
+    os.makedirs(root, exist_ok=True)
+    with open(os.path.join(root, APPLIED_BUNDLE_FILE), "w", encoding="utf-8") as f:
+        json.dump({"version": version, "sha256": digest, "applied": time.strftime("%Y-%m-%dT%H:%M:%S")}, f, indent=2)
+
+
+def ensure_bundle_installed(bundle_path):
+    """
+    Install and activate a bundle unless it was already applied.
+
+    Used at startup so replicas serve a prebuilt index instead of building
+    one, without undoing a later rebuild or rollback on every restart. The
+    bundle is installed when there is no live index yet, or when it differs
+    from the bundle last applied, e.g. a new one was deployed. Rebuilds
+    deleting the bundle's version directory do not bring it back.
+
+    Args:
+        bundle_path (str): Bundle written by create_bundle
+
+    Returns:
+        bool: True if the bundle was installed now
+    """
+    version = read_manifest(bundle_path)["version"]
+    digest = bundle_digest(bundle_path)
+    applied = read_applied_bundle()
+    if current_index_path() is not None:
+        if not applied:
+            # The live index predates this record, so the bundle was applied before it was kept
+            write_applied_bundle(version, digest)
+            return False
+        if (applied.get("version"), applied.get("sha256")) == (version, digest):
+            return False
+    install_bundle(bundle_path, activate=True)
+    write_applied_bundle(version, digest)
+    return True
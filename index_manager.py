@@ -0,0 +1,328 @@
+import os
+import random
+import shutil
+import threading
+from config import (
+    FOLDER_PATH,
+    UPLOAD_FOLDER,
+    RETRIEVER_K,
+    VECTOR_STORE_BACKEND,
+    NUMPY_VECTOR_DTYPE,
+    CHROMA_COLLECTION_METADATA,
+    EMBEDDING_MODEL_NAME,
+    EMBEDDING_BACKEND,
+    ONNX_QUANTIZE,
+    CHUNKING_STRATEGY,
+    CHUNK_MAX_TOKENS,
+    CHUNK_OVERLAP_TOKENS,
+    CHUNK_SIZE,
+    CHUNK_OVERLAP,
+    CHUNK_TEXT_STORAGE,
+    NEAR_DUPLICATE_DEDUP_ENABLED,
+    NEAR_DUPLICATE_THRESHOLD,
+    MINHASH_PERMUTATIONS,
+    MINHASH_BANDS,
+    MINHASH_SHINGLE_SIZE,
+    INDEX_SANITY_SAMPLES,
+    INDEX_SANITY_MIN_HIT_RATE,
+    INDEX_SANITY_MIN_CHUNK_RATIO
+)
+from data_loader import (read_txts_from_folder, extract_text_from_file, content_addressed_path,
+                         EXTRACTOR_VERSIONS)
+from vector_store import (initialize_vector_store, add_document_to_store, get_index_path,
+                          get_text_store)
+from retrieval import create_retriever
+from profiling import profile_request
+from chunk_store import is_offset_chunk
+from index_versions import (new_version_path, set_current, previous_index_path, read_build_info,
+                            write_build_info, collect_garbage)
+
+
+def index_build_settings():
+    """
+    Settings that change the contents of an index.
+
+    An index built with other settings is stale and gets rebuilt.
+
+    Returns:
+        dict: Setting name to value
+    """
+    return {
+        "backend": VECTOR_STORE_BACKEND,
+        "embedding_model": EMBEDDING_MODEL_NAME,
+        "embedding_backend": EMBEDDING_BACKEND if EMBEDDING_BACKEND != "onnx" else f"onnx-{'int8' if ONNX_QUANTIZE else 'fp32'}",
+        "numpy_dtype": NUMPY_VECTOR_DTYPE,
+        "chroma_collection_metadata": CHROMA_COLLECTION_METADATA,
+        "chunking_strategy": CHUNKING_STRATEGY,
+        "chunk_max_tokens": CHUNK_MAX_TOKENS,
+        "chunk_overlap_tokens": CHUNK_OVERLAP_TOKENS,
+        "chunk_size": CHUNK_SIZE,
+        "chunk_overlap": CHUNK_OVERLAP,
+        "chunk_text_storage": CHUNK_TEXT_STORAGE,
+        "near_duplicate_dedup": NEAR_DUPLICATE_DEDUP_ENABLED,
+        "near_duplicate_threshold": NEAR_DUPLICATE_THRESHOLD,
+        # Stored chunk signatures that uploads are checked against
+        "minhash": [MINHASH_PERMUTATIONS, MINHASH_BANDS, MINHASH_SHINGLE_SIZE],
+        "extractor_versions": EXTRACTOR_VERSIONS
+    }
+
+
+def build_index_version(file_data, quiet=False, progress_callback=None):
+    """
+    Build an index from documents into a new version directory.
+
+    The version is not activated; call index_versions.set_current for that.
+
+    Args:
+        file_data (list): Dictionaries with file_name and content
+        quiet (bool): If True, suppresses informational messages
+        progress_callback (callable, optional): Called as progress_callback(stage, fraction)
+            while chunks are embedded and stored
+
+    Returns:
+        tuple: (index directory, vector store)
+    """
+    index_path = new_version_path()
+    vector_store = initialize_vector_store(file_data, quiet=quiet, index_path=index_path,
+                                           progress_callback=progress_callback)
+    write_build_info(index_path, index_build_settings())
+    return index_path, vector_store
+
+
+def load_retriever(index_path):
+    """Open an index version and create its retriever."""
+    vector_store = initialize_vector_store(use_existing=True, quiet=True, index_path=index_path)
+    return create_retriever(vector_store, k=RETRIEVER_K, text_store=get_text_store(index_path))
+
+
+def count_chunks(vector_store):
+    """Number of chunks stored in a vector store."""
+    return len(vector_store.get(include=[])["ids"])
+
+
+def uploaded_documents(vector_store):
+    """
+    Map the uploads indexed in a vector store to their stored file names.
+
+    Args:
+        vector_store: Vector store exposing get()
+
+    Returns:
+        dict: Content hash to the uploaded file name
+    """
+    stored = vector_store.get(include=["metadatas"])
+    return {metadata["content_hash"]: metadata.get("source", "")
+            for metadata in stored["metadatas"] if metadata and metadata.get("content_hash")}
+
+
+def sanity_check(retriever, min_chunks=0):
+    """
+    Check that a freshly built index is fit to serve.
+
+    The index must hold at least min_chunks chunks, and querying with the
+    opening text of sampled chunks must mostly return their own source file.
+
+    Args:
+        retriever: Retriever over the new index
+        min_chunks (int): Minimum number of chunks required
+
+    Returns:
+        tuple: (passed, message)
+    """
+    vector_store = retriever.vectorstore
+    stored = vector_store.get(include=["documents", "metadatas"])
+    n_chunks = len(stored["ids"])
+    if n_chunks == 0:
+        return False, "the new index is empty"
+    if n_chunks < min_chunks:
+        return False, f"the new index has {n_chunks} chunks, expected at least {min_chunks}"
+
+    text_store = getattr(retriever, "text_store", None)
+    samples = random.Random(0).sample(range(n_chunks), min(INDEX_SANITY_SAMPLES, n_chunks))
+    hits = 0
+    for i in samples:
+        metadata = stored["metadatas"][i] or {}
+        text = stored["documents"][i]
+        if not text and text_store is not None and is_offset_chunk(metadata):
+            text = text_store.window(metadata)
+
+        source = metadata.get("source", "")
+        for doc in retriever.invoke(text[:300]):
+            if doc.metadata.get("source") == source or source in doc.metadata.get("also_in", ""):
+                hits += 1
+                break
+
+    hit_rate = hits / len(samples)
+    if hit_rate < INDEX_SANITY_MIN_HIT_RATE:
+        return False, f"only {hit_rate:.0%} of sample queries found their source document"
+    return True, f"{n_chunks} chunks, {hit_rate:.0%} of sample queries found their source document"
+
+
+class IndexManager:
+    """
+    Owner of the live retriever, able to replace it without downtime.
+
+    New index versions are built into their own directory on a background
+    thread while the current version keeps serving. A version that passes
+    the sanity check is activated by atomically replacing the version
+    pointer and the retriever reference, so requests already running finish
+    on the old retriever and new ones use the new retriever. The previous
+    version stays loaded for instant rollback; older ones are deleted.
+    """
+
+    def __init__(self, load_initial_retriever):
+        """
+        Load the live retriever.
+
+        Args:
+            load_initial_retriever (callable): Returns the retriever of the live index
+        """
+        self._lock = threading.Lock()
+        # Held while documents are added to the live index, so a swap never drops them
+        self.write_lock = threading.Lock()
+        self._retriever = load_initial_retriever()
+        self._index_path = get_index_path()
+        self._previous = None  # (index directory, retriever) of the previous version
+        self._build_thread = None
+        self.status = "idle"
+        self.message = ""
+
+    def current(self):
+        """Return the live retriever."""
+        return self._retriever
+
+    @property
+    def index_path(self):
+        return self._index_path
+
+    @property
+    def is_building(self):
+        return self._build_thread is not None and self._build_thread.is_alive()
+
+    @property
+    def can_roll_back(self):
+        return not self.is_building and previous_index_path() is not None
+
+    def needs_rebuild(self):
+        """Whether the live index was built with other settings than the current ones."""
+        return read_build_info(self._index_path) != index_build_settings()
+
+    def start_rebuild(self, reason="manual rebuild", load_documents=None, profile=False):
+        """
+        Build a new index version in the background and switch to it if it passes the sanity check.
+
+        Args:
+            reason (str): Why the index is rebuilt, for the logs
+            load_documents (callable, optional): Returns the file_data to index,
+                defaults to reading FOLDER_PATH
+            profile (bool): Write a CPU and allocation profile of the build (PROFILING_MODE "on_demand")
+
+        Returns:
+            bool: False if a build is already running
+        """
+        with self._lock:
+            if self.is_building:
+                return False
+            self.status = "building"
+            self.message = f"Rebuilding index ({reason})"
+            print(self.message)
+            self._build_thread = threading.Thread(
+                target=self._rebuild,
+                args=(load_documents or (lambda: read_txts_from_folder(FOLDER_PATH)), profile),
+                name="index-builder", daemon=True
+            )
+            self._build_thread.start()
+            return True
+
+    def _rebuild(self, load_documents, profile=False):
+        with profile_request("rebuild", "index", profile):
+            index_path = None
+            try:
+                file_data = load_documents()
+                if not file_data:
+                    raise ValueError("no documents to index")
+
+                old_retriever = self._retriever
+                try:
+                    min_chunks = int(count_chunks(old_retriever.vectorstore) * INDEX_SANITY_MIN_CHUNK_RATIO)
+                except Exception:
+                    min_chunks = 0
+
+                index_path, vector_store = build_index_version(file_data, quiet=True)
+                new_retriever = create_retriever(vector_store, k=RETRIEVER_K, text_store=get_text_store(index_path))
+
+                passed, detail = sanity_check(new_retriever, min_chunks)
+                if not passed:
+                    raise ValueError(f"sanity check failed: {detail}")
+
+                # Uploads indexed in the live version since it was built move over too
+                self._carry_over_uploads(old_retriever, new_retriever)
+                with self.write_lock:
+                    # Ingestion waits from here until the swap, so catch up on uploads
+                    # that finished during the first pass, then switch
+                    self._carry_over_uploads(self._retriever, new_retriever)
+                    self._activate(index_path, new_retriever)
+                deleted = collect_garbage(keep=(index_path, self._previous[0]))
+
+                self.status = "done"
+                self.message = f"Switched to index {os.path.basename(index_path)}: {detail}"
+                if deleted:
+                    self.message += f"; deleted {len(deleted)} old version(s)"
+                print(self.message)
+            except Exception as e:
+                self.status = "failed"
+                self.message = f"Index rebuild failed, still serving {os.path.basename(self._index_path)}: {str(e)}"
+                print(self.message)
+                if index_path and os.path.isdir(index_path):
+                    shutil.rmtree(index_path, ignore_errors=True)
+
+    def _carry_over_uploads(self, old_retriever, new_retriever):
+        """Add uploads indexed in the old version but missing from the new one."""
+        missing = uploaded_documents(old_retriever.vectorstore)
+        for digest in uploaded_documents(new_retriever.vectorstore):
+            missing.pop(digest, None)
+
+        for digest, file_name in missing.items():
+            file_type = os.path.splitext(file_name)[1].lower().lstrip('.')
+            file_path = content_addressed_path(UPLOAD_FOLDER, digest, file_type)
+            if not os.path.exists(file_path):
+                print(f"Upload {file_name} is missing from {UPLOAD_FOLDER}, not carried over")
+                continue
+            content = extract_text_from_file(file_path, file_type, digest=digest)
+            add_document_to_store({"file_name": file_name, "content": content, "content_hash": digest},
+                                  retriever=new_retriever)
+
+    def _activate(self, index_path, retriever):
+        with self._lock:
+            set_current(index_path, previous_path=self._index_path)
+            self._previous = (self._index_path, self._retriever)
+            self._index_path = index_path
+            self._retriever = retriever
+
+    def rollback(self):
+        """
+        Switch back to the previous index version.
+
+        Returns:
+            bool: True if the previous version is now live
+        """
+        if self.is_building:
+            return False
+        previous_path = previous_index_path()
+        if previous_path is None:
+            return False
+
+        try:
+            if self._previous and os.path.abspath(self._previous[0]) == os.path.abspath(previous_path):
+                previous_retriever = self._previous[1]
+            else:
+                previous_retriever = load_retriever(previous_path)
+            self._activate(previous_path, previous_retriever)
+            self.status = "done"
+            self.message = f"Rolled back to index {os.path.basename(previous_path)}"
+            print(self.message)
+            return True
+        except Exception as e:
+            self.message = f"Rollback failed: {str(e)}"
+            print(self.message)
+            return False
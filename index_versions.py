@@ -0,0 +1,163 @@
+import os
+import json
+import time
+import uuid
+import shutil
+from config import BASE_DIR, INDEX_VERSIONS_PATH, VECTOR_STORE_BACKEND
+
+# Pointer to the live and previous index versions of a backend
+POINTER_FILE = "current.json"
+# Settings an index version was built with, written into the version directory
+BUILD_INFO_FILE = "build.json"
+
+
+def versions_root(backend=VECTOR_STORE_BACKEND):
+    """Folder holding the index versions of a backend."""
+    return os.path.join(INDEX_VERSIONS_PATH, backend)
+
+
+def _to_absolute(path):
+    return path if os.path.isabs(path) else os.path.join(BASE_DIR, path)
+
+
+def read_pointer(backend=VECTOR_STORE_BACKEND):
+    """
+    Read the version pointer of a backend.
+
+    Returns:
+        dict: "current" and "previous" index directories, relative to BASE_DIR.
+            Empty when no version has been activated yet.
+    """
+    try:
+        with open(os.path.join(versions_root(backend), POINTER_FILE), encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except Exception as e:
+        print(f"Error reading index version pointer: {str(e)}")
+        return {}
+
+
+def current_index_path(backend=VECTOR_STORE_BACKEND):
+    """
+    Directory of the live index version.
+
+    Returns:
+        str: Absolute path, or None when no version has been activated
+    """
+    current = read_pointer(backend).get("current")
+    return _to_absolute(current) if current else None
+
+
+def previous_index_path(backend=VECTOR_STORE_BACKEND):
+    """
+    Directory of the index version live before the current one, kept for rollback.
+
+    Returns:
+        str: Absolute path, or None if there is no previous version on disk
+    """
+    previous = read_pointer(backend).get("previous")
+    if previous and os.path.isdir(_to_absolute(previous)):
+        return _to_absolute(previous)
+    return None
+
+
+def new_version_path(backend=VECTOR_STORE_BACKEND):
+    """
+    Choose the directory for a new index version. The directory is not created.
+
+    Returns:
+        str: Absolute path; version names sort by creation time
+    """
+    name = f"v{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}"
+    return os.path.join(versions_root(backend), name)
+
+
+def set_current(index_path, previous_path=None, backend=VECTOR_STORE_BACKEND):
+    """
+    Make an index version live.
+
+    The pointer file is replaced atomically, so a crash leaves either the
+    old or the new pointer in place, never a partial one.
+
+    Args:
+        index_path (str): Directory of the version to activate
+        previous_path (str, optional): Version to keep for rollback
+        backend (str): Vector store backend
+    """
+    root = versions_root(backend)
+    os.makedirs(root, exist_ok=True)
+    pointer = {
+        "current": os.path.relpath(index_path, BASE_DIR),
+        "previous": os.path.relpath(previous_path, BASE_DIR) if previous_path else None,
+        "activated": time.strftime("%Y-%m-%dT%H:%M:%S")
+    }
+    temp_path = os.path.join(root, f"{POINTER_FILE}.{os.getpid()}.tmp")
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump(pointer, f, indent=2)
+    os.replace(temp_path, os.path.join(root, POINTER_FILE))
+
+
+def read_build_info(index_path):
+    """
+    Read the settings an index version was built with.
+
+    Returns:
+        dict: Build settings, empty for indexes built before versioning
+    """
+    try:
+        with open(os.path.join(index_path, BUILD_INFO_FILE), encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except Exception as e:
+        print(f"Error reading index build info: {str(e)}")
+        return {}
+
+
+def write_build_info(index_path, build_info):
+    """Record the settings an index version was built with."""
+    with open(os.path.join(index_path, BUILD_INFO_FILE), "w", encoding="utf-8") as f:
+        json.dump(build_info, f, indent=2)
+
+
+def collect_garbage(keep=(), backend=VECTOR_STORE_BACKEND):
+    """
+    Delete index versions older than the one kept for rollback.
+
+    Versions newer than the previous one are left alone even when they are
+    not live, e.g. one installed from a bundle but not activated yet, and so
+    are directories without build info, which are still being written.
+
+    Args:
+        keep (iterable): Further version directories to keep
+        backend (str): Vector store backend
+
+    Returns:
+        list: Names of the deleted versions
+    """
+    root = versions_root(backend)
+    if not os.path.isdir(root):
+        return []
+
+    live = [path for path in (current_index_path(backend), previous_index_path(backend)) if path]
+    # Version names sort by creation time; a legacy index outside the root has no place in that order
+    live_names = [os.path.basename(path) for path in live
+                  if os.path.dirname(os.path.abspath(path)) == os.path.abspath(root)]
+    if not live_names:
+        return []
+    oldest_kept = min(live_names)
+    keep = {os.path.abspath(path) for path in list(keep) + live if path}
+
+    deleted = []
+    for name in sorted(os.listdir(root)):
+        path = os.path.join(root, name)
+        if (not os.path.isdir(path) or name >= oldest_kept or os.path.abspath(path) in keep
+                or not os.path.exists(os.path.join(path, BUILD_INFO_FILE))):
+            continue
+        try:
+            shutil.rmtree(path)
+            deleted.append(name)
+        except Exception as e:
+            print(f"Error deleting index version {name}: {str(e)}")
+    return deleted
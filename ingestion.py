@@ -0,0 +1,226 @@
+import io
+import os
+import time
+import uuid
+import queue
+import threading
+from config import UPLOAD_FOLDER
+from data_loader import handle_uploaded_file, save_uploaded_file
+from vector_store import add_document_to_store, document_is_indexed
+from metrics import RequestMetrics
+from tracing import current_span, start_span, trace, use_span
+from profiling import profile_request
+
+# Job states
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+DUPLICATE = "duplicate"
+FAILED = "failed"
+FINISHED_STATES = (DONE, DUPLICATE, FAILED)
+
+# Finished jobs are forgotten after this many seconds
+JOB_RETENTION_SECONDS = 3600
+
+
+class UploadedBytes(io.BytesIO):
+    """
+    An uploaded file received as raw bytes, e.g. by the HTTP API.
+
+    Like Streamlit's UploadedFile it is a BytesIO with a name, so the
+    extractors read it without writing it to disk.
+    """
+
+    def __init__(self, name, data):
+        super().__init__(data)
+        self.name = name
+
+
+class IngestionJob:
+    """Progress record of one uploaded file moving through ingestion."""
+
+    def __init__(self, uploaded_file, session_id="default", profile=False):
+        self.id = uuid.uuid4().hex[:12]
+        self.file_name = uploaded_file.name
+        self.uploaded_file = uploaded_file
+        self.session_id = session_id
+        self.profile = profile
+        self.status = QUEUED
+        self.stage = "Waiting in queue"
+        self.progress = 0.0
+        self.message = ""
+        self.created = time.time()
+        self.finished = None
+        # Span active when the file was submitted, e.g. the UI upload; the worker continues its trace
+        self.trace_parent = current_span()
+
+    @property
+    def is_finished(self):
+        return self.status in FINISHED_STATES
+
+    def to_dict(self):
+        """Progress of the job as JSON-serializable values."""
+        return {
+            "id": self.id,
+            "file_name": self.file_name,
+            "status": self.status,
+            "stage": self.stage,
+            "progress": self.progress,
+            "message": self.message
+        }
+
+    def update(self, stage, progress):
+        self.stage = stage
+        self.progress = progress
+
+    def finish(self, status, message):
+        self.status = status
+        self.message = message
+        self.progress = 1.0
+        self.finished = time.time()
+        # The upload buffer is no longer needed once the job is over
+        self.uploaded_file = None
+
+
+class IngestionQueue:
+    """
+    Background worker that extracts, embeds and indexes uploaded files.
+
+    Uploads are processed one at a time on a daemon thread, so the Streamlit
+    script thread only enqueues them and polls their progress. New chunks are
+    added through the shared retriever and become searchable for every
+    session as soon as each file finishes.
+    """
+
+    def __init__(self, get_retriever, upload_folder=UPLOAD_FOLDER, write_lock=None):
+        """
+        Initialize the queue and start its worker thread.
+
+        Args:
+            get_retriever (callable): Returns the retriever new chunks are added to
+            upload_folder (str): Folder holding content-addressed uploads
+            write_lock (threading.Lock, optional): Held while a document is added to
+                the live index, e.g. IndexManager.write_lock
+        """
+        self.get_retriever = get_retriever
+        self.upload_folder = upload_folder
+        self.write_lock = write_lock or threading.Lock()
+        self._queue = queue.Queue()
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._worker = threading.Thread(target=self._run, name="ingestion-worker", daemon=True)
+        self._worker.start()
+
+    def submit(self, uploaded_files, session_id="default", profile=False):
+        """
+        Queue uploaded files for ingestion.
+
+        Args:
+            uploaded_files (list): Streamlit UploadedFile or UploadedBytes objects
+            session_id (str): Session the upload came from
+            profile (bool): Write a CPU and allocation profile of each job (PROFILING_MODE "on_demand")
+
+        Returns:
+            list: Job ids, one per file
+        """
+        self._prune()
+        job_ids = []
+        for uploaded_file in uploaded_files:
+            job = IngestionJob(uploaded_file, session_id, profile)
+            with self._lock:
+                self._jobs[job.id] = job
+            self._queue.put(job)
+            job_ids.append(job.id)
+        return job_ids
+
+    def _prune(self):
+        cutoff = time.time() - JOB_RETENTION_SECONDS
+        with self._lock:
+            for job_id in [j.id for j in self._jobs.values() if j.is_finished and j.finished < cutoff]:
+                del self._jobs[job_id]
+
+    @property
+    def pending(self):
+        """Number of jobs waiting or running."""
+        return self._queue.unfinished_tasks
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            try:
+                with profile_request("ingest", job.session_id, job.profile):
+                    self._run_job(job)
+            finally:
+                self._queue.task_done()
+
+    def _run_job(self, job):
+        metrics = RequestMetrics("ingest", session_id=job.session_id, file_name=job.file_name,
+                                 queued_s=round(time.time() - job.created, 4))
+        span = start_span("ingestion.process", parent=job.trace_parent, file_name=job.file_name,
+                          queued_ms=round((time.time() - job.created) * 1000, 1))
+        metrics.set(trace_id=span.trace_id)
+        try:
+            with use_span(span), metrics.activate():
+                self._process(job, metrics)
+        except Exception as e:
+            print(f"Error ingesting {job.file_name}: {str(e)}")
+            job.finish(FAILED, f"Error processing file: {str(e)}")
+        finally:
+            span.set_attribute("status", job.status)
+            if job.status == FAILED:
+                span.set_error(job.message)
+            span.end()
+            metrics.finish(error=job.message if job.status == FAILED else None)
+            job.trace_parent = None
+
+    def _process(self, job, metrics):
+        job.status = RUNNING
+        job.update("Reading file", 0.05)
+
+        retriever = self.get_retriever()
+        with metrics.stage("extraction"), trace("ingestion.extract"):
+            file_path, file_name, content, is_duplicate = handle_uploaded_file(
+                job.uploaded_file, self.upload_folder,
+                is_indexed=lambda digest: document_is_indexed(retriever.vectorstore, digest)
+            )
+        metrics.set(duplicate=is_duplicate, content_chars=len(content or ""))
+        if is_duplicate:
+            # Indexed but the raw file is gone: keep it, so index rebuilds can carry the upload over
+            if not os.path.exists(file_path):
+                save_uploaded_file(job.uploaded_file, file_path)
+            job.finish(DUPLICATE, f"'{file_name}' is already indexed, nothing to do.")
+            return
+
+        if not content:
+            job.finish(FAILED, f"Couldn't extract content from {file_name}")
+            return
+
+        document_data = {
+            "file_name": file_name,
+            "content": content,
+            "content_hash": os.path.splitext(os.path.basename(file_path))[0]
+        }
+
+        # Chunking and embedding cover the remaining 10%-95% of the progress bar
+        def on_progress(stage, fraction):
+            job.update(stage, 0.1 + 0.85 * fraction)
+
+        # Hold the index's write lock until the raw file is saved, so an index swap
+        # either carries this upload over or happens before it is added
+        with self.write_lock:
+            with metrics.stage("indexing"), trace("ingestion.index", content_chars=len(content)):
+                success = add_document_to_store(document_data, retriever=self.get_retriever(),
+                                                progress_callback=on_progress)
+            if success:
+                # Only now keep the raw file, marking its contents as indexed
+                save_uploaded_file(job.uploaded_file, file_path)
+        if not success:
+            job.finish(FAILED, f"Failed to add {file_name} to vector store")
+            return
+
+        job.finish(DONE, f"File '{file_name}' has been added to the knowledge base. "
+                         "You can now ask questions about its content.")
@@ -1,10 +1,11 @@
-from config import FOLDER_PATH, CHROMA_INDEX_PATH, RETRIEVER_SEARCH_DISTANCE, RETRIEVER_K, GROQ_API_KEY
+from config import FOLDER_PATH, RETRIEVER_K, GROQ_API_KEY, INDEX_BUNDLE_PATH, API_URL
 from data_loader import read_txts_from_folder
-from vector_store import initialize_vector_store
-from chatbot import get_bot_response
-import ui
-import os
-from langchain_chroma import Chroma
+from vector_store import initialize_vector_store, vector_store_exists, get_index_path, load_vector_store, get_text_store
+from retrieval import create_retriever
+from index_manager import build_index_version
+from index_versions import set_current
+from index_bundle import ensure_bundle_installed
+from profiling import profile_request
 from vector_store import get_embedding_function
 
 
@@ -28,31 +29,31 @@ def initialize_system():
         print("Create a .env file with GROQ_API_KEY=your_api_key")
     
     try:
-        # Check if embeddings already exist
-        chroma_exists = os.path.exists(CHROMA_INDEX_PATH) and os.listdir(CHROMA_INDEX_PATH)
+        # Serve a prebuilt index bundle instead of embedding the corpus here
+        if INDEX_BUNDLE_PATH and ensure_bundle_installed(INDEX_BUNDLE_PATH):
+            print(f"Installed prebuilt index from {INDEX_BUNDLE_PATH}")
         
-        if chroma_exists:
-            print(f"Embeddings found at {CHROMA_INDEX_PATH}")
+        # Check if embeddings already exist
+        if vector_store_exists():
+            print(f"Embeddings found at {get_index_path()}")
             # Use existing vector store without adding new documents
-            chroma_vector_store = initialize_vector_store(use_existing=True)
+            vector_store = initialize_vector_store(use_existing=True)
         else:
-            # Load data from files and create new vector store
-            print(f"Loading data from {FOLDER_PATH}")
-            file_data = read_txts_from_folder(FOLDER_PATH)
-            print(f"Loaded {len(file_data)} files")
-            
-            # Initialize vector store with the loaded data
-            chroma_vector_store = initialize_vector_store(file_data)
+            # Load data from files and create new vector store, profiled as one build
+            with profile_request("build", "system"):
+                print(f"Loading data from {FOLDER_PATH}")
+                file_data = read_txts_from_folder(FOLDER_PATH)
+                print(f"Loaded {len(file_data)} files")
+                
+                # Build the first index version and make it live
+                index_path, vector_store = build_index_version(file_data)
+            set_current(index_path)
         
-        if chroma_vector_store is None:
+        if vector_store is None:
             raise ValueError("Vector store initialization failed, returned None")
         
         # Create retriever with configured parameters
-        retriever = chroma_vector_store.as_retriever(
-            search_kwargs={"k": RETRIEVER_K},
-            search_type="similarity",
-            search_distance=RETRIEVER_SEARCH_DISTANCE
-        )
+        retriever = create_retriever(vector_store, k=RETRIEVER_K, text_store=get_text_store())
         print("Retriever initialized successfully")
         
         return retriever
@@ -66,20 +67,11 @@ def initialize_system():
         # In case of failure, try creating a minimal functional retriever
         try:
             print("Attempting to create fallback vector store...")
-            # Make sure the directory exists
-            os.makedirs(CHROMA_INDEX_PATH, exist_ok=True)
-            
             # Try to create a basic vector store with default embeddings
-            fallback_store = Chroma(
-                persist_directory=CHROMA_INDEX_PATH,
-                embedding_function=get_embedding_function()
-            )
+            fallback_store = load_vector_store(get_embedding_function())
             
             # Create a basic retriever
-            fallback_retriever = fallback_store.as_retriever(
-                search_kwargs={"k": 1},
-                search_type="similarity"
-            )
+            fallback_retriever = create_retriever(fallback_store, k=1, text_store=get_text_store(), hybrid=False)
             
             print("Created fallback retriever")
             return fallback_retriever
@@ -96,6 +88,14 @@ def main():
     # Pass the function itself, don't call it here
     # retriever = initialize_system() 
     
+    # Imported here so the API server can use initialize_system without Streamlit
+    import ui
+    if API_URL:
+        # Answers are streamed from the shared API server (api.py)
+        from api_client import stream_bot_response as get_bot_response
+    else:
+        from chatbot import get_bot_response
+    
     # Start the UI, passing the initialization function
     ui.run(initialize_system, get_bot_response) # Pass the function
 
@@ -0,0 +1,343 @@
+import os
+import json
+import time
+import uuid
+import threading
+import contextvars
+from contextlib import contextmanager
+from config import METRICS_ENABLED, METRICS_LOG_PATH, LOG_MAX_BYTES, LOG_BACKUP_COUNT
+from profiling import current_profile
+
+# Histogram buckets, in seconds for latencies
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0)
+TOKEN_BUCKETS = (64, 128, 256, 512, 1024, 2048, 4096, 8192)
+RATE_BUCKETS = (5, 10, 25, 50, 100, 200, 400, 800)
+
+# Request whose metrics code deeper in the pipeline (caches, retrieval) reports to
+_current_request = contextvars.ContextVar("current_request_metrics", default=None)
+
+
+def _format_labels(labelnames, values, extra=None):
+    pairs = list(zip(labelnames, values)) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+class Counter:
+    """Monotonic counter with labels, in the Prometheus data model."""
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Histogram:
+    """Cumulative-bucket histogram with labels, in the Prometheus data model."""
+
+    def __init__(self, name, documentation, buckets, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(sorted(buckets))
+        self.labelnames = tuple(labelnames)
+        self._values = {}  # labels -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            state = self._values.setdefault(key, [0] * len(self.buckets) + [0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, state in sorted(self._values.items()):
+                for bound, count in zip(self.buckets, state):
+                    lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, ('le', bound))} {count}")
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, ('le', '+Inf'))} {state[-1]}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {state[-2]}")
+                lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {state[-1]}")
+        return lines
+
+
+class MetricsRegistry:
+    """The metrics of this process, rendered in the Prometheus text format."""
+
+    def __init__(self):
+        self._metrics = []
+
+    def counter(self, name, documentation, labelnames=()):
+        metric = Counter(name, documentation, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, documentation, buckets=LATENCY_BUCKETS, labelnames=()):
+        metric = Histogram(name, documentation, buckets, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+REQUESTS = registry.counter("rag_requests_total", "Requests handled", ("kind", "model", "status"))
+REQUEST_SECONDS = registry.histogram("rag_request_seconds", "End-to-end request time", LATENCY_BUCKETS,
+                                     ("kind", "model"))
+STAGE_SECONDS = registry.histogram("rag_stage_seconds", "Time spent in each pipeline stage", LATENCY_BUCKETS,
+                                   ("kind", "stage"))
+FIRST_TOKEN_SECONDS = registry.histogram("rag_time_to_first_token_seconds",
+                                         "Time from receiving a query to the first streamed token",
+                                         LATENCY_BUCKETS, ("model",))
+COMPLETION_RATE = registry.histogram("rag_completion_tokens_per_second", "LLM streaming speed",
+                                     RATE_BUCKETS, ("model",))
+CONTEXT_TOKENS = registry.histogram("rag_context_tokens", "Estimated tokens of retrieved context sent to the LLM",
+                                    TOKEN_BUCKETS, ("kind",))
+PROMPT_TOKENS = registry.counter("rag_prompt_tokens_total", "Prompt tokens sent to the LLM", ("model",))
+COMPLETION_TOKENS = registry.counter("rag_completion_tokens_total", "Completion tokens received from the LLM",
+                                     ("model",))
+CACHE_LOOKUPS = registry.counter("rag_cache_lookups_total", "Cache lookups by cache and result", ("cache", "result"))
+
+_log_lock = threading.Lock()
+
+
+def _rotate_log(path, backups):
+    """Shift path to path.1, path.1 to path.2 and so on, deleting the oldest."""
+    for i in range(backups, 0, -1):
+        source = f"{path}.{i - 1}" if i > 1 else path
+        if os.path.exists(source):
+            os.replace(source, f"{path}.{i}")
+    if backups == 0:
+        os.remove(path)
+
+
+def append_jsonl(path, lines, max_bytes=LOG_MAX_BYTES, backups=LOG_BACKUP_COUNT):
+    """
+    Append lines to a JSON-lines log, rotating it once it reaches max_bytes.
+
+    A log and its rotated copies take at most about max_bytes * (backups + 1)
+    on disk.
+
+    Args:
+        path (str): Log file
+        lines (list): JSON strings, one per line
+        max_bytes (int): Size at which the log is rotated, None to let it grow
+        backups (int): Rotated copies kept
+    """
+    with _log_lock:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if max_bytes and os.path.exists(path) and os.path.getsize(path) >= max_bytes:
+            _rotate_log(path, backups)
+        with open(path, "a", encoding="utf-8") as f:
+            for line in lines:
+                f.write(line + "\n")
+
+
+def write_record(record, path=METRICS_LOG_PATH):
+    """Append one record to the JSON-lines metrics log."""
+    if not path:
+        return
+    try:
+        append_jsonl(path, [json.dumps(record, default=str)])
+    except Exception as e:
+        print(f"Error writing request metrics: {str(e)}")
+
+
+class RequestMetrics:
+    """
+    Timings and counts of one request through the pipeline.
+
+    Stages are timed with stage(); code deeper in the pipeline reports cache
+    lookups through record_cache() while the request is activated. finish()
+    writes the request as one JSON line and adds it to the process metrics.
+    """
+
+    def __init__(self, kind, session_id="default", **fields):
+        """
+        Start timing a request.
+
+        Args:
+            kind (str): "chat", "report", "retrieve" or "ingest"
+            session_id (str): Session the request belongs to
+            **fields: Further values recorded with the request, e.g. model
+        """
+        profile = current_profile()
+        # A profiled request's report is named with the same id
+        self.request_id = profile.request_id if profile is not None else uuid.uuid4().hex[:16]
+        self.kind = kind
+        self.session_id = session_id
+        self.fields = dict(fields)
+        self.stages = {}
+        self.counts = {}
+        self.started = time.time()
+        self._start = time.perf_counter()
+        self._first_token = None
+        self._finished = False
+        self.error = None
+
+    @contextmanager
+    def stage(self, name):
+        """Time a pipeline stage; repeated stages add up."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - start
+
+    @contextmanager
+    def activate(self):
+        """Make this the request that record_cache() reports to, within the block."""
+        token = _current_request.set(self)
+        try:
+            yield self
+        finally:
+            _current_request.reset(token)
+
+    def set(self, **fields):
+        self.fields.update(fields)
+
+    def count(self, name, amount=1):
+        self.counts[name] = self.counts.get(name, 0) + amount
+
+    def mark_first_token(self):
+        if self._first_token is None:
+            self._first_token = time.perf_counter() - self._start
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self._start
+
+    def finish(self, error=None):
+        """
+        Record the finished request. Later calls do nothing.
+
+        Args:
+            error (str, optional): Why the request failed, defaults to the error attribute
+
+        Returns:
+            dict: The recorded values
+        """
+        if self._finished:
+            return None
+        self._finished = True
+        error = error or self.error
+        total = self.elapsed
+        model = self.fields.get("model", "")
+
+        record = {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.started)),
+            "request_id": self.request_id,
+            "session_id": self.session_id,
+            "kind": self.kind,
+            **self.fields,
+            "total_s": round(total, 4),
+            "stages_s": {name: round(seconds, 4) for name, seconds in self.stages.items()},
+            "time_to_first_token_s": round(self._first_token, 4) if self._first_token is not None else None,
+            **self.counts,
+            "error": error
+        }
+        if not METRICS_ENABLED:
+            return record
+
+        REQUESTS.inc(kind=self.kind, model=model, status="error" if error else "ok")
+        REQUEST_SECONDS.observe(total, kind=self.kind, model=model)
+        for name, seconds in self.stages.items():
+            STAGE_SECONDS.observe(seconds, kind=self.kind, stage=name)
+        if self._first_token is not None:
+            FIRST_TOKEN_SECONDS.observe(self._first_token, model=model)
+        if self.fields.get("completion_tokens_per_s"):
+            COMPLETION_RATE.observe(self.fields["completion_tokens_per_s"], model=model)
+        if "context_tokens" in self.fields:
+            CONTEXT_TOKENS.observe(self.fields["context_tokens"], kind=self.kind)
+        if self.fields.get("prompt_tokens"):
+            PROMPT_TOKENS.inc(self.fields["prompt_tokens"], model=model)
+        if self.fields.get("completion_tokens"):
+            COMPLETION_TOKENS.inc(self.fields["completion_tokens"], model=model)
+        write_record(record)
+        return record
+
+
+def current_request():
+    """The request activated on this thread, or None."""
+    return _current_request.get()
+
+
+def record_cache(cache, hits, misses):
+    """
+    Count lookups of a cache, for the process and for the active request.
+
+    Args:
+        cache (str): Cache name, e.g. "sentence_embeddings"
+        hits (int): Lookups served from the cache
+        misses (int): Lookups that had to compute or load the value
+    """
+    if not METRICS_ENABLED:
+        return
+    if hits:
+        CACHE_LOOKUPS.inc(hits, cache=cache, result="hit")
+    if misses:
+        CACHE_LOOKUPS.inc(misses, cache=cache, result="miss")
+    request = _current_request.get()
+    if request is not None:
+        request.count(f"{cache}_cache_hits", hits)
+        request.count(f"{cache}_cache_misses", misses)
+
+
+def start_metrics_server(port, host="127.0.0.1"):
+    """
+    Serve the Prometheus metrics of this process on a background thread.
+
+    Used by the Streamlit process; the API serves /metrics itself.
+
+    Args:
+        port (int): Port to listen on
+        host (str): Interface to bind
+
+    Returns:
+        ThreadingHTTPServer: The running server
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    print(f"Serving metrics on http://{host}:{port}/metrics")
+    return server
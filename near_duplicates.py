@@ -0,0 +1,299 @@
+import os
+import zlib
+import threading
+import numpy as np
+from config import (
+    NEAR_DUPLICATE_THRESHOLD,
+    MINHASH_PERMUTATIONS,
+    MINHASH_BANDS,
+    MINHASH_SHINGLE_SIZE
+)
+from bm25_index import tokenize
+
+# Hashes are taken modulo a Mersenne prime small enough that a * x + b fits in int64
+MERSENNE_PRIME = (1 << 31) - 1
+
+# Signatures of an index's stored chunks, saved in the index directory
+SIGNATURES_FILE = "minhash.npz"
+
+
+def shingles(text, size=MINHASH_SHINGLE_SIZE):
+    """
+    Split text into overlapping word n-grams.
+
+    Args:
+        text (str): The text to shingle
+        size (int): Words per shingle
+
+    Returns:
+        set: Distinct shingles; texts shorter than size give one shingle
+    """
+    tokens = tokenize(text)
+    if len(tokens) <= size:
+        return {" ".join(tokens)} if tokens else set()
+    return {" ".join(tokens[i:i + size]) for i in range(len(tokens) - size + 1)}
+
+
+class MinHasher:
+    """MinHash signatures estimating the Jaccard similarity of shingle sets."""
+
+    def __init__(self, num_perm=MINHASH_PERMUTATIONS, seed=1):
+        """
+        Initialize the hash permutations.
+
+        Args:
+            num_perm (int): Number of permutations, i.e. signature length
+            seed (int): Seed making signatures comparable between runs
+        """
+        rng = np.random.default_rng(seed)
+        self.num_perm = num_perm
+        self.a = rng.integers(1, MERSENNE_PRIME, num_perm, dtype=np.int64)
+        self.b = rng.integers(0, MERSENNE_PRIME, num_perm, dtype=np.int64)
+
+    def signature(self, shingle_set):
+        """
+        Compute the MinHash signature of a shingle set.
+
+        Args:
+            shingle_set (set): Shingles of one text
+
+        Returns:
+            np.ndarray: int64 signature of length num_perm
+        """
+        if not shingle_set:
+            return np.full(self.num_perm, MERSENNE_PRIME, dtype=np.int64)
+        hashes = np.fromiter((zlib.crc32(s.encode("utf-8")) for s in shingle_set),
+                             dtype=np.int64, count=len(shingle_set)) % MERSENNE_PRIME
+        return ((np.outer(hashes, self.a) + self.b) % MERSENNE_PRIME).min(axis=0)
+
+
+class SignatureIndex:
+    """
+    MinHash signatures of chunks, bucketed by LSH band for lookups.
+
+    Signatures are cut into bands, and a chunk sharing any band with an
+    earlier one is compared with it by estimated Jaccard similarity. Given a
+    path, the signatures are loaded from and saved to that file, so the
+    chunks of an index can be matched by later uploads.
+    """
+
+    def __init__(self, path=None, threshold=NEAR_DUPLICATE_THRESHOLD, num_perm=MINHASH_PERMUTATIONS,
+                 bands=MINHASH_BANDS):
+        """
+        Args:
+            path (str, optional): Signature file, None to keep them in memory only
+            threshold (float): Minimum estimated Jaccard similarity of word shingles
+            num_perm (int): MinHash signature length
+            bands (int): LSH bands, must divide num_perm
+        """
+        self.path = path
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.hasher = MinHasher(num_perm)
+        self.ids = []
+        self.signatures = []
+        self.buckets = {}
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            self._load()
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _load(self):
+        try:
+            with np.load(self.path) as data:
+                ids, signatures = list(data["ids"]), data["signatures"]
+        except Exception as e:
+            print(f"Error reading chunk signatures from {self.path}: {str(e)}")
+            return
+        if signatures.shape[1:] != (self.hasher.num_perm,):
+            print(f"Ignoring chunk signatures in {self.path}, they were computed with other MinHash settings")
+            return
+        for chunk_id, signature in zip(ids, signatures):
+            self._add(str(chunk_id), signature)
+
+    def _band_keys(self, signature):
+        return [(band, signature[band * self.rows:(band + 1) * self.rows].tobytes()) for band in range(self.bands)]
+
+    def _add(self, chunk_id, signature):
+        position = len(self.ids)
+        self.ids.append(chunk_id)
+        self.signatures.append(signature)
+        for key in self._band_keys(signature):
+            self.buckets.setdefault(key, []).append(position)
+
+    def signature(self, text):
+        """MinHash signature of a text, or None if it has no words."""
+        shingle_set = shingles(text)
+        return self.hasher.signature(shingle_set) if shingle_set else None
+
+    def match(self, signature):
+        """
+        Find the earliest stored chunk a signature nearly duplicates.
+
+        Returns:
+            int: Position of the chunk in ids, or None
+        """
+        candidates = set()
+        for key in self._band_keys(signature):
+            candidates.update(self.buckets.get(key, ()))
+        # Earlier chunks first, so duplicates attach to the oldest copy
+        for position in sorted(candidates):
+            if np.mean(signature == self.signatures[position]) >= self.threshold:
+                return position
+        return None
+
+    def add(self, ids, texts):
+        """Store the signatures of chunks; chunks without words are skipped."""
+        with self._lock:
+            for chunk_id, text in zip(ids, texts):
+                signature = self.signature(text)
+                if signature is not None:
+                    self._add(chunk_id, signature)
+
+    def deduplicate(self, texts, metadatas, ids):
+        """
+        Drop chunks that nearly duplicate a stored chunk.
+
+        Args:
+            texts (list): Chunk texts
+            metadatas (list): Metadata dictionaries, one per chunk
+            ids (list): Chunk ids, one per chunk
+
+        Returns:
+            tuple: (texts, metadatas, ids, matches) of the kept chunks, where
+                matches maps each stored chunk id that stood in for dropped
+                chunks to the metadata of those chunks
+        """
+        kept_texts, kept_metadatas, kept_ids, matches = [], [], [], {}
+        with self._lock:
+            for text, metadata, chunk_id in zip(texts, metadatas, ids):
+                signature = self.signature(text)
+                position = self.match(signature) if signature is not None else None
+                if position is None:
+                    kept_texts.append(text)
+                    kept_metadatas.append(metadata)
+                    kept_ids.append(chunk_id)
+                else:
+                    matches.setdefault(self.ids[position], []).append(metadata)
+        return kept_texts, kept_metadatas, kept_ids, matches
+
+    def save(self):
+        """Write the signatures to path, replacing the file atomically."""
+        if not self.path:
+            return
+        with self._lock:
+            ids = np.array(self.ids, dtype=str)
+            signatures = (np.vstack(self.signatures) if self.signatures
+                          else np.zeros((0, self.hasher.num_perm), dtype=np.int64))
+        temp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(temp_path, "wb") as f:
+            np.savez(f, ids=ids, signatures=signatures)
+        os.replace(temp_path, self.path)
+
+
+def find_near_duplicates(texts, threshold=NEAR_DUPLICATE_THRESHOLD, num_perm=MINHASH_PERMUTATIONS,
+                         bands=MINHASH_BANDS):
+    """
+    Group near-duplicate texts with MinHash and locality-sensitive hashing.
+
+    Each text is assigned to the earliest text it nearly duplicates, so the
+    first occurrence of a block of boilerplate becomes the canonical copy.
+
+    Args:
+        texts (list): Texts in corpus order
+        threshold (float): Minimum estimated Jaccard similarity of word shingles
+        num_perm (int): MinHash signature length
+        bands (int): LSH bands, must divide num_perm
+
+    Returns:
+        list: Index of the canonical text for each text, its own index if unique
+    """
+    index = SignatureIndex(threshold=threshold, num_perm=num_perm, bands=bands)
+    canonical = list(range(len(texts)))
+
+    for i, text in enumerate(texts):
+        signature = index.signature(text)
+        if signature is None:
+            continue
+        position = index.match(signature)
+        if position is not None:
+            canonical[i] = canonical[int(index.ids[position])]
+        index._add(str(i), signature)
+
+    return canonical
+
+
+def merge_duplicate_sources(metadata, duplicates):
+    """
+    Record on a canonical chunk that further copies of it were dropped.
+
+    Args:
+        metadata (dict): Metadata of the canonical chunk
+        duplicates (list): Metadata of the dropped copies
+
+    Returns:
+        dict: Updated copy of metadata, with duplicate_count and also_in
+    """
+    own_source = metadata.get("source", "")
+    sources = {source for source in metadata.get("also_in", "").split("; ") if source}
+    sources.update(duplicate.get("source", "") for duplicate in duplicates)
+    sources.discard("")
+    sources.discard(own_source)
+
+    merged = {**metadata, "duplicate_count": int(metadata.get("duplicate_count", 1)) + len(duplicates)}
+    if sources:
+        # Chroma metadata values cannot be lists
+        merged["also_in"] = "; ".join(sorted(sources))
+    return merged
+
+
+def deduplicate_chunks(texts, metadatas, ids):
+    """
+    Drop near-duplicate chunks, keeping one canonical copy of each.
+
+    The canonical chunk records how many copies it stands for in
+    'duplicate_count' and the other files they came from in 'also_in'.
+
+    Args:
+        texts (list): Chunk texts
+        metadatas (list): Metadata dictionaries, one per chunk
+        ids (list): Chunk ids, one per chunk
+
+    Returns:
+        tuple: (texts, metadatas, ids, stats) of the kept chunks, where stats
+            holds the chunk counts before and after and the number of groups
+    """
+    canonical = find_near_duplicates(texts)
+
+    groups = {}
+    for i, root in enumerate(canonical):
+        groups.setdefault(root, []).append(i)
+
+    kept_texts, kept_metadatas, kept_ids = [], [], []
+    for i, (text, metadata, chunk_id) in enumerate(zip(texts, metadatas, ids)):
+        if canonical[i] != i:
+            continue
+        members = groups[i]
+        if len(members) > 1:
+            metadata = merge_duplicate_sources(metadata, [metadatas[j] for j in members if j != i])
+        kept_texts.append(text)
+        kept_metadatas.append(metadata)
+        kept_ids.append(chunk_id)
+
+    stats = {
+        "chunks": len(texts),
+        "kept": len(kept_texts),
+        "removed": len(texts) - len(kept_texts),
+        "groups": sum(1 for members in groups.values() if len(members) > 1)
+    }
+    return kept_texts, kept_metadatas, kept_ids, stats
+
+
+def format_deduplication_report(stats):
+    """Summarize deduplicate_chunks statistics in one line."""
+    saved = 100 * stats["removed"] / stats["chunks"] if stats["chunks"] else 0.0
+    return (f"Near-duplicate detection: {stats['removed']} of {stats['chunks']} chunks were copies "
+            f"in {stats['groups']} groups; {stats['kept']} vectors stored ({saved:.1f}% saved)")
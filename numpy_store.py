@@ -0,0 +1,419 @@
+import os
+import json
+import threading
+from typing import Any, Iterable, List, Optional
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+from config import NUMPY_VECTOR_DTYPE, QUANTIZED_RESCORE_FACTOR
+
+VECTORS_FILE = "vectors.f32"
+RECORDS_FILE = "records.jsonl"
+MANIFEST_FILE = "manifest.json"
+
+# Rows converted back to float32 at a time when scoring a compact matrix
+SCORE_BLOCK_ROWS = 4096
+
+
+def matches_where(metadata, where):
+    """
+    Evaluate a Chroma-style where clause against a metadata dictionary.
+
+    Supports equality, $in, $ne, $nin and $and/$or, which covers the filters
+    produced by retrieval.to_chroma_where.
+
+    Args:
+        metadata (dict): Chunk metadata
+        where (dict): Chroma where clause
+
+    Returns:
+        bool: True if the metadata satisfies the clause
+    """
+    for key, condition in where.items():
+        if key == "$and":
+            if not all(matches_where(metadata, clause) for clause in condition):
+                return False
+        elif key == "$or":
+            if not any(matches_where(metadata, clause) for clause in condition):
+                return False
+        elif isinstance(condition, dict):
+            value = metadata.get(key)
+            for operator, operand in condition.items():
+                if operator == "$eq" and value != operand:
+                    return False
+                if operator == "$ne" and value == operand:
+                    return False
+                if operator == "$in" and value not in operand:
+                    return False
+                if operator == "$nin" and value in operand:
+                    return False
+        elif metadata.get(key) != condition:
+            return False
+    return True
+
+
+def _normalize(matrix):
+    """Scale rows to unit length so a dot product is the cosine similarity."""
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+class CompactMatrix:
+    """
+    In-memory float16 or scalar-quantized int8 copy of the stored vectors.
+
+    int8 codes use one scale per dimension (the largest absolute value seen in
+    that dimension divided by 127). Scores are only approximate; the store
+    rescores the best candidates against the float32 rows on disk.
+    """
+
+    def __init__(self, dtype, dim):
+        """
+        Initialize an empty compact matrix.
+
+        Args:
+            dtype (str): "float16" or "int8"
+            dim (int): Vector dimension
+        """
+        if dtype not in ("float16", "int8"):
+            raise ValueError(f"Unsupported compact vector dtype: {dtype}")
+        self.dtype = dtype
+        self.dim = dim
+        self.rows = np.zeros((0, dim), dtype=np.float16 if dtype == "float16" else np.int8)
+        self.scales = np.zeros(dim, dtype=np.float32)
+
+    def __len__(self):
+        return len(self.rows)
+
+    @property
+    def nbytes(self):
+        return self.rows.nbytes + self.scales.nbytes
+
+    def _encode(self, vectors):
+        if self.dtype == "float16":
+            return vectors.astype(np.float16)
+        safe_scales = np.where(self.scales > 0, self.scales, 1.0)
+        return np.clip(np.rint(vectors / safe_scales), -127, 127).astype(np.int8)
+
+    def rebuild(self, vectors):
+        """
+        Re-encode every row, recomputing the int8 scales.
+
+        Args:
+            vectors: float32 matrix (may be a memmap), encoded block by block
+        """
+        if self.dtype == "int8":
+            self.scales = np.zeros(self.dim, dtype=np.float32)
+            for start in range(0, len(vectors), SCORE_BLOCK_ROWS):
+                block_max = np.abs(vectors[start:start + SCORE_BLOCK_ROWS]).max(axis=0) / 127.0
+                self.scales = np.maximum(self.scales, block_max)
+        self.rows = np.vstack([self._encode(np.asarray(vectors[start:start + SCORE_BLOCK_ROWS]))
+                               for start in range(0, len(vectors), SCORE_BLOCK_ROWS)] or [self.rows[:0]])
+
+    def append(self, vectors, all_vectors):
+        """
+        Encode and append new rows.
+
+        Args:
+            vectors: New float32 rows
+            all_vectors: Every float32 row including the new ones, used if the
+                int8 scales have to grow to fit the new rows
+        """
+        if self.dtype == "int8" and np.any(np.abs(vectors).max(axis=0) / 127.0 > self.scales):
+            self.rebuild(all_vectors)
+            return
+        self.rows = np.vstack([self.rows, self._encode(vectors)])
+
+    def scores(self, queries):
+        """
+        Approximate similarity of every row to each query.
+
+        Args:
+            queries: float32 matrix of shape (n_queries, dim)
+
+        Returns:
+            numpy.ndarray: float32 scores of shape (n_queries, n_rows)
+        """
+        # Folding the int8 scales into the queries lets rows be used as stored
+        weights = queries * self.scales if self.dtype == "int8" else queries
+        scores = np.empty((len(queries), len(self.rows)), dtype=np.float32)
+        for start in range(0, len(self.rows), SCORE_BLOCK_ROWS):
+            block = self.rows[start:start + SCORE_BLOCK_ROWS].astype(np.float32)
+            scores[:, start:start + len(block)] = weights @ block.T
+        return scores
+
+
+class NumpyVectorStore(VectorStore):
+    """
+    Exact (brute-force) vector store over a memory-mapped float32 matrix.
+
+    Vectors are normalized and appended to a flat file, with ids, texts and
+    metadata appended to a JSON lines file alongside it. Searches score every
+    stored vector with a single matrix product, so recall is exact, and
+    nothing beyond the page cache is needed to serve a few thousand chunks.
+
+    With a float16 or int8 dtype, searches instead scan a compact in-memory
+    copy of the vectors and rescore the best k * rescore_factor candidates
+    against the float32 rows, which stay on disk and are paged in on demand.
+    """
+
+    def __init__(self, persist_directory, embedding_function, dtype=NUMPY_VECTOR_DTYPE,
+                 rescore_factor=QUANTIZED_RESCORE_FACTOR):
+        """
+        Open (or create) a store in persist_directory.
+
+        Args:
+            persist_directory (str): Directory holding the store files
+            embedding_function: LangChain-compatible embedding function
+            dtype (str): In-memory search precision: "float32", "float16" or "int8"
+            rescore_factor (int): Candidates rescored at full precision per result
+                when dtype is compact
+        """
+        self.persist_directory = persist_directory
+        self._embedding_function = embedding_function
+        self.dtype = dtype
+        self.rescore_factor = rescore_factor
+        self._compact = None
+        self._lock = threading.Lock()
+        self.dim = None
+        self.ids, self.texts, self.metadatas = [], [], []
+        self._id_set = set()
+        self._matrix = np.zeros((0, 0), dtype=np.float32)
+
+        os.makedirs(persist_directory, exist_ok=True)
+        self._load()
+
+    @property
+    def embeddings(self) -> Optional[Embeddings]:
+        return self._embedding_function
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _path(self, name):
+        return os.path.join(self.persist_directory, name)
+
+    def _load(self):
+        """Read the manifest and records, then memory-map the vectors."""
+        if not os.path.exists(self._path(MANIFEST_FILE)):
+            return
+
+        with open(self._path(MANIFEST_FILE), "r", encoding="utf-8") as f:
+            self.dim = json.load(f)["dim"]
+
+        if os.path.exists(self._path(RECORDS_FILE)):
+            with open(self._path(RECORDS_FILE), "r", encoding="utf-8") as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    record = json.loads(line)
+                    self.ids.append(record["id"])
+                    self.texts.append(record["document"])
+                    self.metadatas.append(record["metadata"])
+
+        vector_bytes = os.path.getsize(self._path(VECTORS_FILE)) if os.path.exists(self._path(VECTORS_FILE)) else 0
+        n_rows = min(vector_bytes // (4 * self.dim), len(self.ids))
+
+        # A write interrupted between the two files leaves extra rows in one of
+        # them; cut both back to the rows they share so later appends stay aligned
+        if vector_bytes != n_rows * 4 * self.dim or len(self.ids) != n_rows:
+            print(f"Warning: Truncating {self.persist_directory} to {n_rows} consistent rows")
+            del self.ids[n_rows:], self.texts[n_rows:], self.metadatas[n_rows:]
+            with open(self._path(VECTORS_FILE), "ab") as f:
+                f.truncate(n_rows * 4 * self.dim)
+            with open(self._path(RECORDS_FILE), "w", encoding="utf-8") as f:
+                for doc_id, text, metadata in zip(self.ids, self.texts, self.metadatas):
+                    f.write(json.dumps({"id": doc_id, "document": text, "metadata": metadata}) + "\n")
+
+        self._id_set = set(self.ids)
+        self._remap(n_rows)
+
+    def _remap(self, n_rows, new_vectors=None):
+        if n_rows == 0:
+            self._matrix = np.zeros((0, self.dim or 0), dtype=np.float32)
+        else:
+            self._matrix = np.memmap(self._path(VECTORS_FILE), dtype=np.float32, mode="r", shape=(n_rows, self.dim))
+
+        if self.dtype == "float32" or not self.dim:
+            return
+        if self._compact is None or new_vectors is None:
+            self._compact = CompactMatrix(self.dtype, self.dim)
+            self._compact.rebuild(self._matrix)
+        else:
+            self._compact.append(new_vectors, self._matrix)
+
+    def add_vectors(self, vectors, texts, metadatas=None, ids=None):
+        """
+        Append precomputed vectors with their texts and metadata.
+
+        Args:
+            vectors: Array-like of shape (n, dim)
+            texts (list): Chunk texts
+            metadatas (list, optional): Metadata dictionaries
+            ids (list, optional): Chunk ids
+
+        Returns:
+            list: Ids of the rows that were added
+        """
+        texts = list(texts)
+        metadatas = metadatas or [{} for _ in texts]
+        ids = ids or [f"vec_{len(self.ids) + i}" for i in range(len(texts))]
+        vectors = _normalize(np.asarray(vectors, dtype=np.float32))
+
+        with self._lock:
+            keep, seen = [], set(self._id_set)
+            for i, doc_id in enumerate(ids):
+                if doc_id not in seen:
+                    keep.append(i)
+                    seen.add(doc_id)
+            if not keep:
+                return []
+
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+                with open(self._path(MANIFEST_FILE), "w", encoding="utf-8") as f:
+                    json.dump({"dim": self.dim, "dtype": "float32", "metric": "cosine"}, f)
+
+            # Append-only writes: vectors first, then the records that make them visible
+            with open(self._path(VECTORS_FILE), "ab") as f:
+                f.write(np.ascontiguousarray(vectors[keep]).tobytes())
+            with open(self._path(RECORDS_FILE), "a", encoding="utf-8") as f:
+                for i in keep:
+                    f.write(json.dumps({"id": ids[i], "document": texts[i], "metadata": metadatas[i]}) + "\n")
+
+            for i in keep:
+                self.ids.append(ids[i])
+                self.texts.append(texts[i])
+                self.metadatas.append(metadatas[i])
+                self._id_set.add(ids[i])
+            self._remap(len(self.ids), new_vectors=vectors[keep])
+
+        return [ids[i] for i in keep]
+
+    def add_texts(self, texts: Iterable[str], metadatas: Optional[List[dict]] = None,
+                  ids: Optional[List[str]] = None, **kwargs: Any) -> List[str]:
+        texts = list(texts)
+        if not texts:
+            return []
+        vectors = self._embedding_function.embed_documents(texts)
+        return self.add_vectors(vectors, texts, metadatas, ids)
+
+    def search_vectors(self, query_vectors, k=4, where=None):
+        """
+        Find the top k rows for a batch of query vectors with one matrix product.
+
+        Args:
+            query_vectors: Array-like of shape (n_queries, dim)
+            k (int): Number of results per query
+            where (dict, optional): Chroma-style metadata filter
+
+        Returns:
+            list: For each query, a list of (row index, cosine similarity) pairs, best first
+        """
+        with self._lock:
+            matrix, metadatas, compact = self._matrix, self.metadatas, self._compact
+
+        if len(matrix) == 0:
+            return [[] for _ in range(len(query_vectors))]
+
+        queries = _normalize(np.atleast_2d(np.asarray(query_vectors, dtype=np.float32)))
+        rescore = compact is not None
+        scores = compact.scores(queries)[:, :len(matrix)] if rescore else queries @ matrix.T
+
+        if where:
+            mask = np.fromiter((matches_where(m, where) for m in metadatas[:len(matrix)]), dtype=bool, count=len(matrix))
+            scores[:, ~mask] = -np.inf
+            k = min(k, int(mask.sum()))
+
+        k = min(k, scores.shape[1])
+        if k <= 0:
+            return [[] for _ in range(len(queries))]
+
+        # Partial selection of the top candidates, then sort just those
+        n_candidates = min(k * self.rescore_factor, scores.shape[1]) if rescore else k
+        top = np.argpartition(-scores, n_candidates - 1, axis=1)[:, :n_candidates]
+        results = []
+        for query, row, candidates in zip(queries, scores, top):
+            if rescore:
+                # Exact scores for the candidates, read from the float32 rows on disk
+                candidates = np.sort(candidates[np.isfinite(row[candidates])])
+                candidate_scores = matrix[candidates] @ query
+            else:
+                candidate_scores = row[candidates]
+            order = np.argsort(-candidate_scores)[:k]
+            results.append([(int(candidates[i]), float(candidate_scores[i])) for i in order])
+        return results
+
+    def similarity_search_with_score(self, query: str, k: int = 4, filter: Optional[dict] = None,
+                                     **kwargs: Any) -> List[tuple]:
+        query_vector = self._embedding_function.embed_query(query)
+        return self.similarity_search_by_vector_with_score(query_vector, k=k, filter=filter)
+
+    def similarity_search_by_vector_with_score(self, embedding: List[float], k: int = 4,
+                                               filter: Optional[dict] = None, **kwargs: Any) -> List[tuple]:
+        hits = self.search_vectors([embedding], k=k, where=filter)[0]
+        return [
+            (Document(page_content=self.texts[i], metadata=self.metadatas[i], id=self.ids[i]), score)
+            for i, score in hits
+        ]
+
+    def similarity_search(self, query: str, k: int = 4, filter: Optional[dict] = None,
+                          **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k=k, filter=filter)]
+
+    def similarity_search_by_vector(self, embedding: List[float], k: int = 4,
+                                    filter: Optional[dict] = None, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_by_vector_with_score(embedding, k=k, filter=filter)]
+
+    def _select_relevance_score_fn(self):
+        # Scores are already cosine similarities
+        return lambda score: score
+
+    def get(self, ids=None, include=None, **kwargs):
+        """
+        Return stored chunks in the same shape as Chroma's get().
+
+        Args:
+            ids (list, optional): Chunks to return, defaults to every chunk
+
+        Returns:
+            dict: ids, documents and metadatas lists
+        """
+        with self._lock:
+            if ids is None:
+                return {"ids": list(self.ids), "documents": list(self.texts), "metadatas": list(self.metadatas)}
+            wanted = set(ids)
+            rows = [i for i, doc_id in enumerate(self.ids) if doc_id in wanted]
+            return {"ids": [self.ids[i] for i in rows], "documents": [self.texts[i] for i in rows],
+                    "metadatas": [self.metadatas[i] for i in rows]}
+
+    def update_metadatas(self, ids, metadatas):
+        """
+        Replace the metadata of stored chunks.
+
+        The records file is rewritten and swapped in atomically; vectors are untouched.
+
+        Args:
+            ids (list): Chunk ids
+            metadatas (list): New metadata dictionaries, one per id
+        """
+        updates = dict(zip(ids, metadatas))
+        with self._lock:
+            for i, doc_id in enumerate(self.ids):
+                if doc_id in updates:
+                    self.metadatas[i] = updates[doc_id]
+            temp_path = self._path(f"{RECORDS_FILE}.tmp")
+            with open(temp_path, "w", encoding="utf-8") as f:
+                for doc_id, text, metadata in zip(self.ids, self.texts, self.metadatas):
+                    f.write(json.dumps({"id": doc_id, "document": text, "metadata": metadata}) + "\n")
+            os.replace(temp_path, self._path(RECORDS_FILE))
+
+    @classmethod
+    def from_texts(cls, texts: List[str], embedding: Embeddings, metadatas: Optional[List[dict]] = None,
+                   ids: Optional[List[str]] = None, persist_directory: Optional[str] = None,
+                   **kwargs: Any) -> "NumpyVectorStore":
+        store = cls(persist_directory=persist_directory, embedding_function=embedding)
+        store.add_texts(texts, metadatas=metadatas, ids=ids)
+        return store
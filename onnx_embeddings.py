@@ -0,0 +1,158 @@
+import os
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from config import (
+    EMBEDDING_MODEL_NAME,
+    ONNX_MODEL_PATH,
+    ONNX_QUANTIZE,
+    ONNX_NUM_THREADS,
+    ONNX_BATCH_SIZE,
+    CHUNK_MAX_TOKENS
+)
+
+# Opset supported by both the PyTorch exporter and ONNX Runtime's quantizer
+ONNX_OPSET = 14
+
+
+def onnx_model_file(quantize=ONNX_QUANTIZE, model_dir=ONNX_MODEL_PATH):
+    """Path of the exported embedding model."""
+    name = EMBEDDING_MODEL_NAME.replace("/", "--")
+    return os.path.join(model_dir, f"{name}-{'int8' if quantize else 'fp32'}.onnx")
+
+
+def export_onnx_model(quantize=ONNX_QUANTIZE, model_dir=ONNX_MODEL_PATH):
+    """
+    Export the embedding model's transformer to ONNX, optionally int8-quantized.
+
+    Only the transformer is exported; mean pooling and normalization are
+    done in numpy by OnnxEmbeddings. Dynamic quantization stores the weights
+    of the linear layers as int8 and quantizes activations at run time, so
+    no calibration data is needed.
+
+    Args:
+        quantize (bool): Whether to write the int8 model as well as the fp32 one
+        model_dir (str): Folder the models are written to
+
+    Returns:
+        str: Path of the requested model
+    """
+    import torch
+    from transformers import AutoModel
+    from vector_store import embedding_model_id, load_embedding_tokenizer
+
+    os.makedirs(model_dir, exist_ok=True)
+    fp32_path = onnx_model_file(False, model_dir)
+    if not os.path.exists(fp32_path):
+        print(f"Exporting {EMBEDDING_MODEL_NAME} to ONNX")
+        model = AutoModel.from_pretrained(embedding_model_id()).eval()
+        sample = load_embedding_tokenizer()(["An example sentence to trace the model with."], return_tensors="pt")
+        input_names = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in sample]
+        dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names + ["last_hidden_state"]}
+        temp_path = f"{fp32_path}.tmp"
+        with torch.no_grad():
+            torch.onnx.export(model, tuple(sample[name] for name in input_names), temp_path,
+                              input_names=input_names, output_names=["last_hidden_state"],
+                              dynamic_axes=dynamic_axes, opset_version=ONNX_OPSET)
+        os.replace(temp_path, fp32_path)
+
+    if not quantize:
+        return fp32_path
+
+    int8_path = onnx_model_file(True, model_dir)
+    if not os.path.exists(int8_path):
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+        print(f"Quantizing {os.path.basename(fp32_path)} to int8")
+        temp_path = f"{int8_path}.tmp"
+        quantize_dynamic(fp32_path, temp_path, weight_type=QuantType.QInt8)
+        os.replace(temp_path, int8_path)
+    return int8_path
+
+
+class OnnxEmbeddings(Embeddings):
+    """
+    LangChain embeddings running the exported model on ONNX Runtime.
+
+    Texts are sorted by length before batching so each batch is padded only
+    to its own longest text. Outputs are mean-pooled and L2-normalized like
+    the sentence-transformers pipeline of the PyTorch model.
+    """
+
+    def __init__(self, model_path, tokenizer, num_threads=ONNX_NUM_THREADS, batch_size=ONNX_BATCH_SIZE,
+                 max_length=CHUNK_MAX_TOKENS):
+        """
+        Args:
+            model_path (str): Exported .onnx model
+            tokenizer: Hugging Face tokenizer of the model
+            num_threads (int, optional): Intra-op threads, None lets ONNX Runtime decide
+            batch_size (int): Texts per inference call
+            max_length (int): Tokens per text, longer texts are truncated
+        """
+        import onnxruntime
+
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.session = onnxruntime.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+        self.input_names = {model_input.name for model_input in self.session.get_inputs()}
+        self.tokenizer = tokenizer
+        self.batch_size = batch_size
+        self.max_length = max_length
+
+    def _embed_batch(self, texts):
+        encoded = self.tokenizer(texts, padding=True, truncation=True, max_length=self.max_length,
+                                 return_tensors="np")
+        feeds = {name: np.asarray(values, dtype=np.int64) for name, values in encoded.items()
+                 if name in self.input_names}
+        hidden = self.session.run(None, feeds)[0]
+        mask = feeds["attention_mask"][:, :, None].astype(np.float32)
+        pooled = (hidden * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+        return pooled / np.maximum(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12)
+
+    def embed_array(self, texts):
+        """
+        Embed texts and return the vectors as one float32 matrix.
+
+        Returns:
+            np.ndarray: Shape (len(texts), dim)
+        """
+        texts = list(texts)
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        vectors = None
+        for start in range(0, len(order), self.batch_size):
+            batch = order[start:start + self.batch_size]
+            embedded = self._embed_batch([texts[i] for i in batch])
+            if vectors is None:
+                vectors = np.empty((len(texts), embedded.shape[1]), dtype=np.float32)
+            vectors[batch] = embedded
+        return vectors
+
+    def embed_documents(self, texts):
+        return self.embed_array(texts).tolist()
+
+    def embed_query(self, text):
+        return self.embed_array([text])[0].tolist()
+
+
+def load_onnx_embeddings(quantize=ONNX_QUANTIZE, num_threads=ONNX_NUM_THREADS):
+    """
+    Load the ONNX embedding model, exporting it on first use.
+
+    Args:
+        quantize (bool): Whether to use the int8 model
+        num_threads (int, optional): Intra-op threads
+
+    Returns:
+        OnnxEmbeddings: The embedding function
+    """
+    from vector_store import load_embedding_tokenizer
+
+    model_path = onnx_model_file(quantize)
+    if not os.path.exists(model_path):
+        model_path = export_onnx_model(quantize)
+    tokenizer = load_embedding_tokenizer()
+    if tokenizer is None:
+        raise RuntimeError(f"The tokenizer of {EMBEDDING_MODEL_NAME} is required")
+    return OnnxEmbeddings(model_path, tokenizer, num_threads=num_threads)
@@ -0,0 +1,365 @@
+"""
+On-demand CPU and allocation profiling of single requests.
+
+With PROFILING_MODE = "on_demand", a request is profiled when it asks for
+it (the UI's "Profile my requests" toggle, "profile": true on POST /chat,
+profile=1 on POST /ingest or POST /index/rebuild, `build_index.py build
+--profile`); with "all", every request is. Index builds count as requests
+too: the first folder build at startup ("build", only under "all"),
+background rebuilds ("rebuild") and offline builds ("build"). While a profiled
+request runs, a sampling profiler records the stacks of the thread doing
+its work and tracemalloc tracks allocations. Each request then gets two
+files in PROFILE_OUTPUT_PATH, named with its kind, session and request id:
+
+    <time>-<kind>-<session>-<request>.txt        top functions and allocations
+    <time>-<kind>-<session>-<request>.collapsed  stacks for flamegraph.pl or speedscope
+
+With PROFILING_MODE = "off" nothing is wrapped and nothing runs.
+"""
+import os
+import re
+import sys
+import time
+import uuid
+import inspect
+import sysconfig
+import functools
+import threading
+import contextvars
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+from config import (
+    BASE_DIR,
+    PROFILING_MODE,
+    PROFILE_OUTPUT_PATH,
+    PROFILE_SAMPLE_INTERVAL_MS,
+    PROFILE_ALLOCATIONS,
+    PROFILE_TOP_N
+)
+
+_STDLIB_DIR = sysconfig.get_paths()["stdlib"]
+
+# Profile of the request running on this thread, so its metrics can share the request id
+_current_profile = contextvars.ContextVar("current_profile", default=None)
+
+
+def should_profile(requested=False):
+    """
+    Whether a request is profiled under PROFILING_MODE.
+
+    Args:
+        requested (bool): Whether the request asked to be profiled
+
+    Returns:
+        bool: True to profile the request
+    """
+    return PROFILING_MODE == "all" or (PROFILING_MODE == "on_demand" and bool(requested))
+
+
+def current_profile():
+    """The profile of the request running on this thread, or None."""
+    return _current_profile.get()
+
+
+def _short_path(path):
+    """File path relative to the repo, the standard library or site-packages, for readable reports."""
+    for root in (BASE_DIR, _STDLIB_DIR):
+        if path.startswith(root + os.sep):
+            return os.path.relpath(path, root)
+    marker = "site-packages" + os.sep
+    if marker in path:
+        return path.split(marker, 1)[1]
+    return path
+
+
+def _frame_label(code):
+    return f"{code.co_name} ({_short_path(code.co_filename)}:{code.co_firstlineno})"
+
+
+class StackSampler:
+    """
+    Samples the Python stacks of the threads running profiled requests.
+
+    One background thread serves every profiled request. It only runs while
+    a thread is registered, and a thread is only registered while it is
+    doing a profiled request's work, not while a stream waits on its reader.
+    """
+
+    def __init__(self, interval=PROFILE_SAMPLE_INTERVAL_MS / 1000):
+        self.interval = interval
+        self._threads = {}  # thread id -> RequestProfile
+        self._lock = threading.Lock()
+        self._worker = None
+
+    def register(self, profile):
+        with self._lock:
+            self._threads[threading.get_ident()] = profile
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+                self._worker.start()
+
+    def unregister(self):
+        with self._lock:
+            self._threads.pop(threading.get_ident(), None)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                if not self._threads:
+                    self._worker = None
+                    return
+                threads = dict(self._threads)
+            frames = sys._current_frames()
+            for thread_id, profile in threads.items():
+                frame = frames.get(thread_id)
+                if frame is not None:
+                    profile.add_sample(frame)
+
+
+_sampler = StackSampler()
+
+_allocation_users = 0
+_started_tracemalloc = False
+_allocation_lock = threading.Lock()
+
+
+def _start_allocation_tracking():
+    """Start tracemalloc for a profiled request, shared by concurrent ones."""
+    global _allocation_users, _started_tracemalloc
+    with _allocation_lock:
+        if _allocation_users == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            _started_tracemalloc = True
+        _allocation_users += 1
+        tracemalloc.reset_peak()
+
+
+def _stop_allocation_tracking():
+    """Stop tracemalloc once no profiled request needs it, unless it was already on."""
+    global _allocation_users, _started_tracemalloc
+    with _allocation_lock:
+        _allocation_users -= 1
+        if _allocation_users == 0 and _started_tracemalloc:
+            tracemalloc.stop()
+            _started_tracemalloc = False
+
+
+class RequestProfile:
+    """
+    CPU samples and allocations of one request.
+
+    Work done on the request's behalf is wrapped in step(), which may run on
+    a different thread each time (the API advances answer streams on worker
+    threads). finish() writes the report.
+    """
+
+    def __init__(self, kind, session_id="default"):
+        """
+        Args:
+            kind (str): "chat", "ingest", "build" or "rebuild"
+            session_id (str): Session the request belongs to
+        """
+        self.request_id = uuid.uuid4().hex[:16]
+        self.kind = kind
+        self.session_id = session_id
+        self.stacks = Counter()
+        self.samples = 0
+        self.active_s = 0.0
+        self.started = time.time()
+        self._start = time.perf_counter()
+        self._snapshot = None
+        self._lock = threading.Lock()
+        self._finished = False
+        self.report_path = None
+
+    def start(self):
+        if PROFILE_ALLOCATIONS:
+            _start_allocation_tracking()
+            self._snapshot = tracemalloc.take_snapshot()
+
+    @contextmanager
+    def step(self):
+        """Profile the work done in the block, on the current thread."""
+        token = _current_profile.set(self)
+        _sampler.register(self)
+        start = time.perf_counter()
+        try:
+            yield self
+        finally:
+            self.active_s += time.perf_counter() - start
+            _sampler.unregister()
+            _current_profile.reset(token)
+
+    def add_sample(self, frame):
+        stack = []
+        while frame is not None:
+            stack.append(_frame_label(frame.f_code))
+            frame = frame.f_back
+        with self._lock:
+            self.stacks[tuple(reversed(stack))] += 1
+            self.samples += 1
+
+    def _allocation_lines(self):
+        snapshot = tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, __file__)
+        ])
+        _, peak = tracemalloc.get_traced_memory()
+        stats = [stat for stat in snapshot.compare_to(self._snapshot, "lineno") if stat.size_diff > 0]
+        lines = [
+            "Allocations (tracemalloc, process-wide while this request ran)",
+            f"  Peak traced memory: {peak / 2**20:.1f} MiB",
+            "  Memory still held at the end of the request, by line:"
+        ]
+        for stat in stats[:PROFILE_TOP_N]:
+            frame = stat.traceback[0]
+            lines.append(f"  {stat.size_diff / 2**10:>10.1f} KiB {stat.count_diff:>8} blocks  "
+                         f"{_short_path(frame.filename)}:{frame.lineno}")
+        return lines
+
+    def _cpu_lines(self):
+        own, total = Counter(), Counter()
+        for stack, count in self.stacks.items():
+            own[stack[-1]] += count
+            for label in set(stack):
+                total[label] += count
+
+        lines = []
+        for title, counts in (("own time (running in the function)", own),
+                              ("total time (function on the stack)", total)):
+            lines.append(f"Top functions by {title}")
+            lines.append(f"  {'samples':>8} {'share':>7}  function")
+            for label, count in counts.most_common(PROFILE_TOP_N):
+                lines.append(f"  {count:>8} {count / max(self.samples, 1):>7.1%}  {label}")
+            lines.append("")
+        return lines
+
+    def finish(self, error=None):
+        """
+        Stop profiling and write the report. Later calls do nothing.
+
+        Args:
+            error (str, optional): Why the request failed
+
+        Returns:
+            str: Path of the text report, or None if it could not be written
+        """
+        if self._finished:
+            return self.report_path
+        self._finished = True
+        wall = time.perf_counter() - self._start
+        try:
+            lines = [
+                f"Profile of {self.kind} request {self.request_id} (session {self.session_id})",
+                f"Started {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self.started))}, "
+                f"wall time {wall:.3f}s, active {self.active_s:.3f}s, "
+                f"{self.samples} samples every {PROFILE_SAMPLE_INTERVAL_MS} ms",
+            ]
+            if error:
+                lines.append(f"Error: {error}")
+            lines.append("")
+            with self._lock:
+                lines.extend(self._cpu_lines())
+            if self._snapshot is not None:
+                lines.extend(self._allocation_lines())
+
+            os.makedirs(PROFILE_OUTPUT_PATH, exist_ok=True)
+            session = re.sub(r"[^A-Za-z0-9_.-]", "_", str(self.session_id))[:64]
+            stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(self.started))
+            base = os.path.join(PROFILE_OUTPUT_PATH, f"{stamp}-{self.kind}-{session}-{self.request_id}")
+            with open(base + ".txt", "w", encoding="utf-8") as f:
+                f.write("\n".join(lines) + "\n")
+            with open(base + ".collapsed", "w", encoding="utf-8") as f:
+                for stack, count in self.stacks.most_common():
+                    f.write(f"{';'.join(stack)} {count}\n")
+            self.report_path = base + ".txt"
+            print(f"Profile written to {self.report_path}")
+        except Exception as e:
+            print(f"Error writing profile of request {self.request_id}: {str(e)}")
+        finally:
+            if self._snapshot is not None:
+                self._snapshot = None
+                _stop_allocation_tracking()
+        return self.report_path
+
+
+@contextmanager
+def profile_request(kind, session_id="default", requested=False):
+    """
+    Profile the block as one request, if PROFILING_MODE says so.
+
+    Args:
+        kind (str): "chat", "ingest", "build" or "rebuild"
+        session_id (str): Session the request belongs to
+        requested (bool): Whether the request asked to be profiled
+
+    Yields:
+        RequestProfile: The running profile, or None when not profiling
+    """
+    if not should_profile(requested):
+        yield None
+        return
+    profile = RequestProfile(kind, session_id)
+    profile.start()
+    error = None
+    try:
+        with profile.step():
+            yield profile
+    except Exception as e:
+        error = str(e)
+        raise
+    finally:
+        profile.finish(error)
+
+
+def _profiled_stream(stream, profile):
+    """Advance a stream inside profile steps, writing the report when it ends."""
+    error = None
+    profile.start()
+    try:
+        while True:
+            with profile.step():
+                try:
+                    item = next(stream)
+                except StopIteration:
+                    return
+            yield item
+    except GeneratorExit:
+        error = "cancelled"
+        stream.close()
+        raise
+    except Exception as e:
+        error = str(e)
+        raise
+    finally:
+        profile.finish(error)
+
+
+def profiled_stream(kind):
+    """
+    Decorator profiling a generator function per call, if PROFILING_MODE says so.
+
+    The decorated function's session_id and profile arguments name the
+    session and ask for the call to be profiled. With PROFILING_MODE "off"
+    the function is returned unwrapped.
+
+    Args:
+        kind (str): Request kind used in report names, e.g. "chat"
+    """
+    def decorator(func):
+        if PROFILING_MODE == "off":
+            return func
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            arguments = signature.bind(*args, **kwargs)
+            arguments.apply_defaults()
+            if not should_profile(arguments.arguments.get("profile")):
+                return func(*args, **kwargs)
+            profile = RequestProfile(kind, str(arguments.arguments.get("session_id", "default")))
+            return _profiled_stream(func(*args, **kwargs), profile)
+        return wrapper
+    return decorator
@@ -0,0 +1,230 @@
+import re
+from typing import Any, List
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.vectorstores import VectorStore
+from config import RETRIEVER_K, HYBRID_SEARCH_ENABLED, HYBRID_FETCH_K, RRF_K
+from bm25_index import BM25Index
+from chunk_store import add_chunks, is_offset_chunk, update_chunk_metadatas
+from tracing import trace
+
+
+# A document code named in a query, optionally followed by a revision,
+# e.g. "QAG2059", "qag 2059 rev 05"
+QUERY_CODE_PATTERN = re.compile(r'\b([A-Z]{3})[\s-]?(\d{4})(?:\s*(?:rev(?:ision)?\.?\s*)?(\d{2})\b)?', re.IGNORECASE)
+
+
+def to_chroma_where(filters):
+    """
+    Convert simple metadata filters into a Chroma where clause.
+
+    Args:
+        filters (dict): Field name to a value or a list of accepted values
+
+    Returns:
+        dict: Chroma where clause, or None when there are no filters
+    """
+    conditions = []
+    for field, accepted in (filters or {}).items():
+        if isinstance(accepted, (list, tuple, set)):
+            accepted = list(accepted)
+            conditions.append({field: accepted[0]} if len(accepted) == 1 else {field: {"$in": accepted}})
+        else:
+            conditions.append({field: accepted})
+
+    if not conditions:
+        return None
+    return conditions[0] if len(conditions) == 1 else {"$and": conditions}
+
+
+def _document_key(doc):
+    """Key used to recognise the same chunk coming back from both search legs."""
+    if getattr(doc, "id", None):
+        return doc.id
+    return (doc.metadata.get("source"), doc.metadata.get("chunk"), doc.page_content)
+
+
+class HybridRetriever(BaseRetriever):
+    """
+    Retriever combining dense vector search with BM25 keyword search.
+
+    Both legs return their best fetch_k candidates and the lists are merged
+    by reciprocal rank fusion, so a chunk that names the exact SOP code asked
+    about ranks highly even when its embedding does not. Metadata filters,
+    given explicitly or detected from document codes in the query, are
+    pushed down to both legs before they search. Without a lexical index
+    only the dense leg runs. Chunks stored as offsets into the document text
+    store have their text filled in only for the final results.
+    """
+
+    vectorstore: VectorStore
+    lexical_index: Any = None
+    text_store: Any = None
+    k: int = RETRIEVER_K
+    fetch_k: int = HYBRID_FETCH_K
+    rrf_k: int = RRF_K
+
+    def add_texts(self, texts, metadatas=None, ids=None):
+        """
+        Add chunks to both the vector store and the lexical index.
+
+        Args:
+            texts (list): Chunk texts
+            metadatas (list, optional): Metadata dictionaries, one per chunk
+            ids (list, optional): Chunk ids, one per chunk
+        """
+        metadatas = metadatas or [{} for _ in texts]
+        add_chunks(self.vectorstore, texts, metadatas, ids)
+        if self.lexical_index is not None:
+            # Offset-stored chunks are loaded from the text store when returned
+            stored_texts = ["" if is_offset_chunk(metadata) else text for text, metadata in zip(texts, metadatas)]
+            self.lexical_index.add(texts, metadatas, ids, stored_texts=stored_texts)
+
+    def update_metadatas(self, ids, metadatas):
+        """
+        Replace the metadata of stored chunks in both the vector store and the lexical index.
+
+        Args:
+            ids (list): Chunk ids
+            metadatas (list): New metadata dictionaries, one per id
+        """
+        update_chunk_metadatas(self.vectorstore, ids, metadatas)
+        if self.lexical_index is not None:
+            self.lexical_index.update_metadatas(ids, metadatas)
+
+    def metadata_values(self, field):
+        """
+        List the distinct values of an indexed metadata field, for filter menus.
+
+        Args:
+            field (str): Metadata field name, e.g. "code" or "department"
+
+        Returns:
+            list: Sorted distinct values
+        """
+        if self.lexical_index is None:
+            return []
+        return self.lexical_index.values(field)
+
+    def detect_filters(self, query):
+        """
+        Derive metadata filters from document codes named in the query.
+
+        Only codes that are actually indexed are used. When a single code is
+        named without a revision, the search is pinned to its latest indexed
+        revision so older revisions cannot be mixed into the answer.
+
+        Args:
+            query (str): The user's query
+
+        Returns:
+            dict: Field name to a value or a list of accepted values
+        """
+        if self.lexical_index is None:
+            return {}
+        known_codes = set(self.lexical_index.values("code"))
+        named = {}
+        for series, number, revision in QUERY_CODE_PATTERN.findall(query):
+            code = f"{series}{number}".upper()
+            if code in known_codes:
+                named.setdefault(code, revision)
+
+        if not named:
+            return {}
+        if len(named) > 1:
+            return {"code": sorted(named)}
+
+        code, revision = next(iter(named.items()))
+        revisions = self.lexical_index.values("revision", filters={"code": code})
+        if revision not in revisions:
+            revision = revisions[-1] if revisions else None
+        return {"code": code, "revision": revision} if revision else {"code": code}
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun,
+        filters: Any = None, **kwargs: Any
+    ) -> List[Document]:
+        k = kwargs.pop("k", self.k)
+
+        # Filters chosen by the user take precedence over those found in the query
+        filters = filters or {}
+        detected = {} if "code" in filters else self.detect_filters(query)
+        filters = {**detected, **filters}
+        where = to_chroma_where(filters)
+        if where:
+            kwargs["filter"] = where
+
+        # Embedding and searching are separate steps so each shows up in traces
+        with trace("retriever.embed_query"):
+            query_vector = self.vectorstore.embeddings.embed_query(query)
+        with trace("retriever.vector_search", k=max(self.fetch_k, k), filtered=bool(where)):
+            dense_docs = self.vectorstore.similarity_search_by_vector(query_vector, k=max(self.fetch_k, k), **kwargs)
+        lexical_hits = []
+        if self.lexical_index is not None:
+            with trace("retriever.lexical_search", k=max(self.fetch_k, k)):
+                lexical_hits = self.lexical_index.search(query, k=max(self.fetch_k, k), filters=filters)
+
+        fused_scores, documents = {}, {}
+        for rank, doc in enumerate(dense_docs):
+            key = _document_key(doc)
+            documents.setdefault(key, doc)
+            fused_scores[key] = fused_scores.get(key, 0.0) + 1.0 / (self.rrf_k + rank + 1)
+
+        for rank, (doc_id, text, metadata, _score) in enumerate(lexical_hits):
+            doc = Document(page_content=text, metadata=metadata, id=doc_id)
+            key = _document_key(doc)
+            documents.setdefault(key, doc)
+            fused_scores[key] = fused_scores.get(key, 0.0) + 1.0 / (self.rrf_k + rank + 1)
+
+        ranked = sorted(fused_scores, key=fused_scores.get, reverse=True)
+        results = [documents[key] for key in ranked[:k]]
+        if self.text_store is None:
+            return results
+        with trace("retriever.materialize", chunks=len(results)):
+            return self.text_store.materialize(results)
+
+
+def build_lexical_index(vector_store, text_store=None):
+    """
+    Build a BM25 index over every chunk already stored in the vector store.
+
+    Args:
+        vector_store: LangChain vector store exposing get()
+        text_store (DocumentTextStore, optional): Store holding the text of
+            offset-stored chunks
+
+    Returns:
+        BM25Index: Index over the same chunks as the vector store
+    """
+    index = BM25Index()
+    stored = vector_store.get(include=["documents", "metadatas"])
+    texts = stored["documents"]
+    if text_store is not None:
+        # Offset-stored chunks are tokenized from the text store but kept empty in the index
+        texts = [text_store.window(metadata) if is_offset_chunk(metadata) and not text else text
+                 for text, metadata in zip(texts, stored["metadatas"])]
+    index.add(texts, stored["metadatas"], stored["ids"], stored_texts=stored["documents"])
+    return index
+
+
+def create_retriever(vector_store, k=RETRIEVER_K, text_store=None, hybrid=HYBRID_SEARCH_ENABLED):
+    """
+    Create the retriever used to answer queries.
+
+    Args:
+        vector_store: Initialized LangChain vector store
+        k (int): Number of documents to retrieve
+        text_store (DocumentTextStore, optional): Store holding the text of
+            offset-stored chunks
+        hybrid (bool): Whether to add BM25 keyword search to the dense search
+
+    Returns:
+        HybridRetriever: Hybrid retriever, or dense-only if hybrid search is disabled
+    """
+    if not hybrid:
+        return HybridRetriever(vectorstore=vector_store, k=k, text_store=text_store)
+
+    lexical_index = build_lexical_index(vector_store, text_store)
+    print(f"Built BM25 index over {len(lexical_index)} chunks")
+    return HybridRetriever(vectorstore=vector_store, lexical_index=lexical_index, k=k, text_store=text_store)
@@ -1,5 +1,13 @@
 import re
 
+# Separator placed between pages of extracted text
+PAGE_BREAK = "\f"
+
+# Line prefixes marking document structure in extracted text. Both count as
+# whitespace for clean_text, so unstructured consumers simply ignore them.
+SECTION_BREAK = "\x1e"  # The line is a section heading
+TABLE_ROW = "\x1f"  # The line is a table row, kept whole as a single unit
+
 def clean_text(text):
     """
     Clean text by removing extra whitespace and form feeds.
@@ -15,6 +23,66 @@ def clean_text(text):
     return text.strip()
 
 
+def split_sentences(text):
+    """
+    Split text into sentences.
+    
+    Args:
+        text (str): The text to split
+        
+    Returns:
+        list: List of non-empty sentences
+    """
+    # Improved regex for better sentence splitting - matches period, exclamation, question mark 
+    # followed by space and capital letter
+    sentences = re.split(r'(?<=[.!?]) +(?=[A-Z])', text)
+    
+    # Filter out empty sentences
+    return [s for s in sentences if s.strip()]
+
+
+def split_units(text):
+    """
+    Split text into the units chunks are built from, tracking section headings.
+    
+    Plain text is split into sentences as by split_sentences. Lines marked
+    with TABLE_ROW are kept whole, and lines marked with SECTION_BREAK start
+    a new section and are kept as a unit of their own.
+    
+    Args:
+        text (str): The text to split
+        
+    Returns:
+        list: (unit, section heading) tuples, heading is "" before the first one
+    """
+    units = []
+    section = ""
+    paragraph_lines = []
+    
+    def flush():
+        for sentence in split_sentences(clean_text(" ".join(paragraph_lines))):
+            units.append((sentence, section))
+        paragraph_lines.clear()
+    
+    # str.splitlines() would also split on the marker characters
+    for line in text.split("\n"):
+        if line.startswith(SECTION_BREAK):
+            flush()
+            section = clean_text(line)
+            if section:
+                units.append((section, section))
+        elif line.startswith(TABLE_ROW):
+            flush()
+            row = clean_text(line)
+            if row:
+                units.append((row, section))
+        else:
+            paragraph_lines.append(line)
+    flush()
+    
+    return units
+
+
 class SimpleSentenceSplitter:
     """
     Split text into chunks based on sentences.
@@ -44,28 +112,156 @@ class SimpleSentenceSplitter:
         Returns:
             list: List of text chunks
         """
-        # Improved regex for better sentence splitting - matches period, exclamation, question mark 
-        # followed by space and capital letter
-        sentences = re.split(r'(?<=[.!?]) +(?=[A-Z])', text)
-        
-        # Filter out empty sentences
-        sentences = [s for s in sentences if s.strip()]
+        return [chunk for chunk, _, _ in self.chunk_sentences(split_sentences(text))]
+    
+    def chunk_sentences(self, sentences):
+        """
+        Group sentences into chunks.
         
+        Args:
+            sentences (list): Sentences in document order
+            
+        Returns:
+            list: (chunk text, first sentence index, last sentence index) tuples
+        """
         chunks = []
-        
-        # More robust chunking logic with proper overlap handling
-        start_index = 0
-        while start_index < len(sentences):
-            end_index = min(start_index + self.chunk_size, len(sentences))
-            chunk_sentences = sentences[start_index:end_index]
-            chunk = " ".join(chunk_sentences).strip()
+        for start_index, end_index in self.chunk_ranges(len(sentences)):
+            chunk = " ".join(sentences[start_index:end_index]).strip()
             
             # Only add non-empty chunks
             if chunk:
-                chunks.append(chunk)
+                chunks.append((chunk, start_index, end_index - 1))
+        
+        return chunks
+    
+    def chunk_ranges(self, num_sentences):
+        """
+        Compute the sentence ranges covered by each chunk.
+        
+        Args:
+            num_sentences (int): Number of sentences in the text
+            
+        Returns:
+            list: (start, end) sentence index pairs, end exclusive
+        """
+        ranges = []
+        
+        # More robust chunking logic with proper overlap handling
+        start_index = 0
+        while start_index < num_sentences:
+            end_index = min(start_index + self.chunk_size, num_sentences)
+            ranges.append((start_index, end_index))
             
             # Move start index for the next chunk, considering overlap
             step = max(1, self.chunk_size - self.chunk_overlap)  # Ensure step is at least 1
             start_index += step
         
-        return chunks
\ No newline at end of file
+        return ranges
+
+
+class TokenBudgetSplitter:
+    """
+    Split text into chunks that fit the embedding model's input window.
+    
+    Sentences are packed into a chunk until its token count, measured with
+    the embedding model's own tokenizer, would pass the budget. Consecutive
+    chunks share up to overlap_tokens tokens of whole sentences. A sentence
+    longer than the budget on its own is cut into budget-sized pieces.
+    """
+    
+    def __init__(self, tokenizer, max_tokens=384, overlap_tokens=64, batch_size=256, special_tokens=2):
+        """
+        Initialize the token budget splitter.
+        
+        Args:
+            tokenizer: Hugging Face tokenizer of the embedding model
+            max_tokens (int): Maximum sequence length of the embedding model
+            overlap_tokens (int): Maximum tokens shared between consecutive chunks
+            batch_size (int): Sentences tokenized per tokenizer call
+            special_tokens (int): Tokens the model adds to every input, e.g. [CLS] and [SEP]
+        """
+        self.tokenizer = tokenizer
+        self.budget = max_tokens - special_tokens
+        self.overlap_tokens = overlap_tokens
+        self.batch_size = batch_size
+    
+    def count_tokens(self, texts):
+        """
+        Count the tokens of each text, tokenizing in batches.
+        
+        Args:
+            texts (list): Texts to measure
+            
+        Returns:
+            list: Token counts, excluding special tokens
+        """
+        counts = []
+        for start in range(0, len(texts), self.batch_size):
+            encoded = self.tokenizer(texts[start:start + self.batch_size], add_special_tokens=False)
+            counts.extend(len(ids) for ids in encoded["input_ids"])
+        return counts
+    
+    def split_long_sentence(self, sentence):
+        """Cut a sentence into pieces of at most budget tokens each."""
+        offsets = self.tokenizer(sentence, add_special_tokens=False, return_offsets_mapping=True)["offset_mapping"]
+        pieces = []
+        for start in range(0, len(offsets), self.budget):
+            window = offsets[start:start + self.budget]
+            piece = sentence[window[0][0]:window[-1][1]].strip()
+            if piece:
+                pieces.append(piece)
+        return pieces
+    
+    def split_text(self, text):
+        """
+        Split text into chunks of at most budget tokens.
+        
+        Args:
+            text (str): The text to split
+            
+        Returns:
+            list: List of text chunks
+        """
+        return [chunk for chunk, _, _ in self.chunk_sentences(split_sentences(text))]
+    
+    def chunk_sentences(self, sentences):
+        """
+        Group sentences into chunks of at most budget tokens.
+        
+        Args:
+            sentences (list): Sentences in document order
+            
+        Returns:
+            list: (chunk text, first sentence index, last sentence index) tuples
+        """
+        counts = self.count_tokens(sentences)
+        chunks = []
+        
+        start = 0
+        while start < len(sentences):
+            if counts[start] > self.budget:
+                for piece in self.split_long_sentence(sentences[start]):
+                    chunks.append((piece, start, start))
+                start += 1
+                continue
+            
+            end, total = start, 0
+            while end < len(sentences) and total + counts[end] <= self.budget:
+                total += counts[end]
+                end += 1
+            
+            chunk = " ".join(sentences[start:end]).strip()
+            if chunk:
+                chunks.append((chunk, start, end - 1))
+            if end >= len(sentences):
+                break
+            
+            # Start the next chunk with as many trailing sentences as fit in the
+            # overlap, always moving forward by at least one sentence
+            next_start, overlap = end, 0
+            while next_start - 1 > start and overlap + counts[next_start - 1] <= self.overlap_tokens:
+                next_start -= 1
+                overlap += counts[next_start]
+            start = next_start
+        
+        return chunks
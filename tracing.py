@@ -0,0 +1,373 @@
+import os
+import json
+import time
+import queue
+import atexit
+import threading
+import contextvars
+import urllib.parse
+import urllib.request
+from contextlib import contextmanager
+from metrics import append_jsonl
+from config import (
+    TRACING_EXPORTER,
+    TRACE_LOG_PATH,
+    OTLP_ENDPOINT,
+    TRACE_SERVICE_NAME,
+    TRACE_EXPORT_INTERVAL
+)
+
+# Span that new spans are created under, unless a parent is given
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+# Attributes copied from a parent span to its children, so any span can be found by session
+INHERITED_ATTRIBUTES = ("session.id",)
+
+STATUS_UNSET = 0
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+
+def _otlp_value(value):
+    """Encode an attribute value as an OTLP AnyValue."""
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _otlp_attributes(attributes):
+    return [{"key": key, "value": _otlp_value(value)} for key, value in attributes.items() if value is not None]
+
+
+class Span:
+    """
+    A timed operation within a trace.
+
+    Spans form a tree through parent_id and share the trace_id of their
+    root. A span is recorded when end() is called, or when the block it is
+    used as a context manager for exits.
+    """
+
+    def __init__(self, name, parent=None, attributes=None):
+        self.name = name
+        self.trace_id = parent.trace_id if parent else os.urandom(16).hex()
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent.span_id if parent else None
+        self.attributes = {key: parent.attributes[key] for key in INHERITED_ATTRIBUTES
+                           if parent and key in parent.attributes}
+        self.attributes.update(attributes or {})
+        self.events = []
+        self.status = STATUS_UNSET
+        self.status_message = ""
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def set_attributes(self, **attributes):
+        self.attributes.update(attributes)
+
+    def add_event(self, name, **attributes):
+        self.events.append((name, time.time_ns(), attributes))
+
+    def set_error(self, message):
+        self.status = STATUS_ERROR
+        self.status_message = message
+
+    def record_exception(self, error):
+        self.set_error(str(error))
+        self.add_event("exception", **{"exception.type": type(error).__name__, "exception.message": str(error)})
+
+    def end(self):
+        """Finish the span and hand it to the exporter. Later calls do nothing."""
+        if self.end_ns is not None:
+            return
+        self.end_ns = time.time_ns()
+        exporter = get_exporter()
+        if exporter is not None:
+            exporter.export(self)
+
+    @property
+    def duration_ms(self):
+        end_ns = self.end_ns if self.end_ns is not None else time.time_ns()
+        return (end_ns - self.start_ns) / 1e6
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc is not None and not isinstance(exc, GeneratorExit):
+            self.record_exception(exc)
+        self.end()
+        return False
+
+    def to_record(self):
+        """The span as one flat JSON-serializable record, for the trace file."""
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.start_ns / 1e9))
+                     + f".{self.start_ns % 10**9 // 10**6:03d}",
+            "duration_ms": round(self.duration_ms, 3),
+            "attributes": self.attributes,
+            "events": [{"name": name, "offset_ms": round((at - self.start_ns) / 1e6, 3), **attributes}
+                       for name, at, attributes in self.events],
+            "status": "error" if self.status == STATUS_ERROR else "ok",
+            "status_message": self.status_message or None
+        }
+
+    def to_otlp(self):
+        """The span in the OTLP/JSON encoding."""
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": 1,  # SPAN_KIND_INTERNAL
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": _otlp_attributes(self.attributes),
+            "events": [{"name": name, "timeUnixNano": str(at), "attributes": _otlp_attributes(attributes)}
+                       for name, at, attributes in self.events],
+            "status": {"code": self.status, "message": self.status_message}
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        return span
+
+
+class _NoopSpan:
+    """Stand-in returned while tracing is off; every method does nothing."""
+
+    trace_id = None
+    span_id = None
+    attributes = {}
+
+    def set_attribute(self, key, value):
+        pass
+
+    def set_attributes(self, **attributes):
+        pass
+
+    def add_event(self, name, **attributes):
+        pass
+
+    def set_error(self, message):
+        pass
+
+    def record_exception(self, error):
+        pass
+
+    def end(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class RemoteSpanContext:
+    """Parent span received from another process in W3C trace context headers."""
+
+    def __init__(self, trace_id, span_id, attributes=None):
+        self.trace_id = trace_id
+        self.span_id = span_id
+        self.attributes = attributes or {}
+
+
+def trace_headers(span=None):
+    """
+    W3C trace context headers continuing a span in another process.
+
+    traceparent carries the trace and span ids; baggage carries the
+    inherited attributes, so the other process's spans keep the session.
+
+    Args:
+        span (Span, optional): Parent span, defaults to the active span
+
+    Returns:
+        dict: Headers to send, empty when there is no span
+    """
+    span = span or _current_span.get()
+    if span is None or span.trace_id is None:
+        return {}
+    headers = {"traceparent": f"00-{span.trace_id}-{span.span_id}-01"}
+    baggage = [f"{key}={urllib.parse.quote(str(span.attributes[key]))}"
+               for key in INHERITED_ATTRIBUTES if key in span.attributes]
+    if baggage:
+        headers["baggage"] = ",".join(baggage)
+    return headers
+
+
+def remote_parent(headers):
+    """
+    Read the parent span from W3C trace context headers.
+
+    Args:
+        headers: Request headers, a mapping with lower-case keys
+
+    Returns:
+        RemoteSpanContext: The remote parent, or None if traceparent is missing or malformed
+    """
+    parts = (headers.get("traceparent") or "").strip().split("-")
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    try:
+        int(parts[1], 16), int(parts[2], 16)
+    except ValueError:
+        return None
+
+    attributes = {}
+    for item in (headers.get("baggage") or "").split(","):
+        key, _, value = item.partition("=")
+        if key.strip() in INHERITED_ATTRIBUTES:
+            attributes[key.strip()] = urllib.parse.unquote(value.split(";")[0].strip())
+    return RemoteSpanContext(parts[1], parts[2], attributes)
+
+
+class SpanExporter:
+    """
+    Batches finished spans and writes them from a background thread.
+
+    The "file" exporter appends one JSON line per span to TRACE_LOG_PATH,
+    rotated like the metrics log.
+    The "otlp" exporter posts OTLP/JSON to a collector's /v1/traces
+    endpoint, e.g. an OpenTelemetry Collector or Jaeger on localhost.
+    """
+
+    def __init__(self, kind=TRACING_EXPORTER, path=TRACE_LOG_PATH, endpoint=OTLP_ENDPOINT,
+                 interval=TRACE_EXPORT_INTERVAL, max_batch=512):
+        self.kind = kind
+        self.path = path
+        self.url = endpoint.rstrip("/") + "/v1/traces"
+        self.interval = interval
+        self.max_batch = max_batch
+        self._queue = queue.Queue()
+        self._worker = threading.Thread(target=self._run, name="span-exporter", daemon=True)
+        self._worker.start()
+        atexit.register(self.flush)
+
+    def export(self, span):
+        self._queue.put(span)
+
+    def _drain(self):
+        spans = []
+        while len(spans) < self.max_batch:
+            try:
+                spans.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return spans
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            self.flush()
+
+    def flush(self):
+        """Write every queued span now."""
+        spans = self._drain()
+        while spans:
+            try:
+                if self.kind == "otlp":
+                    self._post(spans)
+                else:
+                    self._write(spans)
+            except Exception as e:
+                print(f"Error exporting {len(spans)} trace spans: {str(e)}")
+            spans = self._drain()
+
+    def _write(self, spans):
+        append_jsonl(self.path, [json.dumps(span.to_record(), default=str) for span in spans])
+
+    def _post(self, spans):
+        body = {"resourceSpans": [{
+            "resource": {"attributes": _otlp_attributes({"service.name": TRACE_SERVICE_NAME})},
+            "scopeSpans": [{"scope": {"name": "rag"}, "spans": [span.to_otlp() for span in spans]}]
+        }]}
+        request = urllib.request.Request(self.url, data=json.dumps(body).encode("utf-8"), method="POST",
+                                         headers={"Content-Type": "application/json"})
+        urllib.request.urlopen(request, timeout=5).close()
+
+
+_exporter = None
+_exporter_lock = threading.Lock()
+
+
+def get_exporter():
+    """The span exporter of this process, started on first use; None when tracing is off."""
+    global _exporter
+    if TRACING_EXPORTER == "none":
+        return None
+    if _exporter is None:
+        with _exporter_lock:
+            if _exporter is None:
+                _exporter = SpanExporter()
+    return _exporter
+
+
+def current_span():
+    """The active span, or None."""
+    return _current_span.get()
+
+
+def start_span(name, parent=None, **attributes):
+    """
+    Start a span without making it active.
+
+    Use this for spans that stay open across a yield, where an active span
+    would leak into the code consuming the generator; call end() on it.
+
+    Args:
+        name (str): Operation name, e.g. "retriever.vector_search"
+        parent (Span, optional): Parent span, defaults to the active span
+        **attributes: Span attributes, None values are left out; "session_id" is
+            recorded as session.id
+
+    Returns:
+        Span: The started span, or a no-op span when tracing is off
+    """
+    if TRACING_EXPORTER == "none":
+        return NOOP_SPAN
+    attributes = {key: value for key, value in attributes.items() if value is not None}
+    if "session_id" in attributes:
+        attributes["session.id"] = str(attributes.pop("session_id"))
+    if parent is None or parent is NOOP_SPAN:
+        parent = _current_span.get()
+    return Span(name, parent, attributes)
+
+
+@contextmanager
+def use_span(span):
+    """Make a span active within the block, without ending it."""
+    if span is NOOP_SPAN or span is None:
+        yield span
+        return
+    token = _current_span.set(span)
+    try:
+        yield span
+    finally:
+        _current_span.reset(token)
+
+
+@contextmanager
+def trace(name, parent=None, **attributes):
+    """
+    Run a block in a new active span, ending it when the block exits.
+
+    Exceptions leaving the block are recorded on the span.
+    """
+    span = start_span(name, parent, **attributes)
+    with use_span(span), span:
+        yield span
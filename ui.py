@@ -1,15 +1,150 @@
 import streamlit as st
-import time
 import uuid
-from config import APP_TITLE, APP_LAYOUT, UPLOAD_FOLDER, SUPPORTED_FILE_TYPES
-from data_loader import handle_uploaded_file
-from vector_store import add_document_to_store
+import json
+import os
+from config import (APP_TITLE, APP_LAYOUT, SUPPORTED_FILE_TYPES, UPLOAD_POLL_INTERVAL, INDEX_AUTO_REBUILD, API_URL,
+                    CHAT_VISIBLE_TURNS, METRICS_PORT, PROFILING_MODE)
+from ingestion import IngestionQueue
+from index_manager import IndexManager
+from tracing import trace
 import streamlit.components.v1 as components
 
 
 MAX_HISTORY_LENGTH = 10
 MAX_SYSTEM_MESSAGES = 2
 
+# Metadata fields offered as sidebar search filters, with their labels
+SEARCH_FILTER_FIELDS = {
+    "department": "Department",
+    "doc_type": "Document type",
+    "code": "Document code",
+}
+
+@st.cache_resource(show_spinner=False)
+def get_index_manager(_initialize_system_func):
+    """Initialize the system once per server process and share its live retriever with every session."""
+    if API_URL:
+        # The API server owns the index, this process only renders
+        from api_client import RemoteIndexManager
+        return RemoteIndexManager(API_URL)
+    if METRICS_PORT:
+        from metrics import start_metrics_server
+        start_metrics_server(METRICS_PORT)
+    index_manager = IndexManager(_initialize_system_func)
+    if INDEX_AUTO_REBUILD and index_manager.needs_rebuild():
+        # Keep serving the current index while one matching the settings is built
+        index_manager.start_rebuild("index settings changed")
+    return index_manager
+
+@st.cache_resource(show_spinner=False)
+def get_ingestion_queue(_index_manager):
+    """Start the background ingestion worker shared by every session."""
+    if API_URL:
+        from api_client import RemoteIngestionQueue
+        return RemoteIngestionQueue(API_URL)
+    return IngestionQueue(_index_manager.current, write_lock=_index_manager.write_lock)
+
+def build_report_copy_html(content):
+    """Build the HTML of a report's copy button, with the report embedded as a JavaScript string."""
+    # JSON is a valid JavaScript literal; escaping "</" keeps the report from closing the script tag
+    content_js = json.dumps(content).replace("</", "<\\/")
+    return f"""
+        <button id="copyButton" onclick="copyToClipboard()"
+                style="
+                    margin-top: 10px;
+                    background-color: #232D3F;
+                    color: #E6E6E6;
+                    border: none;
+                    padding: 8px 16px;
+                    border-radius: 5px;
+                    cursor: pointer;
+                    font-weight: 500;
+                    display: flex;
+                    align-items: center;
+                    gap: 6px;
+                    transition: all 0.3s ease;
+                    box-shadow: 0 2px 5px rgba(0,0,0,0.2);
+                    border-left: 3px solid #4ECCA3;
+                ">
+            <svg xmlns="http://www.w3.org/2000/svg" width="16" height="16" fill="currentColor" viewBox="0 0 16 16">
+                <path d="M4 1.5H3a2 2 0 0 0-2 2V14a2 2 0 0 0 2 2h10a2 2 0 0 0 2-2V3.5a2 2 0 0 0-2-2h-1v1h1a1 1 0 0 1 1 1V14a1 1 0 0 1-1 1H3a1 1 0 0 1-1-1V3.5a1 1 0 0 1 1-1h1v-1z"/>
+                <path d="M9.5 1a.5.5 0 0 1 .5.5v1a.5.5 0 0 1-.5.5h-3a.5.5 0 0 1-.5-.5v-1a.5.5 0 0 1 .5-.5h3zm-3-1A1.5 1.5 0 0 0 5 1.5v1A1.5 1.5 0 0 0 6.5 4h3A1.5 1.5 0 0 0 11 2.5v-1A1.5 1.5 0 0 0 9.5 0h-3z"/>
+            </svg>
+            Copy Report
+        </button>
+        
+        <div id="copyNotification" 
+             style="
+                display: none;
+                margin-top: 10px;
+                padding: 6px 12px;
+                background-color: #232D3F;
+                color: #E6E6E6;
+                border-radius: 4px;
+                opacity: 0;
+                transition: opacity 0.3s ease;
+                font-size: 14px;
+                border-left: 3px solid #4ECCA3;
+             ">
+            <span style="color: #4ECCA3; font-weight: bold;">✓</span> Copied to clipboard
+        </div>
+        
+        <script>
+            // Add hover effect to button
+            const copyButton = document.getElementById('copyButton');
+            if (copyButton) {{
+                copyButton.addEventListener('mouseover', function() {{
+                    this.style.backgroundColor = '#2C3333';
+                    this.style.transform = 'translateY(-2px)';
+                    this.style.boxShadow = '0 4px 8px rgba(0,0,0,0.2)';
+                    this.style.borderLeft = '3px solid #3AA787';
+                }});
+                
+                copyButton.addEventListener('mouseout', function() {{
+                    this.style.backgroundColor = '#232D3F';
+                    this.style.transform = 'translateY(0)';
+                    this.style.boxShadow = '0 2px 5px rgba(0,0,0,0.2)';
+                    this.style.borderLeft = '3px solid #4ECCA3';
+                }});
+            }}
+            
+            function copyToClipboard() {{
+                // Copy the content to clipboard
+                const content = {content_js};
+                navigator.clipboard.writeText(content).then(function() {{
+                    // Show the notification
+                    const notification = document.getElementById('copyNotification');
+                    if (notification) {{
+                        notification.style.display = 'block';
+                        setTimeout(() => {{
+                            notification.style.opacity = '1';
+                        }}, 10);
+                        
+                        // Hide after 2 seconds
+                        setTimeout(() => {{
+                            notification.style.opacity = '0';
+                            setTimeout(() => {{
+                                notification.style.display = 'none';
+                            }}, 300);
+                        }}, 2000);
+                    }}
+                    
+                    // Change button text temporarily
+                    if (copyButton) {{
+                        const originalHTML = copyButton.innerHTML;
+                        copyButton.innerHTML = '<svg xmlns="http://www.w3.org/2000/svg" width="16" height="16" fill="#4ECCA3" viewBox="0 0 16 16"><path d="M10.97 4.97a.75.75 0 0 1 1.07 1.05l-3.99 4.99a.75.75 0 0 1-1.08.02L4.324 8.384a.75.75 0 1 1 1.06-1.06l2.094 2.093 3.473-4.425a.267.267 0 0 1 .02-.022z"/></svg> <span style="color: #4ECCA3;">Copied!</span>';
+                        
+                        setTimeout(() => {{
+                            copyButton.innerHTML = originalHTML;
+                        }}, 2000);
+                    }}
+                }}).catch(function(error) {{
+                    console.error('Could not copy text: ', error);
+                }});
+            }}
+        </script>
+        """
+
 def run(initialize_system_func, get_bot_response):
     """
     Run the Streamlit UI application.
@@ -20,21 +155,17 @@ def run(initialize_system_func, get_bot_response):
     """
     st.set_page_config(page_title=APP_TITLE, layout=APP_LAYOUT)
 
-    if "retriever" not in st.session_state:
-        st.session_state.retriever = None
-
-    if st.session_state.retriever is None:
+    if "index_manager" not in st.session_state:
         with st.spinner("Initializing system..."):
             try:
-                st.session_state.retriever = initialize_system_func()
-                st.success("System initialized successfully!")
-                time.sleep(1)
-                st.rerun()
+                st.session_state.index_manager = get_index_manager(initialize_system_func)
             except Exception as e:
                 st.error(f"System initialization failed: {e}")
                 st.stop()
 
-    # --- Get retriever from session state ---
+    # --- Get the live retriever, it changes when a rebuilt index is swapped in ---
+    index_manager = st.session_state.index_manager
+    st.session_state.retriever = index_manager.current()
     retriever = st.session_state.retriever
     if retriever is None:
          st.error("Retriever is not available. Initialization might have failed.")
@@ -217,6 +348,24 @@ def run(initialize_system_func, get_bot_response):
     if "all_messages" not in st.session_state:
         st.session_state.all_messages = []
 
+    if "upload_jobs" not in st.session_state:
+        st.session_state.upload_jobs = []
+
+    if "visible_turns" not in st.session_state:
+        st.session_state.visible_turns = CHAT_VISIBLE_TURNS
+
+    if "report_html" not in st.session_state:
+        st.session_state.report_html = {}  # message id -> copy button HTML
+
+    ingestion_queue = get_ingestion_queue(index_manager)
+
+    def add_message(role, content, **fields):
+        """Append a message to both the LLM history and the UI history."""
+        message = {"id": uuid.uuid4().hex, "role": role, "content": content, **fields}
+        st.session_state.messages.append(message)
+        st.session_state.all_messages.append(message)
+        return message
+
     def manage_chat_history():
         """
         Truncate the backend message history (st.session_state.messages) 
@@ -254,8 +403,13 @@ def run(initialize_system_func, get_bot_response):
         else:
             st.session_state.messages = system_messages + regular_messages
 
-    def render_markdown_report_box(content):
-        """Render markdown report in a styled box with a copy button."""
+    def render_markdown_report_box(content, message_id=None, collapsed=False):
+        """
+        Render markdown report in a styled box with a copy button.
+        
+        A collapsed report shows only its title until it is opened, so its
+        text and copy button iframe are not rebuilt on every rerun.
+        """
 
         content_str = str(content)
 
@@ -263,228 +417,148 @@ def run(initialize_system_func, get_bot_response):
             # Title
             st.subheader("Pharmaceutical Report")
 
+            if collapsed and message_id and not st.toggle("Show report", key=f"open_report_{message_id}"):
+                return
+
             st.markdown(content_str)
-            copy_button_html = f"""
-        <button id="copyButton" onclick="copyToClipboard()"
-                style="
-                    margin-top: 10px;
-                    background-color: #232D3F;
-                    color: #E6E6E6;
-                    border: none;
-                    padding: 8px 16px;
-                    border-radius: 5px;
-                    cursor: pointer;
-                    font-weight: 500;
-                    display: flex;
-                    align-items: center;
-                    gap: 6px;
-                    transition: all 0.3s ease;
-                    box-shadow: 0 2px 5px rgba(0,0,0,0.2);
-                    border-left: 3px solid #4ECCA3;
-                ">
-            <svg xmlns="http://www.w3.org/2000/svg" width="16" height="16" fill="currentColor" viewBox="0 0 16 16">
-                <path d="M4 1.5H3a2 2 0 0 0-2 2V14a2 2 0 0 0 2 2h10a2 2 0 0 0 2-2V3.5a2 2 0 0 0-2-2h-1v1h1a1 1 0 0 1 1 1V14a1 1 0 0 1-1 1H3a1 1 0 0 1-1-1V3.5a1 1 0 0 1 1-1h1v-1z"/>
-                <path d="M9.5 1a.5.5 0 0 1 .5.5v1a.5.5 0 0 1-.5.5h-3a.5.5 0 0 1-.5-.5v-1a.5.5 0 0 1 .5-.5h3zm-3-1A1.5 1.5 0 0 0 5 1.5v1A1.5 1.5 0 0 0 6.5 4h3A1.5 1.5 0 0 0 11 2.5v-1A1.5 1.5 0 0 0 9.5 0h-3z"/>
-            </svg>
-            Copy Report
-        </button>
-        
-        <div id="copyNotification" 
-             style="
-                display: none;
-                margin-top: 10px;
-                padding: 6px 12px;
-                background-color: #232D3F;
-                color: #E6E6E6;
-                border-radius: 4px;
-                opacity: 0;
-                transition: opacity 0.3s ease;
-                font-size: 14px;
-                border-left: 3px solid #4ECCA3;
-             ">
-            <span style="color: #4ECCA3; font-weight: bold;">✓</span> Copied to clipboard
-        </div>
-        
-        <script>
-            // Add hover effect to button
-            const copyButton = document.getElementById('copyButton');
-            if (copyButton) {{
-                copyButton.addEventListener('mouseover', function() {{
-                    this.style.backgroundColor = '#2C3333';
-                    this.style.transform = 'translateY(-2px)';
-                    this.style.boxShadow = '0 4px 8px rgba(0,0,0,0.2)';
-                    this.style.borderLeft = '3px solid #3AA787';
-                }});
-                
-                copyButton.addEventListener('mouseout', function() {{
-                    this.style.backgroundColor = '#232D3F';
-                    this.style.transform = 'translateY(0)';
-                    this.style.boxShadow = '0 2px 5px rgba(0,0,0,0.2)';
-                    this.style.borderLeft = '3px solid #4ECCA3';
-                }});
-            }}
-            
-            function copyToClipboard() {{
-                // Copy the content to clipboard
-                const content = `{content_str}`;
-                navigator.clipboard.writeText(content).then(function() {{
-                    // Show the notification
-                    const notification = document.getElementById('copyNotification');
-                    if (notification) {{
-                        notification.style.display = 'block';
-                        setTimeout(() => {{
-                            notification.style.opacity = '1';
-                        }}, 10);
-                        
-                        // Hide after 2 seconds
-                        setTimeout(() => {{
-                            notification.style.opacity = '0';
-                            setTimeout(() => {{
-                                notification.style.display = 'none';
-                            }}, 300);
-                        }}, 2000);
-                    }}
-                    
-                    // Change button text temporarily
-                    if (copyButton) {{
-                        const originalHTML = copyButton.innerHTML;
-                        copyButton.innerHTML = '<svg xmlns="http://www.w3.org/2000/svg" width="16" height="16" fill="#4ECCA3" viewBox="0 0 16 16"><path d="M10.97 4.97a.75.75 0 0 1 1.07 1.05l-3.99 4.99a.75.75 0 0 1-1.08.02L4.324 8.384a.75.75 0 1 1 1.06-1.06l2.094 2.093 3.473-4.425a.267.267 0 0 1 .02-.022z"/></svg> <span style="color: #4ECCA3;">Copied!</span>';
-                        
-                        setTimeout(() => {{
-                            copyButton.innerHTML = originalHTML;
-                        }}, 2000);
-                    }}
-                }}).catch(function(error) {{
-                    console.error('Could not copy text: ', error);
-                }});
-            }}
-        </script>
-        """
         
+        # The copy button HTML embeds the whole report, so it is built once per message
+        cache = st.session_state.report_html
+        copy_button_html = cache.get(message_id) if message_id else None
+        if copy_button_html is None:
+            copy_button_html = build_report_copy_html(content_str)
+            if message_id:
+                cache[message_id] = copy_button_html
         components.html(copy_button_html, height=50)
 
             
     def handle_message(user_input):
         """Handle user input and get bot response, handling streaming."""
-        st.session_state.messages.append({"role": "user", "content": user_input})
-        st.session_state.all_messages = st.session_state.messages.copy() # Update UI history
-        
-        with st.chat_message("user"):
-            st.markdown(user_input)
-
-        with st.chat_message("assistant"):
-            was_report_mode = st.session_state.report_mode
-            
-            response_stream = get_bot_response(
-                user_input, 
-                st.session_state.retriever, 
-                was_report_mode,
-                st.session_state.premium_model,
-                st.session_state.session_id
-            )
+        # Root span of the request; get_bot_response and its retrieval and LLM spans nest below it
+        with trace("ui.handle_message", session_id=st.session_state.session_id,
+                   report_mode=st.session_state.report_mode):
+            add_message("user", user_input)
             
-            full_response = ""
-            if was_report_mode:
-                with st.spinner("Generating report..."):
-                    for chunk in response_stream:
-                        full_response += chunk
-                    render_markdown_report_box(full_response)
-            else:
-                full_response = st.write_stream(response_stream)
-                    
-            if full_response:
-                assistant_message = {
-                    "role": "assistant", 
-                    "content": full_response,
-                    "is_report": was_report_mode 
-                }
-                st.session_state.messages.append(assistant_message)
-                st.session_state.all_messages = st.session_state.messages.copy()
-
-            manage_chat_history() # This now only truncates st.session_state.messages
-
-    def handle_file_upload():
-        """Handle file upload process with progress bar"""
-        if uploaded_file is not None:
-            try:
-                # Display progress bar for file upload and processing
-                progress_bar = st.progress(0)
-                status_text = st.empty()
-                
-                # Step 1: Save the uploaded file
-                status_text.text("Uploading file...")
-                progress_bar.progress(25)
-                
-                file_path, file_name, content = handle_uploaded_file(uploaded_file, UPLOAD_FOLDER)
-                
-                # Step 2: Process the file content
-                status_text.text("Processing document...")
-                progress_bar.progress(50)
-                
-                if not content:
-                    status_text.error(f"Error: Couldn't extract content from {file_name}")
-                    return
-                
-                # Step 3: Prepare file data in the format needed for add_document_to_store
-                document_data = {
-                    "file_name": file_name,
-                    "content": content
-                }
+            with st.chat_message("user"):
+                st.markdown(user_input)
+
+            with st.chat_message("assistant"):
+                was_report_mode = st.session_state.report_mode
+                message_id = uuid.uuid4().hex
                 
-                # Step 4: Add to vector store using add_document_to_store for proper incremental updates
-                status_text.text("Generating embeddings and updating vector store...")
-                progress_bar.progress(75)
+                response_stream = get_bot_response(
+                    user_input, 
+                    st.session_state.retriever, 
+                    was_report_mode,
+                    st.session_state.premium_model,
+                    st.session_state.session_id,
+                    filters=get_search_filters(),
+                    profile=st.session_state.get("profile_requests", False)
+                )
                 
-                try:
-                    # Import necessary modules
-                    from vector_store import get_embedding_function
-                    from langchain_chroma import Chroma
-                    from config import CHROMA_INDEX_PATH, RETRIEVER_SEARCH_DISTANCE, RETRIEVER_K
-                    
-                    # Use add_document_to_store to properly add the new document to existing vector store
-                    success = add_document_to_store(document_data, retriever=st.session_state.retriever)
-                    
-                    if not success:
-                        status_text.error(f"Failed to add document to vector store")
-                        progress_bar.empty()
-                        return
-                    
-                    # Re-initialize the retriever with the updated vector store
-                    embedding_function = get_embedding_function(quiet=True)
-                    chroma_vector_store = Chroma(
-                        persist_directory=CHROMA_INDEX_PATH, 
-                        embedding_function=embedding_function
-                    )
-                    
-                    # Update the retriever in session state
-                    st.session_state.retriever = chroma_vector_store.as_retriever(
-                        search_kwargs={"k": RETRIEVER_K},
-                        search_type="similarity",
-                        search_distance=RETRIEVER_SEARCH_DISTANCE
-                    )
-                    
-                    # Complete the progress
-                    progress_bar.progress(100)
-                    status_text.text(f"✅ {file_name} successfully added to knowledge base!")
-                    
-                    # Add system message to chat (both backend and UI)
-                    system_message = f"File '{file_name}' has been added to the knowledge base. You can now ask questions about its content."
-                    st.session_state.messages.append({"role": "system", "content": system_message})
-                    st.session_state.all_messages = st.session_state.messages.copy() # Update UI history
-                    
-                    # Display system message
-                    with st.chat_message("system", avatar="ℹ️"):
-                        st.info(system_message)
-                    
-                    time.sleep(2)  # Show success message briefly
-                    status_text.empty()
-                    progress_bar.empty()
-                except Exception as e:
-                    status_text.error(f"Error adding document: {str(e)}")
-                    progress_bar.empty()
-            
-            except Exception as e:
-                st.error(f"Error processing file: {str(e)}")
+                # The response is generated while it is rendered, so its spans are children of this one
+                with trace("ui.render"):
+                    full_response = ""
+                    if was_report_mode:
+                        with st.spinner("Generating report..."):
+                            for chunk in response_stream:
+                                full_response += chunk
+                            render_markdown_report_box(full_response, message_id)
+                    else:
+                        full_response = st.write_stream(response_stream)
+                        
+                if full_response:
+                    add_message("assistant", full_response, id=message_id, is_report=was_report_mode)
+
+                manage_chat_history() # This now only truncates st.session_state.messages
+
+    def render_message(message, latest_report_id=None):
+        """Render one message of the chat history; reports before the latest start collapsed."""
+        role = message["role"]
+        content = message.get("content", "")
+        
+        with st.chat_message(role):
+            if role == "system":
+                st.info(content)
+            # Use the stored is_report flag to decide rendering for assistant messages
+            elif role == "assistant" and message.get("is_report", False):
+                render_markdown_report_box(content, message.get("id"),
+                                           collapsed=message.get("id") != latest_report_id)
+            else:
+                st.markdown(content)
+
+    def render_chat_history():
+        """
+        Render the last visible_turns turns of the UI history.
+        
+        Older turns stay collapsed behind a button that loads them a page at
+        a time, so a rerun renders the same number of messages however long
+        the conversation gets.
+        """
+        messages = st.session_state.all_messages
+        turn_starts = [i for i, message in enumerate(messages) if message["role"] == "user"]
+        visible_turns = st.session_state.visible_turns
+        first_visible = turn_starts[-visible_turns] if len(turn_starts) > visible_turns else 0
+        
+        if first_visible > 0:
+            hidden_turns = len(turn_starts) - visible_turns
+            if st.button(f"Show earlier messages ({hidden_turns} older turn{'s' if hidden_turns != 1 else ''})"):
+                st.session_state.visible_turns += CHAT_VISIBLE_TURNS
+                st.rerun()
+        elif visible_turns > CHAT_VISIBLE_TURNS:
+            if st.button("Hide earlier messages"):
+                st.session_state.visible_turns = CHAT_VISIBLE_TURNS
+                st.rerun()
+        
+        reports = [message.get("id") for message in messages if message.get("is_report")]
+        latest_report_id = reports[-1] if reports else None
+        for message in messages[first_visible:]:
+            render_message(message, latest_report_id)
+
+    def get_search_filters():
+        """Collect the metadata filters chosen in the sidebar."""
+        filters = {}
+        for field in SEARCH_FILTER_FIELDS:
+            selected = st.session_state.get(f"filter_{field}")
+            if selected:
+                filters[field] = selected
+        return filters
+
+    def show_upload_progress():
+        """Show live progress of this session's uploads and report the finished ones."""
+        finished = []
+        for job_id in list(st.session_state.upload_jobs):
+            job = ingestion_queue.get(job_id)
+            if job is None:
+                st.session_state.upload_jobs.remove(job_id)
+            elif job.is_finished:
+                st.session_state.upload_jobs.remove(job_id)
+                finished.append(job)
+            else:
+                st.progress(job.progress, text=f"{job.file_name}: {job.stage}")
+        
+        if finished:
+            # Add system messages to chat (both backend and UI)
+            for job in finished:
+                add_message("system", job.message)
+            st.rerun()
+
+    def show_index_status():
+        """Show the live index version and the state of a background rebuild."""
+        st.caption(f"Live version: {os.path.basename(index_manager.index_path)}")
+        if index_manager.is_building:
+            st.session_state.index_building = True
+            st.info(index_manager.message)
+            return
+        
+        if st.session_state.get("index_building"):
+            # The build just finished, rerun so this session picks up the new retriever
+            st.session_state.index_building = False
+            st.rerun()
+        if index_manager.status == "failed":
+            st.error(index_manager.message)
+        elif index_manager.message:
+            st.success(index_manager.message)
 
     # Apply custom styling
     apply_custom_css()
@@ -526,44 +600,66 @@ def run(initialize_system_func, get_bot_response):
         st.subheader("Upload Documents")
         
         with st.form("upload_form", clear_on_submit=True):
-            uploaded_file = st.file_uploader(
-                "Upload a document to the knowledge base",
-                type=SUPPORTED_FILE_TYPES
+            uploaded_files = st.file_uploader(
+                "Upload documents to the knowledge base",
+                type=SUPPORTED_FILE_TYPES,
+                accept_multiple_files=True
             )
             upload_button = st.form_submit_button("Upload and Process")
         
-        if upload_button and uploaded_file is not None:
-            handle_file_upload()
+        if upload_button and uploaded_files:
+            # Processing happens on the background worker, the chat stays responsive;
+            # the jobs are traced as children of this span
+            with trace("ui.upload", session_id=st.session_state.session_id, files=len(uploaded_files)):
+                st.session_state.upload_jobs.extend(ingestion_queue.submit(
+                    uploaded_files,
+                    session_id=st.session_state.session_id,
+                    profile=st.session_state.get("profile_requests", False)
+                ))
+        
+        if st.session_state.upload_jobs:
+            st.fragment(run_every=UPLOAD_POLL_INTERVAL)(show_upload_progress)()
         
         # Display supported file types
         st.caption(f"Supported file types: {', '.join(SUPPORTED_FILE_TYPES)}")
         
+        # Metadata filters, offered when the retriever supports them
+        if hasattr(retriever, "metadata_values"):
+            st.subheader("Filter Search")
+            for field, label in SEARCH_FILTER_FIELDS.items():
+                st.multiselect(label, retriever.metadata_values(field), key=f"filter_{field}")
+            st.caption("Document codes named in a question are filtered on automatically.")
+        
+        # Index version, background rebuilds and rollback
+        st.subheader("Search Index")
+        if index_manager.is_building:
+            st.fragment(run_every=UPLOAD_POLL_INTERVAL)(show_index_status)()
+        else:
+            show_index_status()
+        rebuild_col, rollback_col = st.columns(2)
+        with rebuild_col:
+            if st.button("Rebuild index", disabled=index_manager.is_building):
+                index_manager.start_rebuild(profile=st.session_state.get("profile_requests", False))
+                st.rerun()
+        with rollback_col:
+            if st.button("Roll back", disabled=not index_manager.can_roll_back):
+                index_manager.rollback()
+                st.rerun()
+        
+        if PROFILING_MODE == "on_demand":
+            st.toggle("Profile my requests", key="profile_requests",
+                      help="Write a CPU and allocation profile of each of your questions, uploads and index rebuilds")
+        
         # Clear chat history button
         if st.button("Clear Chat History"):
             st.session_state.messages = []
             st.session_state.all_messages = [] # Clear UI history too
+            st.session_state.report_html = {}
+            st.session_state.visible_turns = CHAT_VISIBLE_TURNS
             st.rerun()
     
-    # Display the chat messages from history (use all_messages for UI)
-    for idx, message in enumerate(st.session_state.all_messages):
-        role = message["role"]
-        content = message.get("content", "")
-        # Get the report flag from the stored message, default to False if missing
-        is_report = message.get("is_report", False) 
-        
-        with st.chat_message(role):
-            if role == "system":
-                st.info(content)
-            # Use the stored is_report flag to decide rendering for assistant messages
-            elif role == "assistant" and is_report:
-                render_markdown_report_box(content)
-            elif role == "assistant" and not is_report:
-                 st.markdown(content)
-            elif role == "user": # Explicitly handle user role
-                 st.markdown(content)
-            # Add a fallback for any unexpected roles, though unlikely
-            else: 
-                 st.markdown(content)
+    # Display the most recent turns of the chat history (use all_messages for UI)
+    render_chat_history()
 
     # --- Auto-scroll to last message ---
     # Place an anchor div after the last message
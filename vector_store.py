@@ -1,19 +1,272 @@
 import os
 import uuid
-from langchain_chroma import Chroma
-from config import CHROMA_INDEX_PATH, CHUNK_SIZE, CHUNK_OVERLAP, EMBEDDING_MODEL_NAME
-from text_utils import clean_text, SimpleSentenceSplitter
-from langchain_huggingface import HuggingFaceEmbeddings
+from functools import lru_cache
+from config import (
+    CHROMA_INDEX_PATH,
+    NUMPY_INDEX_PATH,
+    VECTOR_STORE_BACKEND,
+    CHROMA_COLLECTION_METADATA,
+    CHUNKING_STRATEGY,
+    CHUNK_MAX_TOKENS,
+    CHUNK_OVERLAP_TOKENS,
+    TOKENIZE_BATCH_SIZE,
+    CHUNK_TEXT_STORAGE,
+    NEAR_DUPLICATE_DEDUP_ENABLED,
+    CHUNK_SIZE,
+    CHUNK_OVERLAP,
+    EMBEDDING_MODEL_NAME,
+    EMBEDDING_BACKEND,
+    EMBEDDING_SERVER_SOCKET,
+    INGEST_BATCH_SIZE,
+    BUILD_BATCH_SIZE
+)
+from text_utils import split_units, SimpleSentenceSplitter, TokenBudgetSplitter, PAGE_BREAK
+from data_loader import parse_file_metadata
+from numpy_store import NumpyVectorStore
+from index_versions import current_index_path
+from near_duplicates import (deduplicate_chunks, format_deduplication_report, merge_duplicate_sources,
+                             SignatureIndex, SIGNATURES_FILE)
+from chunk_store import (DocumentTextStore, add_chunks, update_chunk_metadatas, DOC_KEY_FIELD, START_FIELD,
+                         END_FIELD)
+
+def embedding_model_id():
+    """Hugging Face Hub id of the embedding model."""
+    # Bare names are resolved by sentence-transformers under its own namespace
+    return EMBEDDING_MODEL_NAME if "/" in EMBEDDING_MODEL_NAME else f"sentence-transformers/{EMBEDDING_MODEL_NAME}"
+
+def load_local_embedding_function(backend=EMBEDDING_BACKEND):
+    """
+    Load the embedding model into this process.
+    
+    Args:
+        backend (str): "huggingface" for PyTorch, or "onnx" for the exported
+            ONNX model, which falls back to PyTorch if it cannot be loaded
+    """
+    if backend == "onnx":
+        try:
+            from onnx_embeddings import load_onnx_embeddings
+            return load_onnx_embeddings()
+        except Exception as e:
+            print(f"Error loading the ONNX embedding model, using PyTorch instead: {str(e)}")
+    # Imported on first use: it pulls in torch and transformers
+    from langchain_huggingface import HuggingFaceEmbeddings
+    return HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL_NAME)
 
 def get_embedding_function(quiet=False):
-    """Initializes and returns a LangChain-compatible embedding function."""
+    """
+    Initializes and returns a LangChain-compatible embedding function.
+    
+    Uses the shared embedding server when EMBEDDING_SERVER_SOCKET points at
+    a running one, otherwise loads the model into this process.
+    """
+    if EMBEDDING_SERVER_SOCKET:
+        if os.path.exists(EMBEDDING_SERVER_SOCKET):
+            if not quiet:
+                print(f"Using embedding server at {EMBEDDING_SERVER_SOCKET}")
+            from embedding_server import SocketEmbeddings
+            return SocketEmbeddings(EMBEDDING_SERVER_SOCKET)
+        print(f"Embedding server socket {EMBEDDING_SERVER_SOCKET} not found, loading the model locally")
     if not quiet:
-        print(f"Initializing embedding model: {EMBEDDING_MODEL_NAME}")
-    return HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL_NAME)
+        print(f"Initializing embedding model: {EMBEDDING_MODEL_NAME} ({EMBEDDING_BACKEND})")
+    return load_local_embedding_function()
+
+@lru_cache(maxsize=1)
+def load_embedding_tokenizer():
+    """
+    Load the tokenizer of the embedding model.
+    
+    Returns:
+        Hugging Face tokenizer, or None if it cannot be loaded
+    """
+    model_id = embedding_model_id()
+    try:
+        from transformers import AutoTokenizer
+        return AutoTokenizer.from_pretrained(model_id)
+    except Exception as e:
+        print(f"Error loading tokenizer for {model_id}: {str(e)}")
+        return None
+
+def get_text_splitter(strategy=CHUNKING_STRATEGY):
+    """
+    Create the text splitter deciding chunk boundaries.
+    
+    Args:
+        strategy (str): "tokens" or "sentences"
+        
+    Returns:
+        TokenBudgetSplitter or SimpleSentenceSplitter
+    """
+    if strategy == "tokens":
+        tokenizer = load_embedding_tokenizer()
+        if tokenizer is not None:
+            return TokenBudgetSplitter(tokenizer, max_tokens=CHUNK_MAX_TOKENS,
+                                       overlap_tokens=CHUNK_OVERLAP_TOKENS, batch_size=TOKENIZE_BATCH_SIZE)
+        print("Falling back to sentence-count chunking")
+    return SimpleSentenceSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
+
+
+def build_chunks(file_name, content, splitter):
+    """
+    Clean a document's text and split it into chunks with structured metadata.
+    
+    Pages are cleaned and split into sentences separately so that every chunk
+    can record the pages it spans, and the section heading in effect where a
+    chunk starts is recorded with it.
+    
+    Args:
+        file_name (str): Name of the source file
+        content (str): Extracted text, pages separated by PAGE_BREAK
+        splitter: Splitter deciding the chunk boundaries, see get_text_splitter
+        
+    Returns:
+        tuple: (list of chunk texts, list of metadata dictionaries, document text).
+            Each chunk is the slice [text_start:text_end] of the document text,
+            recorded in its metadata.
+    """
+    file_metadata = parse_file_metadata(file_name)
+    pages = content.split(PAGE_BREAK)
+    
+    sentences, sentence_pages, sentence_sections = [], [], []
+    section = ""
+    for page_number, page_text in enumerate(pages, start=1):
+        for sentence, page_section in split_units(page_text):
+            # A section carries on across page breaks until the next heading
+            section = page_section or section
+            sentences.append(sentence)
+            sentence_pages.append(page_number)
+            sentence_sections.append(section)
+    
+    # Chunks are windows into the sentences joined once, in document order
+    document_text = " ".join(sentences)
+    sentence_starts, position = [], 0
+    for sentence in sentences:
+        sentence_starts.append(position)
+        position += len(sentence) + 1
+    
+    text_chunks, chunk_pages, chunk_sections, chunk_offsets = [], [], [], []
+    for chunk, first, last in splitter.chunk_sentences(sentences):
+        start = document_text.find(chunk, sentence_starts[first])
+        text_chunks.append(chunk)
+        chunk_pages.append((sentence_pages[first], sentence_pages[last]))
+        chunk_sections.append(sentence_sections[first])
+        chunk_offsets.append((start, start + len(chunk)))
+    
+    metadatas = []
+    for i, ((page_start, page_end), section, (start, end)) in enumerate(
+            zip(chunk_pages, chunk_sections, chunk_offsets)):
+        metadata = {
+            'source': file_name,
+            'chunk': i + 1,
+            'total_chunks': len(text_chunks),
+            **file_metadata
+        }
+        if len(pages) > 1:
+            metadata['page'] = page_start
+            metadata['page_end'] = page_end
+        if section:
+            metadata['section'] = section
+        if start >= 0:
+            metadata[START_FIELD] = start
+            metadata[END_FIELD] = end
+        metadatas.append(metadata)
+    
+    return text_chunks, metadatas, document_text
+
+def get_index_path():
+    """Return the index directory of the configured vector store backend."""
+    # The live versioned index, once one has been built, else the fixed legacy location
+    versioned_path = current_index_path()
+    if versioned_path:
+        return versioned_path
+    if VECTOR_STORE_BACKEND == "numpy":
+        return NUMPY_INDEX_PATH
+    return CHROMA_INDEX_PATH
+
+@lru_cache(maxsize=4)
+def get_signature_index(index_path):
+    """
+    MinHash signatures of the chunks stored in an index, loaded once per process.
+    
+    Uploads are checked against them, so boilerplate already in the corpus
+    is not embedded and stored again.
+    """
+    return SignatureIndex(os.path.join(index_path, SIGNATURES_FILE))
+
+def get_text_store(index_path=None):
+    """Document text store kept alongside the vector index."""
+    return DocumentTextStore(os.path.join(index_path or get_index_path(), "documents"))
+
+def store_document_text(text_store, document_text, metadatas):
+    """
+    Store a document's text once and point its chunks at it.
+    
+    Does nothing unless CHUNK_TEXT_STORAGE is "offsets". Chunks whose window
+    could not be located keep their text inline.
+    
+    Args:
+        text_store (DocumentTextStore): Store for document texts
+        document_text (str): Document text returned by build_chunks
+        metadatas (list): Chunk metadata dictionaries, updated in place
+    """
+    if CHUNK_TEXT_STORAGE != "offsets":
+        return
+    doc_key = text_store.put(document_text)
+    for metadata in metadatas:
+        if START_FIELD in metadata:
+            metadata[DOC_KEY_FIELD] = doc_key
+
+def vector_store_exists(index_path=None):
+    """Check whether the configured backend already has an index on disk."""
+    index_path = index_path or get_index_path()
+    return bool(os.path.exists(index_path) and os.listdir(index_path))
 
+def document_is_indexed(vector_store, digest):
+    """
+    Check whether a vector store holds chunks of the document with this content hash.
+    
+    Args:
+        vector_store: Vector store exposing get()
+        digest (str): Content hash of the document
+        
+    Returns:
+        bool: True if any stored chunk came from the document
+    """
+    try:
+        # Chroma filters on the metadata; the numpy store returns every chunk to check
+        stored = vector_store.get(where={"content_hash": digest}, include=["metadatas"])
+        return any(metadata and metadata.get("content_hash") == digest for metadata in stored["metadatas"])
+    except Exception as e:
+        print(f"Error checking the index for document {digest[:12]}: {str(e)}")
+        return False
 
+def load_vector_store(embedding_function, index_path=None):
+    """
+    Open the vector store of the configured backend, creating it if missing.
+    
+    Args:
+        embedding_function: LangChain-compatible embedding function
+        index_path (str, optional): Index directory, defaults to the backend's configured path
+        
+    Returns:
+        VectorStore: Chroma or NumpyVectorStore, depending on VECTOR_STORE_BACKEND
+    """
+    index_path = index_path or get_index_path()
+    os.makedirs(index_path, exist_ok=True)
+    
+    if VECTOR_STORE_BACKEND == "chroma":
+        from langchain_chroma import Chroma
+        return Chroma(
+            persist_directory=index_path,
+            embedding_function=embedding_function,
+            collection_metadata=CHROMA_COLLECTION_METADATA
+        )
+    elif VECTOR_STORE_BACKEND == "numpy":
+        return NumpyVectorStore(persist_directory=index_path, embedding_function=embedding_function)
+    else:
+        raise ValueError(f"Unsupported vector store backend: {VECTOR_STORE_BACKEND}")
 
-def initialize_vector_store(file_data=None, use_existing=False, quiet=False):
+def initialize_vector_store(file_data=None, use_existing=False, quiet=False, index_path=None,
+                            progress_callback=None, batch_size=BUILD_BATCH_SIZE):
     """
     Initialize or load the vector store and add documents from file_data.
     
@@ -29,42 +282,45 @@ def initialize_vector_store(file_data=None, use_existing=False, quiet=False):
         file_data (list, optional): List of dictionaries with file_name and content
         use_existing (bool): Whether to use an existing vector store without adding new documents
         quiet (bool): If True, suppresses informational messages
+        index_path (str, optional): Index directory, defaults to the live index
+        progress_callback (callable, optional): Called as progress_callback(stage, fraction)
+            while chunks are embedded and stored
+        batch_size (int): Chunks embedded and stored per batch
         
     Returns:
-        Chroma: Initialized Chroma vector store
+        VectorStore: Initialized vector store of the configured backend
     """
+    index_path = index_path or get_index_path()
     try:
         # Get the embedding function
         embedding_function = get_embedding_function(quiet=quiet)
         
         # Check if embeddings directory exists
-        chroma_exists = os.path.exists(CHROMA_INDEX_PATH) and os.listdir(CHROMA_INDEX_PATH)
+        store_exists = vector_store_exists(index_path)
         
         # Case 1: Use existing vector store if specified or if no file_data and store exists
-        if use_existing and chroma_exists:
+        if use_existing and store_exists:
             if not quiet:
-                print(f"Loading existing Chroma vector store from {CHROMA_INDEX_PATH}")
-            return Chroma(persist_directory=CHROMA_INDEX_PATH, embedding_function=embedding_function)
+                print(f"Loading existing {VECTOR_STORE_BACKEND} vector store from {index_path}")
+            return load_vector_store(embedding_function, index_path)
             
         # Case 2: No file data provided and no existing store or not using existing
         if file_data is None:
-            if chroma_exists:
-                if not quiet:
-                    print(f"Loading existing Chroma vector store from {CHROMA_INDEX_PATH}")
-                return Chroma(persist_directory=CHROMA_INDEX_PATH, embedding_function=embedding_function)
-            else:
-                if not quiet:
-                    print("Creating new empty Chroma vector store")
-                os.makedirs(CHROMA_INDEX_PATH, exist_ok=True)
-                return Chroma(persist_directory=CHROMA_INDEX_PATH, embedding_function=embedding_function)
+            if not quiet:
+                if store_exists:
+                    print(f"Loading existing {VECTOR_STORE_BACKEND} vector store from {index_path}")
+                else:
+                    print(f"Creating new empty {VECTOR_STORE_BACKEND} vector store")
+            return load_vector_store(embedding_function, index_path)
         
         # Case 3: Process documents if file_data is provided
         if not quiet:
             print(f"Processing {len(file_data) if file_data else 0} files for vector store")
         
         # Initialize text splitter
-        splitter = SimpleSentenceSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
+        splitter = get_text_splitter()
         
+        text_store = get_text_store(index_path)
         documents, metadatas, ids = [], [], []
         doc_counter = 0
         
@@ -78,25 +334,19 @@ def initialize_vector_store(file_data=None, use_existing=False, quiet=False):
                     print(f"Warning: Empty content for file {file_name}")
                 continue
                 
-            # Clean text
-            cleaned_content = clean_text(content)
-            
-            # Split into chunks
-            text_chunks = splitter.split_text(cleaned_content)
+            # Clean text and split into chunks with their metadata
+            text_chunks, chunk_metadatas, document_text = build_chunks(file_name, content, splitter)
             
             if text_chunks:
+                store_document_text(text_store, document_text, chunk_metadatas)
                 if not quiet:
                     print(f"Processing {file_name}: Created {len(text_chunks)} chunks")
                 
-                # Create metadata and IDs for each chunk
+                # Create IDs for each chunk
                 for i, chunk in enumerate(text_chunks):
                     chunk_id = f"doc_{doc_counter + i}"
                     documents.append(chunk)
-                    metadatas.append({
-                        'source': file_name,
-                        'chunk': i + 1,
-                        'total_chunks': len(text_chunks)
-                    })
+                    metadatas.append(chunk_metadatas[i])
                     ids.append(chunk_id)
                     
                 doc_counter += len(text_chunks)
@@ -108,61 +358,63 @@ def initialize_vector_store(file_data=None, use_existing=False, quiet=False):
         if not documents:
             if not quiet:
                 print("Warning: No documents found to add to the vector store")
-            os.makedirs(CHROMA_INDEX_PATH, exist_ok=True)
-            return Chroma(persist_directory=CHROMA_INDEX_PATH, embedding_function=embedding_function)
+            return load_vector_store(embedding_function, index_path)
     
-        # Determine whether to create new vector store or update existing one
-        if chroma_exists:
-            if not quiet:
-                print(f"Loading existing Chroma vector store from {CHROMA_INDEX_PATH}")
-            chroma_vector_store = Chroma(persist_directory=CHROMA_INDEX_PATH, embedding_function=embedding_function) 
-            
-            if not quiet:
-                print(f"Adding {len(documents)} new document chunks")
-            chroma_vector_store.add_texts(
-                texts=documents,
-                metadatas=metadatas,
-                ids=ids
-            )
-        else:
+        # Boilerplate repeated across documents is embedded and stored once
+        if NEAR_DUPLICATE_DEDUP_ENABLED:
+            documents, metadatas, ids, stats = deduplicate_chunks(documents, metadatas, ids)
             if not quiet:
-                print(f"Creating new Chroma vector store at {CHROMA_INDEX_PATH}")
-            os.makedirs(CHROMA_INDEX_PATH, exist_ok=True)
-            chroma_vector_store = Chroma.from_texts(
-                texts=documents,
-                embedding=embedding_function,
-                metadatas=metadatas,
-                ids=ids,
-                persist_directory=CHROMA_INDEX_PATH
-            )
+                print(format_deduplication_report(stats))
+    
+        # Load the existing vector store, or create a new one, and add the chunks
+        if not quiet:
+            if store_exists:
+                print(f"Loading existing {VECTOR_STORE_BACKEND} vector store from {index_path}")
+            else:
+                print(f"Creating new {VECTOR_STORE_BACKEND} vector store at {index_path}")
+        vector_store = load_vector_store(embedding_function, index_path)
+        
+        if not quiet:
+            print(f"Adding {len(documents)} new document chunks")
+        report = progress_callback or (lambda stage, fraction: None)
+        for start in range(0, len(documents), batch_size):
+            report("Embedding and indexing", start / len(documents))
+            end = start + batch_size
+            add_chunks(vector_store, documents[start:end], metadatas[start:end], ids[start:end])
+        report("Embedding and indexing", 1.0)
+        
+        if NEAR_DUPLICATE_DEDUP_ENABLED:
+            signature_index = get_signature_index(index_path)
+            signature_index.add(ids, documents)
+            signature_index.save()
         
         if not quiet:
             print(f"Vector store persisted with {len(documents)} document chunks")
-        return chroma_vector_store
+        return vector_store
         
     except Exception as e:
         print(f"Error in initialize_vector_store: {str(e)}")
         # Create a basic empty store for recovery
-        os.makedirs(CHROMA_INDEX_PATH, exist_ok=True)
-        return Chroma(persist_directory=CHROMA_INDEX_PATH, embedding_function=embedding_function)
+        return load_vector_store(get_embedding_function(quiet=True), index_path)
 
-def add_document_to_store(document_data, retriever=None):
+def add_document_to_store(document_data, retriever=None, progress_callback=None):
     """
     Add a single document to an existing vector store
     
     Args:
-        document_data (dict): Dictionary with file_name and content
-        retriever: Optional retriever object to update
+        document_data (dict): Dictionary with file_name, content and optionally content_hash
+        retriever: Optional retriever object to update in place, so the new
+            chunks are searchable without recreating it
+        progress_callback (callable, optional): Called as progress_callback(stage, fraction)
+            while the document is chunked and its chunks are embedded and stored
         
     Returns:
         bool: True if successful, False otherwise
     """
+    report = progress_callback or (lambda stage, fraction: None)
     try:
-        # Get the embedding function
-        embedding_function = get_embedding_function()
-
         # Initialize text splitter
-        splitter = SimpleSentenceSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
+        splitter = get_text_splitter()
         
         file_name = document_data.get('file_name', 'uploaded_file')
         content = document_data.get('content', '')
@@ -171,15 +423,16 @@ def add_document_to_store(document_data, retriever=None):
             print(f"Warning: Empty content for file {file_name}")
             return False
             
-        # Clean text
-        cleaned_content = clean_text(content)
-        
-        # Split into chunks
-        text_chunks = splitter.split_text(cleaned_content)
+        # Clean text and split into chunks with their metadata
+        report("Chunking", 0.0)
+        text_chunks, chunk_metadatas, document_text = build_chunks(file_name, content, splitter)
         
         if not text_chunks:
             print(f"Warning: No chunks created for {file_name}")
             return False
+        
+        text_store = getattr(retriever, "text_store", None) or get_text_store()
+        store_document_text(text_store, document_text, chunk_metadatas)
             
         print(f"Processing {file_name}: Created {len(text_chunks)} chunks")
         
@@ -192,33 +445,61 @@ def add_document_to_store(document_data, retriever=None):
         for i, chunk in enumerate(text_chunks):
             chunk_id = f"{prefix}_{i}"
             documents.append(chunk)
-            metadatas.append({
-                'source': file_name,
-                'chunk': i + 1,
-                'total_chunks': len(text_chunks),
-                'added': 'manual_upload'
-            })
+            metadatas.append({**chunk_metadatas[i], 'added': 'manual_upload'})
+            if document_data.get('content_hash'):
+                metadatas[-1]['content_hash'] = document_data['content_hash']
             ids.append(chunk_id)
         
-        # Load the existing vector store
-        if os.path.exists(CHROMA_INDEX_PATH):
-             # Pass embedding_function when loading
-            chroma_vector_store = Chroma(persist_directory=CHROMA_INDEX_PATH, embedding_function=embedding_function)
-            
-            # Add the new document chunks
-            print(f"Adding {len(documents)} chunks from {file_name} to vector store")
-            chroma_vector_store.add_texts(
-                texts=documents,
-                metadatas=metadatas,
-                ids=ids
-            )
-            
-
-            print(f"Vector store updated with new document: {file_name}")
-            return True
+        # Add through the live retriever so its lexical index stays in sync
+        if retriever is not None and hasattr(retriever, "add_texts"):
+            vector_store = retriever.vectorstore
+            add_texts = retriever.add_texts
+            update_metadatas = retriever.update_metadatas
+        elif retriever is not None and hasattr(retriever, "vectorstore"):
+            vector_store = retriever.vectorstore
+            add_texts = lambda texts, metadatas, ids: add_chunks(vector_store, texts, metadatas, ids)
+            update_metadatas = lambda ids, metadatas: update_chunk_metadatas(vector_store, ids, metadatas)
+        elif os.path.exists(get_index_path()):
+            # Load the existing vector store, passing embedding_function when loading
+            vector_store = load_vector_store(get_embedding_function())
+            add_texts = lambda texts, metadatas, ids: add_chunks(vector_store, texts, metadatas, ids)
+            update_metadatas = lambda ids, metadatas: update_chunk_metadatas(vector_store, ids, metadatas)
         else:
             print("Error: Vector store does not exist")
             return False
+        
+        signature_index = None
+        if NEAR_DUPLICATE_DEDUP_ENABLED:
+            documents, metadatas, ids, stats = deduplicate_chunks(documents, metadatas, ids)
+            if stats["removed"]:
+                print(format_deduplication_report(stats))
+            
+            # Boilerplate already in the corpus is credited to its indexed copy instead of stored again;
+            # the text store sits in the index directory
+            signature_index = get_signature_index(os.path.dirname(text_store.directory))
+            documents, metadatas, ids, matches = signature_index.deduplicate(documents, metadatas, ids)
+            if matches:
+                stored = vector_store.get(ids=list(matches), include=["metadatas"])
+                canonical_ids = stored["ids"]
+                update_metadatas(canonical_ids, [merge_duplicate_sources(metadata or {}, matches[chunk_id])
+                                                 for chunk_id, metadata in zip(canonical_ids, stored["metadatas"])])
+                print(f"{sum(len(copies) for copies in matches.values())} chunks of {file_name} "
+                      f"are already indexed, credited to the existing copies")
+        
+        # Embed and store in batches so progress can be reported as it happens
+        print(f"Adding {len(documents)} chunks from {file_name} to vector store")
+        for start in range(0, len(documents), INGEST_BATCH_SIZE):
+            end = start + INGEST_BATCH_SIZE
+            report("Embedding and indexing", start / len(documents))
+            add_texts(documents[start:end], metadatas=metadatas[start:end], ids=ids[start:end])
+        report("Embedding and indexing", 1.0)
+        
+        if signature_index is not None and documents:
+            signature_index.add(ids, documents)
+            signature_index.save()
+        
+        print(f"Vector store updated with new document: {file_name}")
+        return True
             
     except Exception as e:
         print(f"Error adding document to store: {str(e)}")